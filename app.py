@@ -1,75 +1,69 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Blueprint, Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask.sessions import SecureCookieSessionInterface
 from flask_cors import CORS
-import sqlite3
+from itsdangerous import URLSafeTimedSerializer
+import importlib
 import hashlib
-import secrets
 from datetime import datetime, timedelta
-import requests
 import json
 import time
 import random
 import socket
 from urllib.parse import urlparse
 import os
+import threading
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
-CORS(app)
+from core.audit_log import audit_log_metrics
+from core.auth_cache import auth_cache_metrics
+from core.database import get_connection, pool_metrics
+from core.geoip import geoip_metrics
+from core.migrations import ensure_schema
+from core.scheduler import scheduler_metrics
+from core.session_tokens import session_token_metrics
+from core.token_filter import token_filter, token_filter_metrics
+from core.signing_keys import keyring_metrics, purpose_keys
+from core.startup import on_startup, run_startup_hooks, startup_metrics
 
-# Database setup
+# Which blueprints this process serves (comma-separated APP_FEATURES), and where
+APP_CONFIG = {
+    'features': os.environ.get('APP_FEATURES', 'investigation,access_control,country_access,trials'),
+    'url_prefixes': {
+        # Country access repeats the tenant dashboard/API routes, so it gets its own prefix
+        'country_access': os.environ.get('COUNTRY_ACCESS_PREFIX', '/country')
+    },
+    'cors_origins': os.environ.get('CORS_ORIGINS', '*')
+}
+
+# feature -> module defining `bp` (and optionally health_metrics()); imported only when enabled
+FEATURE_MODULES = {
+    'investigation': __name__,
+    'access_control': 'access_control_system',
+    'country_access': 'country_access_control',
+    'trials': 'trial_management_system'
+}
+
+# Blueprints shared by several features -> the features that need them; registered once, unprefixed
+SHARED_MODULES = {
+    'audit_api': ('access_control', 'country_access')
+}
+
+bp = Blueprint('investigation', __name__)
+
+# Database setup (visitors and users tables live in the shared schema)
+@on_startup
 def init_db():
-    conn = sqlite3.connect('visitors.db')
-    c = conn.cursor()
-    
-    # Create visitors table with comprehensive fields
-    c.execute('''CREATE TABLE IF NOT EXISTS visitors (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        website_url TEXT,
-        ip_address TEXT,
-        name TEXT,
-        email TEXT,
-        phone TEXT,
-        company TEXT,
-        title TEXT,
-        industry TEXT,
-        location TEXT,
-        country TEXT,
-        region TEXT,
-        city TEXT,
-        device TEXT,
-        browser TEXT,
-        current_page TEXT,
-        pages_visited TEXT,
-        duration INTEGER,
-        interest_level TEXT,
-        referral_source TEXT,
-        session_count INTEGER,
-        total_page_views INTEGER,
-        last_activity TIMESTAMP,
-        first_visit TIMESTAMP,
-        investigation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Create users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password_hash TEXT,
-        role TEXT DEFAULT 'user',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Create admin user if not exists
-    admin_password = hashlib.sha256('admin123'.encode()).hexdigest()
-    c.execute('INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?, ?, ?)',
-              ('admin', admin_password, 'admin'))
-    
-    conn.commit()
-    conn.close()
+    ensure_schema()
+
+# Load every access token into this worker's front-door filter before serving
+@on_startup
+def build_token_filter():
+    if token_filter.config['enabled']:
+        token_filter.rebuild()
 
 # Real visitor tracking integration
 class RealVisitorTracker:
     def __init__(self):
+        import requests  # only the investigation path needs it; keeps worker boot light
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -138,7 +132,7 @@ class RealVisitorTracker:
         """Get real visitor details using IP geolocation and data enrichment"""
         try:
             # Use real IP geolocation API
-            geo_response = requests.get(f"http://ip-api.com/json/{ip_address}", timeout=5)
+            geo_response = self.session.get(f"http://ip-api.com/json/{ip_address}", timeout=5)
             
             if geo_response.status_code == 200:
                 geo_data = geo_response.json()
@@ -377,56 +371,61 @@ class RealVisitorTracker:
             'referral_source': referral_source
         }
 
-# Initialize database
-init_db()
+# Real visitor tracker, created on the first investigation
+_real_tracker = None
+_tracker_lock = threading.Lock()
 
-# Initialize real visitor tracker
-real_tracker = RealVisitorTracker()
+def get_real_tracker():
+    global _real_tracker
+    if _real_tracker is None:
+        with _tracker_lock:
+            if _real_tracker is None:
+                _real_tracker = RealVisitorTracker()
+    return _real_tracker
 
 # Serve logo files from root directory
-@app.route('/logo.png')
+@bp.route('/logo.png')
 def serve_logo():
     return send_file('logo.png', mimetype='image/png')
 
-@app.route('/favicon.png')
+@bp.route('/favicon.png')
 def serve_favicon():
     return send_file('favicon.png', mimetype='image/png')
 
-@app.route('/')
+@bp.route('/')
 def index():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('investigation.login'))
     return render_template('dashboard.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         password_hash = hashlib.sha256(password.encode()).hexdigest()
         
-        conn = sqlite3.connect('visitors.db')
-        c = conn.cursor()
-        c.execute('SELECT id, role FROM users WHERE username = ? AND password_hash = ?',
-                  (username, password_hash))
-        user = c.fetchone()
-        conn.close()
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT id, role FROM users WHERE username = ? AND password_hash = ?',
+                      (username, password_hash))
+            user = c.fetchone()
         
         if user:
             session['user_id'] = user[0]
             session['role'] = user[1]
-            return redirect(url_for('index'))
+            return redirect(url_for('investigation.index'))
         else:
             return render_template('login.html', error='Invalid credentials')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('investigation.login'))
 
-@app.route('/api/investigate', methods=['POST'])
+@bp.route('/api/investigate', methods=['POST'])
 def investigate():
     if 'user_id' not in session:
         return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
@@ -439,39 +438,30 @@ def investigate():
         if not website_url:
             return jsonify({'status': 'error', 'message': 'Website URL is required'})
         
-        # Clear previous investigation data
-        conn = sqlite3.connect('visitors.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM visitors')
-        conn.commit()
-        
         print(f"Starting real investigation for: {website_url}")
         
-        # Get real visitor data using the tracker
-        real_visitors = real_tracker.get_website_analytics(website_url)
+        # Get real visitor data using the tracker (no pooled connection held during lookups)
+        real_visitors = get_real_tracker().get_website_analytics(website_url)
         
-        # Store real visitor data in database
-        for visitor in real_visitors:
-            visitor['website_url'] = website_url
-            
-            c.execute('''INSERT INTO visitors (
+        # Replace the previous investigation data in one transaction
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute('DELETE FROM visitors')
+            c.executemany('''INSERT INTO visitors (
                 website_url, ip_address, name, email, phone, company, title, industry,
                 location, country, region, city, device, browser, current_page,
                 pages_visited, duration, interest_level, referral_source,
                 session_count, total_page_views, last_activity, first_visit
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (
-                visitor['website_url'], visitor['ip_address'], visitor['name'],
+            [(
+                website_url, visitor['ip_address'], visitor['name'],
                 visitor['email'], visitor['phone'], visitor['company'], visitor['title'],
                 visitor['industry'], visitor['location'], visitor['country'],
                 visitor['region'], visitor['city'], visitor['device'], visitor['browser'],
                 visitor['current_page'], visitor['pages_visited'], visitor['duration'],
                 visitor['interest_level'], visitor['referral_source'], visitor['session_count'],
                 visitor['total_page_views'], visitor['last_activity'], visitor['first_visit']
-            ))
-        
-        conn.commit()
-        conn.close()
+            ) for visitor in real_visitors])
         
         print(f"Investigation complete. Found {len(real_visitors)} real visitors.")
         
@@ -485,18 +475,19 @@ def investigate():
         print(f"Investigation error: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
-@app.route('/api/visitors')
+@bp.route('/api/visitors')
 def get_visitors():
     if 'user_id' not in session:
         return jsonify([]), 401
     
     try:
-        conn = sqlite3.connect('visitors.db')
-        c = conn.cursor()
-        c.execute('''SELECT * FROM visitors ORDER BY investigation_timestamp DESC LIMIT 20''')
+        with get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT * FROM visitors ORDER BY investigation_timestamp DESC LIMIT 20''')
+            rows = c.fetchall()
         
         visitors = []
-        for row in c.fetchall():
+        for row in rows:
             visitor = {
                 'id': row[0],
                 'website_url': row[1],
@@ -525,13 +516,78 @@ def get_visitors():
             }
             visitors.append(visitor)
         
-        conn.close()
         return jsonify(visitors)
         
     except Exception as e:
         print(f"Error fetching visitors: {e}")
         return jsonify([])
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+def enabled_features(config):
+    features = config['features']
+    if isinstance(features, str):
+        features = [name.strip() for name in features.split(',') if name.strip()]
+    unknown = [name for name in features if name not in FEATURE_MODULES]
+    if unknown:
+        raise ValueError(f"Unknown APP_FEATURES: {', '.join(unknown)}")
+    return features
+
+class KeyringSessionInterface(SecureCookieSessionInterface):
+    """Session cookies signed with the shared keyring: valid on every worker and node,
+    and still readable after a key rotation (itsdangerous signs with the last key
+    in the list and verifies with all of them)"""
+
+    def get_signing_serializer(self, app):
+        keys = purpose_keys('flask-session')
+        return URLSafeTimedSerializer(
+            list(reversed(keys)),
+            salt=self.salt,
+            serializer=self.serializer,
+            signer_kwargs={'key_derivation': self.key_derivation, 'digest_method': self.digest_method}
+        )
+
+def create_app(config=None):
+    """Application factory: one app serving the enabled feature blueprints.
+
+    Every blueprint in the process shares the same connection pool, auth cache,
+    geo resolver and scheduler; startup hooks run once for this process.
+    """
+    config = dict(APP_CONFIG, **(config or {}))
+    features = enabled_features(config)
+    app = Flask(__name__)
+    app.session_interface = KeyringSessionInterface()
+    CORS(app, origins=config['cors_origins'])
 
+    modules = {}
+    for feature in features:
+        modules[feature] = importlib.import_module(FEATURE_MODULES[feature])
+        app.register_blueprint(modules[feature].bp, url_prefix=config['url_prefixes'].get(feature))
+    for module_name, needed_by in SHARED_MODULES.items():
+        if any(feature in features for feature in needed_by):
+            app.register_blueprint(importlib.import_module(module_name).bp)
+
+    @app.context_processor
+    def registered_blueprints():
+        """Lets pages shared by several features link only to the blueprints this app serves"""
+        return {'blueprints': app.blueprints}
+
+    @app.route('/health')
+    def health_check():
+        """Health check endpoint (read-only - maintenance runs from the scheduler)"""
+        health = {'status': 'healthy', 'timestamp': datetime.now().isoformat(), 'features': features,
+                  'db_pool': pool_metrics(), 'auth_cache': auth_cache_metrics(), 'geoip': geoip_metrics(),
+                  'session_tokens': session_token_metrics(), 'signing_keys': keyring_metrics(),
+                  'token_filter': token_filter_metrics(),
+                  'audit_log': audit_log_metrics(),
+                  'scheduler': scheduler_metrics(), 'startup': startup_metrics()}
+        for module in modules.values():
+            if hasattr(module, 'health_metrics'):
+                health.update(module.health_metrics())
+        return jsonify(health)
+
+    run_startup_hooks()
+    # Loaded after the hooks so the generated-key fallback finds its table
+    app.secret_key = purpose_keys('flask-secret')[0]
+    return app
+
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
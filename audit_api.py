@@ -0,0 +1,108 @@
+"""
+Tenant Audit API
+Access log pages and streamed exports shared by the access control and country
+access dashboards; registered once by the app factory for either feature
+"""
+
+from flask import Blueprint, request, jsonify, Response
+from datetime import datetime
+from core.database import get_connection
+from core.audit_query import parse_log_query, fetch_access_logs, resolve_user_names, columnar_page
+from core.exports import iter_audit_rows, iter_session_rows, stream_export
+from core.authorization import log_access, authorize_request, has_permission
+from core.session_tokens import SESSION_TOKEN_CONFIG
+from core.country_policy import COUNTRIES
+
+bp = Blueprint('audit_api', __name__)
+
+# Every partition holds the country columns, whichever service wrote the row
+AUDIT_LOG_COLUMNS = ['user_id', 'action', 'resource', 'ip_address', 'country_code', 'is_vpn', 'success', 'details']
+
+SESSION_EXPORT_COLUMNS = ['session_id', 'user_id', 'ip_address', 'country_code', 'is_vpn', 'user_agent',
+                          'created_at', 'last_activity', 'expires_at', 'is_active']
+
+@bp.route('/api/access-logs/<access_token>')
+def get_access_logs(access_token):
+    """Get a page of access logs with country information (filters and cursor in the query string)"""
+    ip_address = request.remote_addr
+    user_data = authorize_request(access_token, ip_address, request.headers.get(SESSION_TOKEN_CONFIG['header']),
+                                  resolve_country=False)
+
+    if not user_data:
+        return jsonify({'error': 'Access denied'}), 403
+
+    if not has_permission(user_data, 'view_audit_logs'):
+        return jsonify({'error': 'Permission denied - cannot view audit logs'}), 403
+
+    try:
+        log_query = parse_log_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        rows, next_cursor = fetch_access_logs(cursor, user_data['client_id'], AUDIT_LOG_COLUMNS, **log_query)
+        users = resolve_user_names(cursor, (row[2] for row in rows))
+
+    if request.args.get('format') == 'columnar':
+        country_names = {row[6]: COUNTRIES.get(row[6], row[6]) for row in rows if row[6]}
+        return jsonify(columnar_page(['timestamp', 'id'] + AUDIT_LOG_COLUMNS, rows, users, next_cursor,
+                                     countries=country_names))
+
+    logs = []
+    for row in rows:
+        name, email = users.get(row[2], (None, None))
+        country_name = COUNTRIES.get(row[6], row[6]) if row[6] else 'Unknown'
+        logs.append({
+            'id': row[1],
+            'timestamp': row[0],
+            'user_name': name or 'Unknown',
+            'user_email': email or 'Unknown',
+            'action': row[3],
+            'resource': row[4],
+            'ip_address': row[5],
+            'country_code': row[6],
+            'country_name': country_name,
+            'is_vpn': bool(row[7]),
+            'success': bool(row[8]),
+            'details': row[9]
+        })
+    return jsonify({'logs': logs, 'next_cursor': next_cursor})
+
+@bp.route('/api/export/<access_token>/<dataset>')
+def export_data(access_token, dataset):
+    """Stream audit logs or session history as CSV or XLSX (?format=csv|xlsx)"""
+    ip_address = request.remote_addr
+    user_data = authorize_request(access_token, ip_address, request.headers.get(SESSION_TOKEN_CONFIG['header']),
+                                  resolve_country=False)
+
+    if not user_data:
+        return jsonify({'error': 'Access denied'}), 403
+
+    if not has_permission(user_data, 'export_data'):
+        return jsonify({'error': 'Permission denied - cannot export data'}), 403
+
+    client_id = user_data['client_id']
+    if dataset == 'audit-logs':
+        try:
+            filters = parse_log_query(request.args)['filters']
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        header = ['timestamp', 'user_name', 'user_email'] + AUDIT_LOG_COLUMNS[1:]
+        rows = iter_audit_rows(client_id, header[3:], filters)
+    elif dataset == 'sessions':
+        header = SESSION_EXPORT_COLUMNS
+        rows = iter_session_rows(client_id, SESSION_EXPORT_COLUMNS)
+    else:
+        return jsonify({'error': 'Unknown export - use audit-logs or sessions'}), 404
+
+    try:
+        body, mimetype, extension = stream_export(request.args.get('format', 'csv').lower(), header, rows, dataset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    log_access(user_data['user_id'], client_id, f'export_{dataset}', ip_address=ip_address)
+
+    filename = f"{dataset}_{client_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
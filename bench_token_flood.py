@@ -0,0 +1,122 @@
+"""
+Unknown-Token Flood Benchmark
+Times verify_user_access on random access tokens (a scanner hammering
+/dashboard/<token>) with the front-door filter on and off, against a
+temporary database, and checks real tokens are still accepted.
+
+Usage: python bench_token_flood.py [users] [requests] [threads]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+FLOOD_TARGETS = {
+    'filtered_us_per_request': 50,  # rejection cost with the filter on
+    'db_reads_per_1000': 5          # pool checkouts per 1000 unknown tokens with the filter on
+}
+
+def seed_users(count):
+    from core.database import get_connection
+    from core.ids import generate_access_token
+
+    tokens = [generate_access_token() for _ in range(count)]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO clients (client_id, business_name, contact_email, website_url, access_token,
+                                 subscription_status)
+            VALUES ('bench_client', 'Bench', 'bench@example.com', 'https://example.com', 'bench_client_token',
+                    'active')
+        ''')
+        cursor.executemany('''
+            INSERT INTO client_users (user_id, client_id, name, email, role, access_token, permissions,
+                                      session_limit)
+            VALUES (?, 'bench_client', 'Bench User', 'bench@example.com', 'viewer', ?, '{}', 1000)
+        ''', [(f'bench_user_{i}', token) for i, token in enumerate(tokens)])
+    return tokens
+
+def flood(tokens, threads):
+    """Verify every token across `threads` threads; returns (seconds, accepted count)"""
+    from core.authorization import verify_user_access
+
+    accepted = [0] * threads
+    chunks = [tokens[i::threads] for i in range(threads)]
+
+    def run(index):
+        for token in chunks[index]:
+            if verify_user_access(token) is not None:
+                accepted[index] += 1
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, sum(accepted)
+
+def pool_checkouts():
+    from core.database import pool_metrics
+    stats = pool_metrics()
+    return stats['hits'] + stats['misses']
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    workdir = tempfile.mkdtemp()
+    os.environ['CLIENT_DB_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['SCHEDULER_ENABLED'] = '0'
+
+    from core.audit_log import audit_log_metrics
+    from core.ids import generate_access_token
+    from core.migrations import ensure_schema
+    from core.token_filter import token_filter
+
+    ensure_schema()
+    valid = seed_users(users)
+    unknown = [generate_access_token() for _ in range(requests)]
+    print(f"{users} users, {requests} unknown tokens, {threads} threads")
+
+    results = {}
+    for label, enabled in (('unfiltered', False), ('filtered', True)):
+        token_filter.config = dict(token_filter.config, enabled=enabled)
+        if enabled:
+            token_filter.rebuild()
+            print(f"  filter built in {token_filter.metrics['last_rebuild_ms']} ms: "
+                  f"{token_filter.stats()['bits'] // 8 // 1024} KB, {token_filter.stats()['hashes']} hashes")
+        before = pool_checkouts()
+        seconds, accepted = flood(unknown, threads)
+        reads = pool_checkouts() - before
+        results[label] = {
+            'us_per_request': round(seconds / requests * 1e6, 2),
+            'requests_per_second': round(requests / seconds),
+            'db_reads_per_1000': round(reads / requests * 1000, 2),
+            'accepted': accepted
+        }
+        print(f"  {label:>10}: {results[label]}")
+
+    seconds, accepted = flood(valid[:1000], threads)
+    print(f"  valid tokens still accepted: {accepted}/1000")
+    print(f"  filter: {token_filter.stats()}")
+    print(f"  audit log: {audit_log_metrics()}")
+
+    checks = {
+        'filtered_us_per_request': results['filtered']['us_per_request'],
+        'db_reads_per_1000': results['filtered']['db_reads_per_1000']
+    }
+    failed = [name for name, target in FLOOD_TARGETS.items() if checks[name] > target]
+    failed += ['false_rejects'] if accepted != 1000 else []
+    failed += ['unknown_accepted'] if any(result['accepted'] for result in results.values()) else []
+    for name, target in FLOOD_TARGETS.items():
+        print(f"{name}: {checks[name]} (target {target}) {'FAIL' if name in failed else 'ok'}")
+    if results['filtered']['us_per_request']:
+        print(f"speedup: {results['unfiltered']['us_per_request'] / results['filtered']['us_per_request']:.1f}x")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Shared core for the Visitor Investigation System services
+Side-effect-free building blocks used by every Flask service module
+"""
@@ -0,0 +1,216 @@
+"""
+Audit Log Writer
+Background, group-committing writer for access_logs rows (routed to monthly partitions)
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from core.database import get_connection
+from core.log_partitions import ensure_partition, partition_month
+
+AUDIT_LOG_CONFIG = {
+    'mode': os.environ.get('AUDIT_LOG_MODE', 'async'),  # 'async' or 'sync' (tests, scripts)
+    'batch_size': int(os.environ.get('AUDIT_LOG_BATCH_SIZE', '200')),
+    'flush_interval': float(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL', '0.5')),  # seconds
+    'max_queue': int(os.environ.get('AUDIT_LOG_MAX_QUEUE', '10000')),
+    # What to do when the queue is full: 'sync' (write inline), 'block', 'drop_newest', 'drop_oldest'
+    'overflow_policy': os.environ.get('AUDIT_LOG_OVERFLOW', 'sync')
+}
+
+def write_entries(entries):
+    """Insert access log entries in one transaction, batching rows by month partition and columns"""
+    groups = {}
+    for entry in entries:
+        month = partition_month(entry.get('timestamp') or datetime.utcnow())
+        groups.setdefault((month, tuple(entry)), []).append(tuple(entry.values()))
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for (month, columns), rows in groups.items():
+            table = ensure_partition(cursor, month)
+            placeholders = ', '.join('?' for _ in columns)
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+class AuditLogWriter:
+    """In-process audit queue drained by a daemon thread in size/time-bounded batches"""
+
+    def __init__(self, batch_size=200, flush_interval=0.5, max_queue=10000, overflow_policy='sync'):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._stopping = False
+        self._thread = None
+        self.metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'dropped': 0,
+            'overflow_sync_writes': 0,
+            'failed': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_write_ms': 0.0,
+            'total_write_ms': 0.0
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, entry):
+        """Queue an entry, applying the overflow policy when the queue is full"""
+        with self._cond:
+            if self.overflow_policy == 'block':
+                while len(self._queue) >= self.max_queue and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+
+            if self._stopping:
+                # The writer is draining or gone: write inline, never queue past it or the bound
+                self.metrics['overflow_sync_writes'] += 1
+                overflow_entry, entry = entry, None
+            elif len(self._queue) >= self.max_queue:
+                if self.overflow_policy == 'drop_newest':
+                    self.metrics['dropped'] += 1
+                    return
+                elif self.overflow_policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self.metrics['dropped'] += 1
+                else:
+                    self.metrics['overflow_sync_writes'] += 1
+                    overflow_entry, entry = entry, None
+
+            if entry is not None:
+                self._queue.append(entry)
+                self.metrics['enqueued'] += 1
+                depth = len(self._queue)
+                if depth > self.metrics['max_queue_depth']:
+                    self.metrics['max_queue_depth'] = depth
+                if depth >= self.batch_size:
+                    self._cond.notify_all()
+                return
+
+        # Queue full under the 'sync' policy, or shutting down - fall back to a direct write
+        write_entries([overflow_entry])
+
+    def _take_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._in_flight = len(batch)
+            self._cond.notify_all()  # wake producers blocked on a full queue
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                started = time.perf_counter()
+                try:
+                    write_entries(batch)
+                    written = len(batch)
+                except Exception as e:
+                    print(f"Error writing audit log batch: {e}")
+                    written = 0
+                    self.metrics['failed'] += len(batch)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with self._cond:
+                    self._in_flight = 0
+                    self.metrics['written'] += written
+                    self.metrics['batches'] += 1
+                    self.metrics['last_batch_size'] = len(batch)
+                    self.metrics['last_write_ms'] = elapsed_ms
+                    self.metrics['total_write_ms'] += elapsed_ms
+                    self._cond.notify_all()
+            with self._cond:
+                if self._stopping and not self._queue:
+                    self._cond.notify_all()
+                    return
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been written"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._queue or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self._cond.wait(min(remaining, self.flush_interval))
+        return True
+
+    def shutdown(self, timeout=5.0):
+        """Stop the writer after draining the queue"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Anything left (writer never started or timed out) is written inline
+        with self._cond:
+            leftover = list(self._queue)
+            self._queue.clear()
+        if leftover:
+            write_entries(leftover)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.metrics)
+            stats['queue_depth'] = len(self._queue)
+        stats['avg_write_ms'] = stats['total_write_ms'] / stats['batches'] if stats['batches'] else 0.0
+        stats['mode'] = AUDIT_LOG_CONFIG['mode']
+        return stats
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Get this worker's audit log writer, starting its thread on first use"""
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = AuditLogWriter(AUDIT_LOG_CONFIG['batch_size'], AUDIT_LOG_CONFIG['flush_interval'],
+                                         AUDIT_LOG_CONFIG['max_queue'], AUDIT_LOG_CONFIG['overflow_policy'])
+                _writer_pid = pid
+                _writer.start()
+                atexit.register(_writer.shutdown)
+    return _writer
+
+def record_access(entry):
+    """Record one access_logs row (a column -> value dict)"""
+    # Stamp the event time now; an async write may land a little later
+    entry.setdefault('timestamp', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+    if AUDIT_LOG_CONFIG['mode'] == 'sync':
+        write_entries([entry])
+    else:
+        get_writer().submit(entry)
+
+def flush_audit_log(timeout=5.0):
+    """Block until queued audit entries are written (no-op in sync mode)"""
+    if _writer is None or _writer_pid != os.getpid():
+        return True
+    return _writer.flush(timeout)
+
+def audit_log_metrics():
+    """Queue depth and write latency counters for this worker"""
+    if _writer is None or _writer_pid != os.getpid():
+        return {'mode': AUDIT_LOG_CONFIG['mode'], 'queue_depth': 0}
+    return _writer.stats()
@@ -0,0 +1,148 @@
+"""
+Audit Log Queries
+Filtered, keyset-paginated reads over the monthly access log partitions
+"""
+
+import base64
+from datetime import datetime
+
+from core.log_partitions import query_recent_logs
+
+AUDIT_QUERY_CONFIG = {
+    'default_limit': 100,
+    'max_limit': 500
+}
+
+# Equality filters accepted from the query string (each backed by a client-scoped index)
+FILTER_COLUMNS = ['action', 'user_id', 'country_code', 'success']
+
+BOOLEAN_COLUMNS = ('success', 'is_vpn')
+
+def encode_cursor(timestamp, row_id):
+    """Opaque page cursor for the last row of a page"""
+    return base64.urlsafe_b64encode(f'{timestamp}|{row_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Page cursor -> (timestamp, id); raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def _parse_time(value, name):
+    try:
+        return datetime.fromisoformat(value.strip().replace('Z', '')).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise ValueError(f'Invalid {name} - use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS')
+
+def parse_log_query(args):
+    """Build fetch_access_logs keyword arguments from request query parameters.
+
+    Supports action, user_id, country_code, success, since (inclusive),
+    until (exclusive), limit and cursor. Raises ValueError on bad input.
+    """
+    filters = {}
+    for name in ('action', 'user_id', 'country_code'):
+        value = (args.get(name) or '').strip()
+        if value:
+            filters[name] = value.upper() if name == 'country_code' else value
+
+    success = (args.get('success') or '').strip().lower()
+    if success:
+        if success in ('1', 'true', 'yes'):
+            filters['success'] = 1
+        elif success in ('0', 'false', 'no'):
+            filters['success'] = 0
+        else:
+            raise ValueError('Invalid success filter - use true or false')
+
+    for name in ('since', 'until'):
+        if args.get(name):
+            filters[name] = _parse_time(args.get(name), name)
+
+    try:
+        limit = int(args.get('limit') or AUDIT_QUERY_CONFIG['default_limit'])
+    except ValueError:
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, AUDIT_QUERY_CONFIG['max_limit']))
+
+    after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    return {'filters': filters, 'limit': limit, 'after': after}
+
+def fetch_access_logs(cursor, client_id, columns, filters=None, limit=100, after=None):
+    """Fetch one page of a client's logs, newest first.
+
+    Rows are (timestamp, id, *columns). Returns (rows, next_cursor), where
+    next_cursor is None on the last page.
+    """
+    filters = filters or {}
+    where = ['client_id = ?']
+    params = [client_id]
+    for column in FILTER_COLUMNS:
+        if column in filters:
+            where.append(f'{column} = ?')
+            params.append(filters[column])
+
+    since = filters.get('since')
+    until = filters.get('until')
+    if since:
+        where.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        where.append('timestamp < ?')
+        params.append(until)
+
+    # Keyset: continue strictly after the last (timestamp, id) already returned
+    newest = until
+    if after:
+        after_timestamp, after_id = after
+        where.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+        params.extend([after_timestamp, after_timestamp, after_id])
+        newest = min(until, after_timestamp) if until else after_timestamp
+
+    query = f'''
+        SELECT timestamp, id, {', '.join(columns)} FROM {{table}}
+        WHERE {' AND '.join(where)}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    '''
+    rows = query_recent_logs(cursor, query, params, limit + 1, since, newest)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+    return rows, next_cursor
+
+def resolve_user_names(cursor, user_ids):
+    """Map user_id -> (name, email) for the users on one page, in a single query"""
+    user_ids = [user_id for user_id in set(user_ids) if user_id]
+    if not user_ids:
+        return {}
+    cursor.execute(f'''
+        SELECT user_id, name, email FROM client_users
+        WHERE user_id IN ({', '.join('?' for _ in user_ids)})
+    ''', user_ids)
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+def columnar_page(columns, rows, users, next_cursor, **lookups):
+    """Compact response: column names once, rows as arrays, users and other lookups by key"""
+    bool_indexes = [i for i, column in enumerate(columns) if column in BOOLEAN_COLUMNS]
+    data = []
+    for row in rows:
+        row = list(row)
+        for i in bool_indexes:
+            row[i] = bool(row[i])
+        data.append(row)
+
+    page = {
+        'format': 'columnar',
+        'columns': list(columns),
+        'rows': data,
+        'users': {user_id: {'name': name, 'email': email} for user_id, (name, email) in users.items()},
+        'next_cursor': next_cursor
+    }
+    page.update(lookups)
+    return page
@@ -0,0 +1,123 @@
+"""
+Authorization Record Cache
+Short-TTL in-process cache of decoded user/client records keyed by access token
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+AUTH_CACHE_CONFIG = {
+    'ttl_seconds': float(os.environ.get('AUTH_CACHE_TTL', '30')),
+    'max_entries': int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', '10000'))
+}
+
+# Every cache created in this process, so invalidations reach all of them
+_caches = []
+
+class AuthCache:
+    """LRU cache of authorization records with per-entry expiry"""
+
+    def __init__(self, name, ttl_seconds=None, max_entries=None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else AUTH_CACHE_CONFIG['ttl_seconds']
+        self.max_entries = max_entries if max_entries is not None else AUTH_CACHE_CONFIG['max_entries']
+        self._entries = OrderedDict()  # access_token -> (expires, record, extras)
+        self._by_user = {}  # user_id -> access_token
+        self._by_client = {}  # client_id -> set of access_tokens
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidations': 0}
+        _caches.append(self)
+
+    def get(self, access_token):
+        """Return (record, extras) for a live entry, or None"""
+        with self._lock:
+            entry = self._entries.get(access_token)
+            if entry is None:
+                self.metrics['misses'] += 1
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(access_token)
+                self.metrics['expired'] += 1
+                self.metrics['misses'] += 1
+                return None
+            self._entries.move_to_end(access_token)
+            self.metrics['hits'] += 1
+            return entry[1], entry[2]
+
+    def put(self, access_token, record, **extras):
+        """Cache a decoded record; extras hold derived data that must not be serialized"""
+        with self._lock:
+            if access_token in self._entries:
+                self._remove(access_token)
+            self._entries[access_token] = (time.monotonic() + self.ttl_seconds, record, extras)
+            self._by_user[record['user_id']] = access_token
+            self._by_client.setdefault(record['client_id'], set()).add(access_token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, access_token):
+        _, record, _ = self._entries.pop(access_token)
+        if self._by_user.get(record['user_id']) == access_token:
+            del self._by_user[record['user_id']]
+        tokens = self._by_client.get(record['client_id'])
+        if tokens:
+            tokens.discard(access_token)
+            if not tokens:
+                del self._by_client[record['client_id']]
+
+    def invalidate_token(self, access_token):
+        with self._lock:
+            if access_token in self._entries:
+                self._remove(access_token)
+                self.metrics['invalidations'] += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            access_token = self._by_user.get(user_id)
+            if access_token is not None:
+                self._remove(access_token)
+                self.metrics['invalidations'] += 1
+
+    def invalidate_client(self, client_id):
+        with self._lock:
+            for access_token in list(self._by_client.get(client_id, ())):
+                self._remove(access_token)
+                self.metrics['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._by_client.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._entries)
+        return stats
+
+def register_cache(cache):
+    """Include another token-keyed cache (name, invalidate_*, stats) in the helpers below"""
+    _caches.append(cache)
+
+# Invalidation helpers - call these whenever user or client state changes
+def invalidate_token(access_token):
+    """Drop a cached record by access token"""
+    for cache in _caches:
+        cache.invalidate_token(access_token)
+
+def invalidate_user(user_id):
+    """Drop the cached record of a single user"""
+    for cache in _caches:
+        cache.invalidate_user(user_id)
+
+def invalidate_client(client_id):
+    """Drop the cached records of every user of a client"""
+    for cache in _caches:
+        cache.invalidate_client(client_id)
+
+def auth_cache_metrics():
+    """Hit/miss counters for every auth cache in this process"""
+    return {cache.name: cache.stats() for cache in _caches}
@@ -0,0 +1,333 @@
+"""
+Tenant Authorization
+Single-query verification of dashboard access tokens: user and client status,
+trial expiry, IP allowlists, country and VPN policy, session limits and role
+permissions. One auth cache per process, shared by every blueprint. API calls
+carrying a signed session token are authorized from its claims without the DB.
+"""
+
+import json
+from datetime import datetime
+
+from core.audit_log import record_access
+from core.auth_cache import AuthCache
+from core.country_policy import COUNTRIES, compile_country_policy_json
+from core.database import get_connection
+from core.geoip import lookup_ip
+from core.ip_matcher import compile_allowlist
+from core.session_tokens import (PERMISSION_BITS, compile_permission_mask, decode_session_token,
+                                 issue_session_token, token_fingerprint)
+from core.sessions import session_now
+from core.token_filter import token_filter
+
+# Decoded user/client records for verify_user_access, keyed by access token
+auth_cache = AuthCache('authorization')
+
+# User fields echoed back by API routes (all of them are carried in session tokens)
+USER_PAYLOAD_FIELDS = ['user_id', 'client_id', 'name', 'email', 'business_name', 'role', 'current_country',
+                       'current_country_name', 'is_vpn']
+
+def log_access(user_id, client_id, action, resource=None, ip_address=None, country_code=None, 
+               is_vpn=False, user_agent=None, success=True, details=None):
+    """Log user access for audit trail with country information (written in batches)"""
+    record_access({
+        'user_id': user_id,
+        'client_id': client_id,
+        'action': action,
+        'resource': resource,
+        'ip_address': ip_address,
+        'country_code': country_code,
+        'is_vpn': is_vpn,
+        'user_agent': user_agent,
+        'success': success,
+        'details': details
+    })
+
+def check_ip_restriction(ip_matcher, client_ip):
+    """Check if client IP is allowed by the user's compiled allowlist"""
+    if ip_matcher is None:
+        return True  # No IP restrictions
+    
+    return ip_matcher.matches(client_ip)
+
+def check_country_restriction(country_policy, country_code):
+    """Check if a country is allowed by the user's compiled country policy"""
+    if country_policy is None:
+        return True  # No country restrictions
+    
+    return country_policy.allows(country_code)
+
+def count_active_sessions(user_id):
+    """Count a user's unexpired active sessions"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT COUNT(*) FROM user_sessions 
+            WHERE user_id = ? AND is_active = 1 AND expires_at > ?
+        ''', (user_id, session_now()))
+        
+        return cursor.fetchone()[0]
+
+def check_session_limit(user_id, session_limit, active_sessions=None):
+    """Check if user has exceeded session limit"""
+    if active_sessions is None:
+        active_sessions = count_active_sessions(user_id)
+    
+    return active_sessions >= session_limit
+
+def load_user_record(access_token):
+    """Load the decoded user/client record for a token, with its active session count.
+
+    Served from the auth cache when possible; otherwise a single query
+    fetches the record, trial state and session count together. Expired
+    trials are rejected in SQL (and by a string comparison on cache hits).
+    Tokens the front-door filter has never seen are rejected without SQL.
+    """
+    now = datetime.now().isoformat()
+    cached = auth_cache.get(access_token)
+    if cached:
+        record, extras = cached
+        if record['is_trial'] and record['trial_end_time'] and record['trial_end_time'] <= now:
+            auth_cache.invalidate_token(access_token)
+            return None
+        return record, extras, count_active_sessions(record['user_id'])
+    
+    if not token_filter.might_exist(access_token):
+        return None
+    
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT cu.user_id, cu.client_id, cu.name, cu.email, cu.role, cu.status,
+                   cu.access_expires_at, cu.country_restrictions, cu.block_vpn, cu.permissions, 
+                   cu.session_limit, c.business_name, c.website_url, c.subscription_status, c.plan_type,
+                   (SELECT COUNT(*) FROM user_sessions us
+                    WHERE us.user_id = cu.user_id AND us.is_active = 1
+                    AND us.expires_at > ?) AS active_sessions,
+                   c.account_type, c.trial_end_time, cu.allowed_ips
+            FROM client_users cu
+            JOIN clients c ON cu.client_id = c.client_id
+            WHERE cu.access_token = ? AND cu.status = 'active'
+            AND (c.subscription_status = 'active'
+                 OR (c.subscription_status = 'trial' AND c.account_type = 'trial'
+                     AND (c.trial_end_time IS NULL OR c.trial_end_time > ?)))
+        ''', (session_now(), access_token, now))
+        
+        result = cursor.fetchone()
+    
+    if not result:
+        token_filter.record_miss(access_token)
+        return None
+    
+    record = {
+        'user_id': result[0],
+        'client_id': result[1],
+        'name': result[2],
+        'email': result[3],
+        'role': result[4],
+        'status': result[5],
+        'access_expires_at': result[6],
+        'country_restrictions': json.loads(result[7]) if result[7] else {},
+        'block_vpn': bool(result[8]),
+        'permissions': json.loads(result[9]) if result[9] else {},
+        'session_limit': result[10],
+        'business_name': result[11],
+        'website_url': result[12],
+        'subscription_status': result[13],
+        'plan_type': result[14],
+        'account_type': result[16] or 'full',
+        'is_trial': result[16] == 'trial',
+        'trial_end_time': result[17] if result[16] == 'trial' else None,
+        'allowed_ips': json.loads(result[18]) if result[18] else []
+    }
+    extras = {
+        'expires_at': datetime.fromisoformat(record['access_expires_at']) if record['access_expires_at'] else None,
+        'ip_matcher': compile_allowlist(record['allowed_ips']),
+        'country_policy': compile_country_policy_json(result[7])
+    }
+    auth_cache.put(access_token, record, **extras)
+    
+    return record, extras, result[15]
+
+def verify_user_access(access_token, ip_address=None, user_agent=None, include_trial_remaining=False,
+                       resolve_country=True, check_sessions=True):
+    """Verify user access token with IP, country and trial restrictions.
+
+    The geo lookup is skipped when resolve_country is False and the user has
+    no country or VPN policy (the IP-allowlist pages never show the country).
+    check_sessions=False skips the session limit for a session already counted.
+    """
+    loaded = load_user_record(access_token)
+    if not loaded:
+        return None
+    
+    record, extras, active_sessions = loaded
+    user_data = dict(record)
+    
+    # Check if access has expired
+    if extras['expires_at'] and datetime.now() > extras['expires_at']:
+        log_access(user_data['user_id'], user_data['client_id'], 'access_denied', 
+                  details='Access expired', ip_address=ip_address, success=False)
+        return None
+    
+    # Check IP restrictions
+    if ip_address and not check_ip_restriction(extras['ip_matcher'], ip_address):
+        log_access(user_data['user_id'], user_data['client_id'], 'access_denied', 
+                  details=f'IP not allowed: {ip_address}', ip_address=ip_address, success=False)
+        return None
+    
+    # Get country from IP
+    country_code = 'Unknown'
+    is_vpn = False
+    if ip_address and (resolve_country or user_data['block_vpn'] or extras['country_policy'] is not None):
+        country_code, is_vpn = lookup_ip(ip_address)
+    
+    # Check VPN restriction
+    if user_data['block_vpn'] and is_vpn:
+        log_access(user_data['user_id'], user_data['client_id'], 'access_denied', 
+                  details='VPN/Proxy blocked', ip_address=ip_address, 
+                  country_code=country_code, is_vpn=is_vpn, success=False)
+        return None
+    
+    # Check country restrictions
+    if not check_country_restriction(extras['country_policy'], country_code):
+        log_access(user_data['user_id'], user_data['client_id'], 'access_denied', 
+                  details=f'Country not allowed: {country_code}', ip_address=ip_address, 
+                  country_code=country_code, is_vpn=is_vpn, success=False)
+        return None
+    
+    # Check session limit
+    if check_sessions and check_session_limit(user_data['user_id'], user_data['session_limit'], active_sessions):
+        log_access(user_data['user_id'], user_data['client_id'], 'access_denied', 
+                  details='Session limit exceeded', ip_address=ip_address, 
+                  country_code=country_code, is_vpn=is_vpn, success=False)
+        return None
+    
+    # Add country info to user data
+    user_data['current_country'] = country_code
+    user_data['current_country_name'] = COUNTRIES.get(country_code, country_code)
+    user_data['is_vpn'] = is_vpn
+    
+    # Only parse the trial end when the caller displays the countdown
+    if include_trial_remaining and user_data['trial_end_time']:
+        time_remaining = datetime.fromisoformat(user_data['trial_end_time']) - datetime.now()
+        user_data['trial_hours_remaining'] = max(0, int(time_remaining.total_seconds() / 3600))
+    
+    return user_data
+
+def issue_user_session_token(user_data, access_token, ip_address=None):
+    """Exchange verified user data for a signed session token; returns (token, exp epoch seconds).
+
+    The token is bound to the URL token and client IP it was issued for and
+    never outlives the user's access expiry or trial end.
+    """
+    claims = {
+        'u': user_data['user_id'],
+        'c': user_data['client_id'],
+        'r': user_data['role'],
+        'n': user_data['name'],
+        'e': user_data['email'],
+        'b': user_data['business_name'],
+        'p': compile_permission_mask(user_data, has_permission),
+        't': token_fingerprint(access_token),
+        'ip': ip_address,
+        'cc': user_data.get('current_country', 'Unknown'),
+        'v': user_data.get('is_vpn', False)
+    }
+    if 'allowed_interest_levels' in user_data['permissions']:
+        claims['l'] = user_data['permissions']['allowed_interest_levels']
+    
+    deadlines = [datetime.fromisoformat(value).timestamp()
+                 for value in (user_data['access_expires_at'], user_data['trial_end_time']) if value]
+    return issue_session_token(claims, min(deadlines) if deadlines else None)
+
+def user_data_from_claims(claims):
+    """The subset of user data API routes need, rebuilt from session token claims"""
+    user_data = {
+        'user_id': claims['u'],
+        'client_id': claims['c'],
+        'name': claims['n'],
+        'email': claims['e'],
+        'business_name': claims['b'],
+        'role': claims['r'],
+        'permission_mask': claims['p'],
+        'permissions': {},
+        'current_country': claims['cc'],
+        'current_country_name': COUNTRIES.get(claims['cc'], claims['cc']),
+        'is_vpn': claims['v']
+    }
+    if 'l' in claims:
+        user_data['permissions']['allowed_interest_levels'] = claims['l']
+    return user_data
+
+def authorize_request(access_token, ip_address=None, session_token=None, resolve_country=True):
+    """User data for an API call: from a valid session token when one is sent (no DB
+    round trip), otherwise by verifying the URL access token as before"""
+    if session_token:
+        claims = decode_session_token(session_token)
+        if claims and claims['t'] == token_fingerprint(access_token) and claims['ip'] == ip_address:
+            return user_data_from_claims(claims)
+    return verify_user_access(access_token, ip_address, resolve_country=resolve_country)
+
+def renew_session_token(access_token, ip_address=None, session_token=None, user_agent=None,
+                        resolve_country=True):
+    """Re-verify the URL token and issue a fresh session token; returns (token, exp) or None.
+
+    A still-valid session token for the same URL token and IP stands for a
+    session already counted against the session limit, so renewing it skips
+    that check; user, client, trial, IP and country checks all run again.
+    """
+    claims = decode_session_token(session_token) if session_token else None
+    renewing = bool(claims and claims['t'] == token_fingerprint(access_token) and claims['ip'] == ip_address)
+    user_data = verify_user_access(access_token, ip_address, user_agent, resolve_country=resolve_country,
+                                   check_sessions=not renewing)
+    if not user_data:
+        return None
+    return issue_user_session_token(user_data, access_token, ip_address)
+
+def user_payload(user_data):
+    """The user fields API responses return, identical for token and URL-token callers"""
+    payload = {field: user_data.get(field) for field in USER_PAYLOAD_FIELDS}
+    payload['permissions'] = [name for name in PERMISSION_BITS if has_permission(user_data, name)]
+    return payload
+
+def has_permission(user_data, permission):
+    """Check if user has specific permission"""
+    if 'permission_mask' in user_data:
+        # Compiled into the session token when it was issued
+        return bool(user_data['permission_mask'] & PERMISSION_BITS.get(permission, 0))
+    
+    permissions = user_data.get('permissions', {})
+    
+    # Admin role has all permissions
+    if user_data['role'] == 'admin':
+        return True
+    
+    # Owner role has all permissions except user management (unless explicitly granted)
+    if user_data['role'] == 'owner':
+        if permission == 'manage_users':
+            return permissions.get('manage_users', True)
+        return True
+    
+    # Manager role has most permissions
+    if user_data['role'] == 'manager':
+        restricted_permissions = ['manage_users', 'delete_data']
+        if permission in restricted_permissions:
+            return permissions.get(permission, False)
+        return True
+    
+    # Viewer role has limited permissions
+    if user_data['role'] == 'viewer':
+        allowed_permissions = ['view_visitors', 'view_basic_info']
+        if permission in allowed_permissions:
+            return permissions.get(permission, True)
+        return permissions.get(permission, False)
+    
+    # Read-only role has very limited permissions
+    if user_data['role'] == 'readonly':
+        allowed_permissions = ['view_visitors']
+        return permission in allowed_permissions and permissions.get(permission, True)
+    
+    return False
@@ -0,0 +1,93 @@
+"""
+Country Restriction Policies
+Country/continent restrictions compiled into O(1) set lookups
+"""
+
+import json
+from functools import lru_cache
+
+# Country data for restrictions
+COUNTRIES = {
+    'US': 'United States', 'CA': 'Canada', 'GB': 'United Kingdom', 'AU': 'Australia',
+    'DE': 'Germany', 'FR': 'France', 'IT': 'Italy', 'ES': 'Spain', 'NL': 'Netherlands',
+    'SE': 'Sweden', 'NO': 'Norway', 'DK': 'Denmark', 'FI': 'Finland', 'CH': 'Switzerland',
+    'AT': 'Austria', 'BE': 'Belgium', 'IE': 'Ireland', 'PT': 'Portugal', 'LU': 'Luxembourg',
+    'JP': 'Japan', 'KR': 'South Korea', 'SG': 'Singapore', 'HK': 'Hong Kong', 'TW': 'Taiwan',
+    'IN': 'India', 'CN': 'China', 'RU': 'Russia', 'BR': 'Brazil', 'MX': 'Mexico',
+    'AR': 'Argentina', 'CL': 'Chile', 'CO': 'Colombia', 'PE': 'Peru', 'VE': 'Venezuela',
+    'ZA': 'South Africa', 'EG': 'Egypt', 'NG': 'Nigeria', 'KE': 'Kenya', 'MA': 'Morocco',
+    'IL': 'Israel', 'AE': 'United Arab Emirates', 'SA': 'Saudi Arabia', 'TR': 'Turkey',
+    'PL': 'Poland', 'CZ': 'Czech Republic', 'HU': 'Hungary', 'RO': 'Romania', 'BG': 'Bulgaria',
+    'HR': 'Croatia', 'SI': 'Slovenia', 'SK': 'Slovakia', 'LT': 'Lithuania', 'LV': 'Latvia',
+    'EE': 'Estonia', 'GR': 'Greece', 'CY': 'Cyprus', 'MT': 'Malta', 'IS': 'Iceland',
+    'NZ': 'New Zealand', 'TH': 'Thailand', 'MY': 'Malaysia', 'ID': 'Indonesia', 'PH': 'Philippines',
+    'VN': 'Vietnam', 'BD': 'Bangladesh', 'PK': 'Pakistan', 'LK': 'Sri Lanka', 'MM': 'Myanmar'
+}
+
+CONTINENTS = {
+    'NA': ['US', 'CA', 'MX', 'GT', 'BZ', 'SV', 'HN', 'NI', 'CR', 'PA'],
+    'EU': ['GB', 'DE', 'FR', 'IT', 'ES', 'NL', 'SE', 'NO', 'DK', 'FI', 'CH', 'AT', 'BE', 'IE', 'PT', 'LU', 'PL', 'CZ', 'HU', 'RO', 'BG', 'HR', 'SI', 'SK', 'LT', 'LV', 'EE', 'GR', 'CY', 'MT', 'IS'],
+    'AS': ['JP', 'KR', 'SG', 'HK', 'TW', 'IN', 'CN', 'TH', 'MY', 'ID', 'PH', 'VN', 'BD', 'PK', 'LK', 'MM'],
+    'SA': ['BR', 'AR', 'CL', 'CO', 'PE', 'VE', 'UY', 'PY', 'BO', 'EC', 'GY', 'SR', 'GF'],
+    'AF': ['ZA', 'EG', 'NG', 'KE', 'MA', 'GH', 'TZ', 'UG', 'MZ', 'MG', 'CM', 'CI', 'NE', 'BF', 'ML', 'MW', 'ZM', 'SN', 'SO', 'TD', 'GN', 'RW', 'BJ', 'TN', 'BI', 'ER', 'SL', 'TG', 'CF', 'LR', 'MR', 'GM'],
+    'OC': ['AU', 'NZ', 'FJ', 'PG', 'NC', 'SB', 'VU', 'WS', 'KI', 'TO', 'FM', 'PW', 'MH', 'TV', 'NR']
+}
+
+CONTINENT_NAMES = {
+    'NA': 'North America',
+    'EU': 'Europe', 
+    'AS': 'Asia',
+    'SA': 'South America',
+    'AF': 'Africa',
+    'OC': 'Oceania'
+}
+
+# Reverse index: country code -> continent code
+COUNTRY_TO_CONTINENT = {
+    country: continent
+    for continent, continent_countries in CONTINENTS.items()
+    for country in continent_countries
+}
+
+class CountryPolicy:
+    """A compiled restriction: the set of listed country codes plus allow/block mode"""
+
+    __slots__ = ('restriction_type', 'codes')
+
+    def __init__(self, restriction_type, codes):
+        self.restriction_type = restriction_type
+        self.codes = frozenset(codes)
+
+    def allows(self, country_code):
+        """Single set lookup - allow lists must contain the country, block lists must not"""
+        return (country_code in self.codes) == (self.restriction_type == 'allow')
+
+def compile_country_policy(restrictions):
+    """Compile a restrictions dict ({'type', 'countries', 'continents'}); None means unrestricted"""
+    if not restrictions:
+        return None
+
+    codes = set(restrictions.get('countries', []))
+    for continent in restrictions.get('continents', []):
+        codes.update(CONTINENTS.get(continent, ()))
+
+    restriction_type = 'block' if restrictions.get('type', 'allow') == 'block' else 'allow'
+    return CountryPolicy(restriction_type, codes)
+
+@lru_cache(maxsize=4096)
+def compile_country_policy_json(raw_restrictions):
+    """Compile the stored JSON form; identical policies share one compiled object"""
+    if not raw_restrictions:
+        return None
+    return compile_country_policy(json.loads(raw_restrictions))
+
+def evaluate_country_for_users(country_code, users):
+    """Batch mode: check one country against many (user_id, raw_restrictions) pairs.
+
+    Returns {user_id: allowed}.
+    """
+    results = {}
+    for user_id, raw_restrictions in users:
+        policy = compile_country_policy_json(raw_restrictions)
+        results[user_id] = policy is None or policy.allows(country_code)
+    return results
@@ -0,0 +1,200 @@
+"""
+Shared SQLite Access Layer
+Pooled, pre-configured connections to client_management.db for all service modules
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Database configuration (override with environment variables in production)
+DB_CONFIG = {
+    'path': os.environ.get('CLIENT_DB_PATH', 'client_management.db'),
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', '8')),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', '30')),  # seconds to wait for a free connection
+    'busy_timeout_ms': 5000,
+    'mmap_size': 256 * 1024 * 1024,  # 256 MB
+    'cache_size_kb': 16384  # 16 MB page cache per connection
+}
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections, each configured with pragmas once"""
+
+    def __init__(self, path, size, timeout):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.metrics = {
+            'hits': 0,          # served from an idle pooled connection
+            'misses': 0,        # had to open a new connection
+            'waits': 0,         # pool exhausted, caller had to wait
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+            'discarded': 0
+        }
+
+    def _connect(self):
+        """Open a connection and apply per-connection pragmas"""
+        conn = sqlite3.connect(self.path, timeout=DB_CONFIG['busy_timeout_ms'] / 1000,
+                               check_same_thread=False)
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f"PRAGMA busy_timeout={int(DB_CONFIG['busy_timeout_ms'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(DB_CONFIG['mmap_size'])}")
+        cursor.execute(f"PRAGMA cache_size=-{int(DB_CONFIG['cache_size_kb'])}")
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+        return conn
+
+    def _count(self, metric, amount=1):
+        with self._lock:
+            self.metrics[metric] += amount
+
+    def acquire(self):
+        """Take a connection from the pool, opening or waiting for one if needed"""
+        try:
+            conn = self._idle.get_nowait()
+            self._count('hits')
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open < self.size
+            if can_open:
+                self._open += 1
+
+        if can_open:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+            self._count('misses')
+            return conn
+
+        # Pool exhausted - wait for another thread to release a connection
+        started = time.perf_counter()
+        self._count('waits')
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count('timeouts')
+            raise sqlite3.OperationalError('Timed out waiting for a pooled database connection')
+        finally:
+            self._count('wait_time_ms', (time.perf_counter() - started) * 1000)
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._open -= 1
+                self.metrics['discarded'] += 1
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        """Snapshot of pool metrics"""
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['open_connections'] = self._open
+        stats['idle_connections'] = self._idle.qsize()
+        stats['pool_size'] = self.size
+        return stats
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def get_pool():
+    """Get the connection pool for this worker process"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            # Connections must never cross a fork, so each worker gets its own pool
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(DB_CONFIG['path'], DB_CONFIG['pool_size'], DB_CONFIG['pool_timeout'])
+                _pool_pid = pid
+                _local.__dict__.clear()
+    return _pool
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection for the current thread.
+
+    Commits on normal exit and rolls back on error. Nested calls on the same
+    thread share the outer connection and transaction.
+    """
+    held = getattr(_local, 'conn', None)
+    if held is not None:
+        _local.depth += 1
+        try:
+            yield held
+        finally:
+            _local.depth -= 1
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    _local.conn = conn
+    _local.depth = 0
+    discard = False
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        raise
+    finally:
+        _local.conn = None
+        pool.release(conn, discard=discard)
+
+def pool_metrics():
+    """Pool hit/wait counters for the current worker"""
+    return get_pool().stats()
+
+def close_pool():
+    """Close all pooled connections for the current worker"""
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close_all()
+
+def ensure_columns(cursor, table, columns):
+    """Add any missing columns to an existing table (columns: name -> column definition)"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    added = []
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            added.append(name)
+    return added
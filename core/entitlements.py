@@ -0,0 +1,225 @@
+"""
+Client Entitlements
+One precomputed row per client (plan, limits, feature flags, status), refreshed
+in the same transaction as any billing or trial change and cached in memory
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from core.database import get_connection
+
+ENTITLEMENT_CONFIG = {
+    'ttl_seconds': float(os.environ.get('ENTITLEMENT_CACHE_TTL', '60')),
+    'max_entries': 10000
+}
+
+# Limits per plan when no payment_plans row exists (trial and admin-created clients)
+PLAN_LIMITS = {
+    'trial': {'max_users': 3, 'max_websites': 1},
+    'basic': {'max_users': 5, 'max_websites': 1},
+    'professional': {'max_users': 15, 'max_websites': 5},
+    'enterprise': {'max_users': 50, 'max_websites': 25}
+}
+
+ENTITLEMENT_COLUMNS = ['client_id', 'account_type', 'status', 'plan_id', 'plan_name', 'max_users',
+                       'max_websites', 'features', 'plan_features', 'trial_end_time', 'subscription_id',
+                       'payment_provider', 'subscription_status', 'billing_cycle', 'amount',
+                       'current_period_end', 'updated_at']
+
+def create_entitlements_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_entitlements (
+            client_id TEXT PRIMARY KEY,
+            account_type TEXT,
+            status TEXT,
+            plan_id TEXT,
+            plan_name TEXT,
+            max_users INTEGER,
+            max_websites INTEGER,
+            features TEXT,
+            plan_features TEXT,
+            trial_end_time TIMESTAMP,
+            subscription_id TEXT,
+            payment_provider TEXT,
+            subscription_status TEXT,
+            billing_cycle TEXT,
+            amount DECIMAL(10,2),
+            current_period_end TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+    # Backfill clients created before the table existed
+    cursor.execute('''
+        SELECT c.client_id FROM clients c
+        LEFT JOIN client_entitlements e ON e.client_id = c.client_id
+        WHERE e.client_id IS NULL
+    ''')
+    missing = [row[0] for row in cursor.fetchall()]
+    if missing:
+        refresh_entitlements(cursor, missing)
+
+def _has_billing_tables(cursor):
+    cursor.execute('''
+        SELECT COUNT(*) FROM sqlite_master
+        WHERE type = 'table' AND name IN ('subscriptions', 'payment_plans')
+    ''')
+    return cursor.fetchone()[0] == 2
+
+def _plan_feature_flags(cursor):
+    """plan_id -> feature flag dict, from the payment_plans rows (the only copy of them)"""
+    if not _has_billing_tables(cursor):
+        return {}
+    cursor.execute('PRAGMA table_info(payment_plans)')
+    if 'feature_flags' not in {row[1] for row in cursor.fetchall()}:
+        return {}  # refreshed again once the payment_plan_feature_flags migration adds them
+    cursor.execute('SELECT plan_id, feature_flags FROM payment_plans WHERE feature_flags IS NOT NULL')
+    return {plan_id: json.loads(flags) for plan_id, flags in cursor.fetchall()}
+
+def _flags_for_plan(plan_flags, plan_id):
+    """Flags for a plan; trials get none of the paid features, unknown plans those of basic"""
+    if plan_id in plan_flags:
+        return plan_flags[plan_id]
+    if plan_id == 'trial':
+        return {flag: False for flags in plan_flags.values() for flag in flags}
+    return plan_flags.get('basic', {})
+
+def refresh_entitlements(cursor, client_ids):
+    """Recompute entitlement rows for these clients inside the caller's transaction"""
+    client_ids = list(dict.fromkeys(client_ids))
+    if not client_ids:
+        return 0
+
+    placeholders = ', '.join('?' for _ in client_ids)
+    if _has_billing_tables(cursor):
+        # The newest live subscription decides the plan, as get_client_subscription_status did
+        cursor.execute(f'''
+            SELECT c.client_id, c.account_type, c.subscription_status, c.plan_type, c.max_users,
+                   c.trial_end_time, s.subscription_id, s.plan_id, s.payment_provider, s.status,
+                   s.billing_cycle, s.amount, s.current_period_end,
+                   pp.name, pp.max_users, pp.max_websites, pp.features
+            FROM clients c
+            LEFT JOIN subscriptions s ON s.id = (
+                SELECT s2.id FROM subscriptions s2
+                WHERE s2.client_id = c.client_id AND s2.status IN ('active', 'trialing', 'past_due')
+                ORDER BY s2.created_at DESC
+                LIMIT 1
+            )
+            LEFT JOIN payment_plans pp ON pp.plan_id = s.plan_id
+            WHERE c.client_id IN ({placeholders})
+        ''', client_ids)
+    else:
+        cursor.execute(f'''
+            SELECT client_id, account_type, subscription_status, plan_type, max_users, trial_end_time,
+                   NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+            FROM clients WHERE client_id IN ({placeholders})
+        ''', client_ids)
+    rows = cursor.fetchall()
+    plan_flags = _plan_feature_flags(cursor)
+
+    now = datetime.now().isoformat()
+    records = []
+    for (client_id, account_type, status, plan_type, client_max_users, trial_end_time,
+         subscription_id, sub_plan_id, payment_provider, subscription_status, billing_cycle, amount,
+         current_period_end, plan_name, plan_max_users, plan_max_websites, plan_features) in rows:
+        account_type = account_type or 'full'
+        plan_id = sub_plan_id or ('trial' if account_type == 'trial' else plan_type) or 'basic'
+        limits = PLAN_LIMITS.get(plan_id, {})
+        records.append((
+            client_id, account_type, status, plan_id, plan_name,
+            plan_max_users or limits.get('max_users') or client_max_users,
+            plan_max_websites or limits.get('max_websites', 1),
+            json.dumps(_flags_for_plan(plan_flags, plan_id)),
+            plan_features,
+            trial_end_time if account_type == 'trial' else None,
+            subscription_id, payment_provider, subscription_status, billing_cycle, amount,
+            current_period_end, now
+        ))
+
+    cursor.executemany(f'''
+        INSERT OR REPLACE INTO client_entitlements ({', '.join(ENTITLEMENT_COLUMNS)})
+        VALUES ({', '.join('?' for _ in ENTITLEMENT_COLUMNS)})
+    ''', records)
+    invalidate_entitlements(client_ids)
+    return len(records)
+
+class EntitlementCache:
+    """Decoded entitlement records with a short TTL"""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}  # client_id -> (expires, record)
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, client_id):
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self.metrics['misses'] += 1
+                return None
+            self.metrics['hits'] += 1
+            return entry[1]
+
+    def put(self, client_id, record):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[client_id] = (time.monotonic() + self.ttl_seconds, record)
+
+    def invalidate(self, client_ids):
+        with self._lock:
+            for client_id in client_ids:
+                if self._entries.pop(client_id, None) is not None:
+                    self.metrics['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._entries)
+        return stats
+
+entitlement_cache = EntitlementCache(ENTITLEMENT_CONFIG['ttl_seconds'], ENTITLEMENT_CONFIG['max_entries'])
+
+def invalidate_entitlements(client_ids):
+    entitlement_cache.invalidate(client_ids)
+
+def get_entitlements(client_id):
+    """Entitlement record for a client (features decoded to a flag dict), or None"""
+    record = entitlement_cache.get(client_id)
+    if record is not None:
+        return record
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {', '.join(ENTITLEMENT_COLUMNS)} FROM client_entitlements WHERE client_id = ?
+        ''', (client_id,))
+        row = cursor.fetchone()
+        if row is None and refresh_entitlements(cursor, [client_id]):
+            cursor.execute(f'''
+                SELECT {', '.join(ENTITLEMENT_COLUMNS)} FROM client_entitlements WHERE client_id = ?
+            ''', (client_id,))
+            row = cursor.fetchone()
+
+    if row is None:
+        return None
+    record = dict(zip(ENTITLEMENT_COLUMNS, row))
+    record['features'] = json.loads(record['features']) if record['features'] else {}
+    record['plan_features'] = json.loads(record['plan_features']) if record['plan_features'] else []
+    entitlement_cache.put(client_id, record)
+    return record
+
+def max_users_for(client_id, plan_type=None):
+    """User limit for a client: its entitlement record, or the plan defaults without one"""
+    entitlements = get_entitlements(client_id)
+    if entitlements and entitlements['max_users']:
+        return entitlements['max_users']
+    return PLAN_LIMITS.get(plan_type, PLAN_LIMITS['basic'])['max_users']
+
+def entitlement_metrics():
+    return entitlement_cache.stats()
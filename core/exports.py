@@ -0,0 +1,149 @@
+"""
+Streaming Exports
+Constant-memory CSV and XLSX generators fed by keyset-paginated database reads
+"""
+
+import csv
+import io
+import tempfile
+
+from core.database import get_connection
+from core.log_partitions import partitions_for_range
+
+EXPORT_CONFIG = {
+    'fetch_size': 5000,  # rows per keyset-paginated read
+    'csv_flush_rows': 1000,  # rows buffered before a CSV chunk is yielded
+    'xlsx_chunk_bytes': 64 * 1024
+}
+
+CSV_MIMETYPE = 'text/csv'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def iter_keyset(table, columns, where, params, order_column, chunk_size=None):
+    """Yield rows of a table ordered by (order_column, id), chunk_size rows per query.
+
+    Each chunk is a short keyset-paginated read on a pooled connection that is
+    returned before the rows are yielded, so a slow download never holds a pool
+    slot (or a read snapshot) for the lifetime of the response.
+    """
+    chunk_size = chunk_size or EXPORT_CONFIG['fetch_size']
+    last = None
+    while True:
+        chunk_where = list(where)
+        chunk_params = list(params)
+        if last is not None:
+            last_value, last_id = last
+            if last_value is None:
+                # NULLs sort first; the rest of the NULLs by id, then every non-NULL row
+                chunk_where.append(f'({order_column} IS NOT NULL OR id > ?)')
+                chunk_params.append(last_id)
+            else:
+                chunk_where.append(f'({order_column} > ? OR ({order_column} = ? AND id > ?))')
+                chunk_params.extend([last_value, last_value, last_id])
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {order_column}, id, {', '.join(columns)} FROM {table}
+                WHERE {' AND '.join(chunk_where)}
+                ORDER BY {order_column}, id
+                LIMIT ?
+            ''', chunk_params + [chunk_size])
+            rows = cursor.fetchall()
+        for row in rows:
+            yield row[2:]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][:2]
+
+def iter_audit_rows(client_id, columns, filters=None):
+    """Yield a client's access log rows oldest first across the partitions the since/until filters reach.
+
+    Rows are (timestamp, user name, user email, *columns). User names come
+    from one up-front lookup instead of a join per row.
+    """
+    filters = filters or {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, name, email FROM client_users WHERE client_id = ?', (client_id,))
+        users = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        partitions = partitions_for_range(cursor, filters.get('since'), filters.get('until'))
+
+    where = ['client_id = ?']
+    params = [client_id]
+    for column in ('action', 'user_id', 'country_code', 'success'):
+        if column in filters:
+            where.append(f'{column} = ?')
+            params.append(filters[column])
+    if filters.get('since'):
+        where.append('timestamp >= ?')
+        params.append(filters['since'])
+    if filters.get('until'):
+        where.append('timestamp < ?')
+        params.append(filters['until'])
+
+    for table in reversed(partitions):
+        for row in iter_keyset(table, ['timestamp', 'user_id'] + list(columns), where, params, 'timestamp'):
+            name, email = users.get(row[1], ('Unknown', 'Unknown'))
+            yield (row[0], name, email) + tuple(row[2:])
+
+def iter_session_rows(client_id, columns):
+    """Yield a client's session history oldest first"""
+    return iter_keyset('user_sessions', columns, ['client_id = ?'], [client_id], 'created_at')
+
+def stream_csv(header, rows):
+    """Generate CSV text chunks without holding the whole file in memory"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_CONFIG['csv_flush_rows']:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue()
+
+def stream_xlsx(header, rows, title='Export'):
+    """Generate XLSX bytes using openpyxl's write-only mode and a temporary file.
+
+    Memory stays constant, but unlike CSV this is not a true stream: a zip
+    container can only be finalised after its last row, so the first byte is
+    sent once the whole workbook has been written to disk. Large exports
+    should use CSV when time to first byte matters.
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    header_cells = []
+    for name in header:
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    sheet.append(header_cells)
+    for row in rows:
+        sheet.append(list(row))
+
+    # The zip container can only be finalised once every row is written, so it
+    # is spooled to disk rather than kept in memory
+    with tempfile.TemporaryFile() as handle:
+        workbook.save(handle)
+        handle.seek(0)
+        while True:
+            chunk = handle.read(EXPORT_CONFIG['xlsx_chunk_bytes'])
+            if not chunk:
+                break
+            yield chunk
+
+def stream_export(export_format, header, rows, title='Export'):
+    """(generator, mimetype, extension) for 'csv' or 'xlsx'; raises ValueError otherwise"""
+    if export_format == 'csv':
+        return stream_csv(header, rows), CSV_MIMETYPE, 'csv'
+    if export_format == 'xlsx':
+        return stream_xlsx(header, rows, title), XLSX_MIMETYPE, 'xlsx'
+    raise ValueError('Unsupported export format - use csv or xlsx')
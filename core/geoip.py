@@ -0,0 +1,205 @@
+"""
+Geo-IP Resolution
+Local IP range database with binary-search lookups and a bounded LRU cache
+"""
+
+import csv
+import ipaddress
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+
+GEOIP_CONFIG = {
+    # CSV rows: start_ip,end_ip,country_code,is_proxy (IPs as text or integers)
+    'database_path': os.environ.get('GEOIP_DATABASE', 'geoip_ranges.csv'),
+    'cache_size': int(os.environ.get('GEOIP_CACHE_SIZE', '50000')),
+    # 'auto' uses ip-api.com only when no local database is available
+    'remote_fallback': os.environ.get('GEOIP_REMOTE_FALLBACK', 'auto'),
+    'remote_timeout': 2,
+    # A lookup the remote backend could not answer (timeout, rate limit) is retried after this many seconds
+    'failure_ttl': int(os.environ.get('GEOIP_FAILURE_TTL', '30'))
+}
+
+GeoResult = namedtuple('GeoResult', ['country_code', 'is_proxy'])
+
+UNKNOWN = GeoResult('Unknown', False)
+LOCALHOST = GeoResult('US', False)  # Default for local development traffic
+
+def _ip_to_int(value):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return number, (4 if number <= 0xFFFFFFFF else 6)
+    ip = ipaddress.ip_address(value)
+    return int(ip), ip.version
+
+class RangeDatabaseResolver:
+    """Non-overlapping IP ranges held in sorted arrays, searched with bisect"""
+
+    # None from lookup() means no range holds the IP, which stays true until the file changes
+    definitive = True
+
+    def __init__(self, rows=()):
+        ranges = {4: [], 6: []}
+        for start, end, country_code, is_proxy in rows:
+            start_int, version = _ip_to_int(start)
+            end_int, _ = _ip_to_int(end)
+            ranges[version].append((start_int, end_int, country_code.strip().upper() or 'Unknown',
+                                    str(is_proxy).strip().lower() in ('1', 'true', 'yes')))
+
+        self._tables = {}
+        for version, entries in ranges.items():
+            entries.sort()
+            # IPv4 fits in machine-word arrays; IPv6 needs Python ints
+            starts = array('L', (e[0] for e in entries)) if version == 4 else [e[0] for e in entries]
+            ends = array('L', (e[1] for e in entries)) if version == 4 else [e[1] for e in entries]
+            countries = [e[2] for e in entries]
+            proxies = bytearray(e[3] for e in entries)
+            self._tables[version] = (starts, ends, countries, proxies)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a range database from a CSV file"""
+        with open(path, newline='') as handle:
+            reader = csv.reader(handle)
+            rows = []
+            for row in reader:
+                if not row or row[0].startswith('#') or row[0].strip().lower() in ('start', 'start_ip'):
+                    continue
+                rows.append((row[0], row[1], row[2], row[3] if len(row) > 3 else '0'))
+        return cls(rows)
+
+    def __len__(self):
+        return sum(len(table[0]) for table in self._tables.values())
+
+    def lookup(self, ip_address):
+        """Return GeoResult for an IP, or None if no range contains it"""
+        ip = ipaddress.ip_address(ip_address)
+        starts, ends, countries, proxies = self._tables[ip.version]
+        number = int(ip)
+        index = bisect_right(starts, number) - 1
+        if index >= 0 and number <= ends[index]:
+            return GeoResult(countries[index], bool(proxies[index]))
+        return None
+
+class RemoteResolver:
+    """ip-api.com lookup returning country and proxy status in one request"""
+
+    # None from lookup() may be a timeout or an error, so it is not cached for long
+    definitive = False
+
+    def __init__(self, timeout=2):
+        self.timeout = timeout
+
+    def lookup(self, ip_address):
+        import requests
+
+        try:
+            response = requests.get(f'http://ip-api.com/json/{ip_address}?fields=countryCode,proxy',
+                                    timeout=self.timeout)
+            if response.status_code == 200:
+                data = response.json()
+                if data.get('countryCode'):
+                    return GeoResult(data['countryCode'], bool(data.get('proxy', False)))
+        except Exception:
+            pass
+
+        # Fallback: try ipinfo.io (country only)
+        try:
+            response = requests.get(f'https://ipinfo.io/{ip_address}/country', timeout=self.timeout)
+            if response.status_code == 200 and response.text.strip():
+                return GeoResult(response.text.strip(), False)
+        except Exception:
+            pass
+
+        return None
+
+class GeoResolver:
+    """Chain of lookup backends behind a bounded LRU cache"""
+
+    def __init__(self, backends, cache_size=50000, failure_ttl=30):
+        self.backends = list(backends)
+        self.cache_size = cache_size
+        self.failure_ttl = failure_ttl
+        self._cache = OrderedDict()  # ip -> (GeoResult, expires_at or None)
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0}
+
+    def resolve(self, ip_address):
+        """Return GeoResult(country_code, is_proxy) for an IP address"""
+        if not ip_address or ip_address in ['127.0.0.1', '::1', 'localhost']:
+            return LOCALHOST
+
+        with self._lock:
+            cached = self._cache.get(ip_address)
+            if cached is not None and (cached[1] is None or cached[1] > time.monotonic()):
+                self._cache.move_to_end(ip_address)
+                self.metrics['hits'] += 1
+                return cached[0]
+            self.metrics['misses'] += 1
+
+        result, expires_at = UNKNOWN, None
+        try:
+            for backend in self.backends:
+                found = backend.lookup(ip_address)
+                if found:
+                    result, expires_at = found, None
+                    break
+                if not getattr(backend, 'definitive', True):
+                    expires_at = time.monotonic() + self.failure_ttl
+        except ValueError:
+            expires_at = None  # Not a valid IP address
+
+        with self._lock:
+            self._cache[ip_address] = (result, expires_at)
+            self._cache.move_to_end(ip_address)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['cached'] = len(self._cache)
+        return stats
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def build_resolver(config=None):
+    """Build a resolver from GEOIP_CONFIG-style settings"""
+    config = config or GEOIP_CONFIG
+    backends = []
+    if config['database_path'] and os.path.exists(config['database_path']):
+        backends.append(RangeDatabaseResolver.from_csv(config['database_path']))
+
+    remote = str(config['remote_fallback']).lower()
+    if remote in ('1', 'true', 'yes') or (remote == 'auto' and not backends):
+        backends.append(RemoteResolver(config['remote_timeout']))
+
+    return GeoResolver(backends, config['cache_size'], config['failure_ttl'])
+
+def get_resolver():
+    """Get the process-wide geo resolver, building it on first use"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = build_resolver()
+    return _resolver
+
+def set_resolver(resolver):
+    """Install a custom resolver (any object with resolve(ip) -> GeoResult)"""
+    global _resolver
+    _resolver = resolver
+
+def lookup_ip(ip_address):
+    """Resolve country code and proxy/VPN status for an IP in one call"""
+    return get_resolver().resolve(ip_address)
+
+def geoip_metrics():
+    """Cache counters of this process's resolver (empty until the first lookup builds it)"""
+    return _resolver.stats() if _resolver is not None and hasattr(_resolver, 'stats') else {}
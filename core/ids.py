@@ -0,0 +1,35 @@
+"""
+Identifier Generation
+Prefixed random identifiers and access tokens shared by every service module
+"""
+
+import secrets
+import uuid
+
+def prefixed_id(prefix, length=12):
+    """Random identifier such as client_3f9a0c1d2e4b"""
+    return f"{prefix}_{uuid.uuid4().hex[:length]}"
+
+def generate_client_id():
+    """Generate unique client identifier"""
+    return prefixed_id('client')
+
+def generate_user_id():
+    """Generate unique user identifier"""
+    return prefixed_id('user')
+
+def generate_access_token():
+    """Generate secure access token"""
+    return secrets.token_urlsafe(32)
+
+def generate_session_id():
+    """Generate unique session identifier"""
+    return prefixed_id('session', 16)
+
+def generate_trial_id():
+    """Generate unique trial identifier"""
+    return prefixed_id('trial')
+
+def generate_subscription_id():
+    """Generate unique subscription identifier"""
+    return prefixed_id('sub')
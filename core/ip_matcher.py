@@ -0,0 +1,58 @@
+"""
+IP Allowlist Matching
+Allowlists compiled once into merged, sorted integer intervals for bisect lookups
+"""
+
+import ipaddress
+from bisect import bisect_right
+
+class CompiledAllowlist:
+    """IPv4/IPv6 allowlist stored as disjoint [start, end] intervals per address family"""
+
+    def __init__(self, entries):
+        intervals = {4: [], 6: []}
+        self.invalid_entries = []
+        for entry in entries:
+            try:
+                # Single IPs become /32 or /128 networks
+                network = ipaddress.ip_network(str(entry).strip(), strict=False)
+            except ValueError:
+                self.invalid_entries.append(entry)
+                continue
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+        for version, ranges in intervals.items():
+            ranges.sort()
+            merged = []
+            for start, end in ranges:
+                if merged and start <= merged[-1][1] + 1:
+                    if end > merged[-1][1]:
+                        merged[-1][1] = end
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [r[0] for r in merged]
+            self._ends[version] = [r[1] for r in merged]
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def matches(self, client_ip):
+        """Return True if the IP falls inside any allowed range"""
+        try:
+            ip = ipaddress.ip_address(client_ip)
+        except ValueError:
+            return False
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        number = int(ip)
+        starts = self._starts[ip.version]
+        index = bisect_right(starts, number) - 1
+        return index >= 0 and number <= self._ends[ip.version][index]
+
+def compile_allowlist(allowed_ips):
+    """Compile a list of IPs/CIDRs; returns None when there is no restriction"""
+    if not allowed_ips:
+        return None
+    return CompiledAllowlist(allowed_ips)
@@ -0,0 +1,49 @@
+"""
+Database Leases
+Time-limited named leases so exactly one worker in a deployment runs a singleton job
+"""
+
+import os
+import socket
+import time
+import uuid
+
+from core.database import get_connection
+
+def create_lease_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            acquired_at REAL
+        )
+    ''')
+
+def make_holder_id():
+    """Identity of this worker process for lease ownership"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def try_acquire_lease(name, holder, ttl_seconds):
+    """Acquire or renew a lease; returns True while this holder owns it"""
+    now = time.time()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO scheduler_leases (name) VALUES (?)', (name,))
+        # Take over only if we already hold it or the previous holder let it lapse
+        cursor.execute('''
+            UPDATE scheduler_leases
+            SET holder = ?, expires_at = ?,
+                acquired_at = CASE WHEN holder = ? THEN acquired_at ELSE ? END
+            WHERE name = ? AND (holder = ? OR holder IS NULL OR expires_at < ?)
+        ''', (holder, now + ttl_seconds, holder, now, name, holder, now))
+        return cursor.rowcount == 1
+
+def release_lease(name, holder):
+    """Give up a lease early so another worker can take over immediately"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE scheduler_leases SET holder = NULL, expires_at = 0
+            WHERE name = ? AND holder = ?
+        ''', (name, holder))
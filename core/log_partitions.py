@@ -0,0 +1,165 @@
+"""
+Access Log Partitions
+Monthly access_logs_YYYYMM tables with composite indexes and partition-drop retention
+"""
+
+import os
+import threading
+from datetime import datetime
+
+from core.database import get_connection
+from core.leases import make_holder_id, try_acquire_lease
+
+LOG_PARTITION_CONFIG = {
+    'prefix': 'access_logs_',
+    # Months of logs to keep, including the current one (0 keeps everything)
+    'retention_months': int(os.environ.get('ACCESS_LOG_RETENTION_MONTHS', '12')),
+    # Retention runs at boot and then this often; the lease lets one worker per interval do it
+    'retention_interval': int(os.environ.get('ACCESS_LOG_RETENTION_INTERVAL', '3600')),
+    'retention_lease': 'access_log_retention'
+}
+
+# Superset of the columns written by the access control and country access services
+PARTITION_COLUMNS = ['user_id', 'client_id', 'action', 'resource', 'ip_address', 'country_code', 'is_vpn',
+                     'user_agent', 'success', 'details', 'timestamp']
+
+_known_partitions = set()
+_partitions_lock = threading.Lock()
+
+def partition_month(timestamp):
+    """'2024-05-17 10:00:00' (or a datetime) -> '202405'"""
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime('%Y%m')
+    return timestamp[:4] + timestamp[5:7]
+
+def partition_name(month):
+    return f"{LOG_PARTITION_CONFIG['prefix']}{month}"
+
+def create_log_indexes(cursor, table='access_logs'):
+    """Composite indexes for the client-scoped log queries and their filters"""
+    # The rowid is the implicit last key, so these also serve (timestamp, id) keyset order
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_client_time ON {table} (client_id, timestamp)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_client_user_time ON {table} (client_id, user_id, timestamp)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_client_action_time ON {table} (client_id, action, timestamp)')
+    if table != 'access_logs':
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_client_country_time '
+                       f'ON {table} (client_id, country_code, timestamp)')
+
+def ensure_partition(cursor, month):
+    """Create the partition table for a month if needed and return its name"""
+    table = partition_name(month)
+    if table in _known_partitions:
+        return table
+
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            client_id TEXT,
+            action TEXT NOT NULL,
+            resource TEXT,
+            ip_address TEXT,
+            country_code TEXT,
+            is_vpn BOOLEAN DEFAULT 0,
+            user_agent TEXT,
+            success BOOLEAN DEFAULT 1,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    create_log_indexes(cursor, table)
+
+    is_new_month = False
+    with _partitions_lock:
+        if table not in _known_partitions:
+            is_new_month = bool(_known_partitions) and table > max(_known_partitions)
+            _known_partitions.add(table)
+
+    # A month rollover is the natural point to apply retention
+    if is_new_month:
+        drop_expired_partitions(cursor)
+    return table
+
+def list_partitions(cursor):
+    """Existing partition table names, newest first"""
+    cursor.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name GLOB ?
+        ORDER BY name DESC
+    ''', (LOG_PARTITION_CONFIG['prefix'] + '[0-9][0-9][0-9][0-9][0-9][0-9]',))
+    return [row[0] for row in cursor.fetchall()]
+
+def partitions_for_range(cursor, since=None, until=None):
+    """Partitions that can hold rows between two timestamps, newest first"""
+    first = partition_name(partition_month(since)) if since else None
+    last = partition_name(partition_month(until)) if until else None
+    return [name for name in list_partitions(cursor)
+            if (first is None or name >= first) and (last is None or name <= last)]
+
+def retention_cutoff(retention_months, now=None):
+    """Oldest month (YYYYMM) still kept by the retention policy"""
+    now = now or datetime.utcnow()
+    months = now.year * 12 + now.month - 1 - (retention_months - 1)
+    return f'{months // 12:04d}{months % 12 + 1:02d}'
+
+def drop_expired_partitions(cursor, retention_months=None, now=None):
+    """Drop whole partitions older than the retention window; returns dropped table names"""
+    retention_months = LOG_PARTITION_CONFIG['retention_months'] if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+
+    oldest_kept = partition_name(retention_cutoff(retention_months, now))
+    dropped = []
+    for table in list_partitions(cursor):
+        if table < oldest_kept:
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+            dropped.append(table)
+    with _partitions_lock:
+        _known_partitions.difference_update(dropped)
+    return dropped
+
+def apply_log_retention():
+    """Scheduled retention: drop expired partitions unless another worker did this interval"""
+    if not try_acquire_lease(LOG_PARTITION_CONFIG['retention_lease'], make_holder_id(),
+                             LOG_PARTITION_CONFIG['retention_interval']):
+        return []
+    with get_connection() as conn:
+        return drop_expired_partitions(conn.cursor())
+
+def migrate_legacy_logs(cursor):
+    """Move rows from the unpartitioned access_logs table into monthly partitions"""
+    cursor.execute('PRAGMA table_info(access_logs)')
+    legacy_columns = {row[1] for row in cursor.fetchall()}
+    columns = ', '.join(column for column in PARTITION_COLUMNS if column in legacy_columns)
+
+    cursor.execute('''
+        SELECT DISTINCT strftime('%Y%m', timestamp) FROM access_logs WHERE timestamp IS NOT NULL
+    ''')
+    months = [row[0] for row in cursor.fetchall() if row[0]]
+    for month in months:
+        table = ensure_partition(cursor, month)
+        cursor.execute(f'''
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM access_logs WHERE strftime('%Y%m', timestamp) = ?
+            ORDER BY id
+        ''', (month,))
+    cursor.execute('DELETE FROM access_logs WHERE timestamp IS NOT NULL')
+    return len(months)
+
+def init_log_storage(cursor):
+    """Index the legacy table, roll its rows into partitions and apply retention"""
+    create_log_indexes(cursor)
+    migrate_legacy_logs(cursor)
+    ensure_partition(cursor, partition_month(datetime.utcnow()))
+    drop_expired_partitions(cursor)
+
+def query_recent_logs(cursor, query, params, limit, since=None, until=None):
+    """Run a newest-first query (with a {table} placeholder and a trailing LIMIT ?) across
+    partitions, stopping as soon as enough rows have been collected"""
+    rows = []
+    for table in partitions_for_range(cursor, since, until):
+        cursor.execute(query.format(table=table), tuple(params) + (limit - len(rows),))
+        rows.extend(cursor.fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
@@ -0,0 +1,85 @@
+"""
+Schema Migrations
+Numbered, ordered schema versions recorded in schema_version. Worker boot does
+a single version read once the database is current; DDL only runs on upgrade.
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+
+from core.database import get_connection
+from core.leases import create_lease_table
+from core.session_tokens import create_revocation_table
+from core.signing_keys import create_secrets_table
+from core.schema import (add_plan_feature_flags, create_investigation_schema, create_payment_schema,
+                         create_tenant_schema, create_trial_schema, import_legacy_investigations,
+                         seed_payment_plans)
+
+# (version, name, apply(cursor)) in the order they must run; never renumber or edit applied entries
+MIGRATIONS = [
+    (1, 'tenant_schema', create_tenant_schema),
+    (2, 'trial_schema', create_trial_schema),
+    (3, 'payment_schema', create_payment_schema),
+    (4, 'default_payment_plans', seed_payment_plans),
+    (5, 'scheduler_leases', create_lease_table),
+    (6, 'investigation_schema', create_investigation_schema),
+    (7, 'session_revocations', create_revocation_table),
+    (8, 'app_secrets', create_secrets_table),
+    (9, 'payment_plan_feature_flags', add_plan_feature_flags),
+    (10, 'legacy_investigation_data', import_legacy_investigations)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def current_version(cursor):
+    """Applied schema version (0 for a fresh database)"""
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_version')
+    except sqlite3.OperationalError:
+        return 0  # schema_version does not exist yet
+    return cursor.fetchone()[0] or 0
+
+def migrate():
+    """Apply pending migrations in one write transaction; returns the versions applied"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if not conn.in_transaction:
+            # Another worker booting at the same time waits here, then sees the new version
+            cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL
+            )
+        ''')
+        version = current_version(cursor)
+        applied = []
+        for number, name, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            apply(cursor)
+            cursor.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                           (number, name, datetime.now().isoformat()))
+            applied.append(number)
+    if applied:
+        print(f"Applied schema migrations {applied} (now at version {LATEST_VERSION})")
+    return applied
+
+def ensure_schema():
+    """Make sure the schema is current; after the first call in a process this is free"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_connection() as conn:
+            version = current_version(conn.cursor())
+        if version < LATEST_VERSION:
+            migrate()
+        _schema_ready = True
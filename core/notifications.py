@@ -0,0 +1,294 @@
+"""
+Trial Notification Dispatcher
+Sends due trial_notifications in batches over one persistent SMTP connection
+"""
+
+import random
+import smtplib
+import threading
+import time
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from string import Template
+
+from core.database import ensure_columns, get_connection
+from core.leases import make_holder_id
+
+NOTIFICATION_CONFIG = {
+    'batch_size': 200,
+    'max_retries': 5,
+    'per_domain_per_minute': 30,  # recipient-domain rate limit
+    'messages_per_connection': 100,  # reconnect after this many messages
+    'idle_timeout': 60,  # seconds before an idle connection is re-checked with NOOP
+    'claim_ttl': 300
+}
+
+# Templates are parsed once at import; rendering is a single substitute() call
+NOTIFICATION_TEMPLATES = {
+    'trial_reminder': (
+        Template('Your $business_name trial is underway'),
+        Template('Hi $business_name,\n\n'
+                 'Your Visitor Investigation System trial ends on $trial_end.\n'
+                 'Upgrade any time to keep full access to your visitor data.\n\n'
+                 '$from_name')
+    ),
+    'trial_expiring': (
+        Template('Your $business_name trial expires soon'),
+        Template('Hi $business_name,\n\n'
+                 'Your trial expires on $trial_end. After that, dashboard access is restricted\n'
+                 'until you choose a plan.\n\n'
+                 '$from_name')
+    ),
+    'trial_expired': (
+        Template('Your $business_name trial has ended'),
+        Template('Hi $business_name,\n\n'
+                 'Your trial ended on $trial_end and access has been restricted.\n'
+                 'Choose a plan to restore access to your dashboard and visitor history.\n\n'
+                 '$from_name')
+    )
+}
+
+def init_notification_storage(cursor):
+    """Claim columns and the due-notification index on trial_notifications"""
+    ensure_columns(cursor, 'trial_notifications', {
+        'claimed_by': 'TEXT',
+        'claim_expires_at': 'REAL',
+        'last_error': 'TEXT'
+    })
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_trial_notifications_status_scheduled
+        ON trial_notifications (status, scheduled_time)
+    ''')
+
+def render_notification(notification_type, context):
+    """(subject, body) for a notification type"""
+    subject, body = NOTIFICATION_TEMPLATES[notification_type]
+    return subject.safe_substitute(context), body.safe_substitute(context)
+
+class DomainRateLimiter:
+    """Token bucket per recipient domain"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._buckets = {}  # domain -> (tokens, updated_at)
+
+    def allow(self, domain):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(domain, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[domain] = (tokens, now)
+            return False
+        self._buckets[domain] = (tokens - 1, now)
+        return True
+
+class PersistentSMTP:
+    """One SMTP session reused across messages, reopened on error or after a message quota"""
+
+    def __init__(self, email_config, smtp_factory=None):
+        self.config = email_config
+        self.smtp_factory = smtp_factory or smtplib.SMTP
+        self._smtp = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self.metrics = {'connections': 0, 'sent': 0, 'errors': 0}
+
+    def _connect(self):
+        smtp = self.smtp_factory(self.config['smtp_server'], self.config['smtp_port'], timeout=30)
+        if self.config.get('use_tls', True):
+            smtp.starttls()
+        if self.config.get('password'):
+            smtp.login(self.config.get('username') or self.config['email'], self.config['password'])
+        self.metrics['connections'] += 1
+        self._sent_on_connection = 0
+        return smtp
+
+    def _connection(self):
+        if self._smtp is not None:
+            stale = self._sent_on_connection >= NOTIFICATION_CONFIG['messages_per_connection']
+            if not stale and time.monotonic() - self._last_used > NOTIFICATION_CONFIG['idle_timeout']:
+                try:
+                    stale = self._smtp.noop()[0] != 250
+                except smtplib.SMTPException:
+                    stale = True
+            if stale:
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, message, recipient):
+        """Send one message, retrying once on a fresh connection if the session dropped"""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    self._connection().sendmail(self.config['email'], [recipient], message.as_string())
+                    self._sent_on_connection += 1
+                    self._last_used = time.monotonic()
+                    self.metrics['sent'] += 1
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self._smtp = None
+                    if attempt == 2:
+                        self.metrics['errors'] += 1
+                        raise
+                except Exception:
+                    self.metrics['errors'] += 1
+                    raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+def claim_due_notifications(claimer, limit):
+    """Claim pending notifications that are due, joined with their client details"""
+    now = datetime.now().isoformat()
+    claim_token = f"{claimer}:{random.getrandbits(32):08x}"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if not conn.in_transaction:
+            cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id FROM trial_notifications
+            WHERE (status = 'pending' AND scheduled_time <= ?)
+               OR (status = 'sending' AND claim_expires_at < ?)
+            ORDER BY scheduled_time
+            LIMIT ?
+        ''', (now, time.time(), limit))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return []
+
+        placeholders = ', '.join('?' for _ in ids)
+        cursor.execute(f'''
+            UPDATE trial_notifications
+            SET status = 'sending', claimed_by = ?, claim_expires_at = ?
+            WHERE id IN ({placeholders})
+        ''', [claim_token, time.time() + NOTIFICATION_CONFIG['claim_ttl']] + ids)
+        cursor.execute(f'''
+            SELECT n.id, n.notification_type, n.retry_count, c.business_name, c.contact_email,
+                   c.account_type, c.trial_end_time
+            FROM trial_notifications n
+            JOIN clients c ON n.client_id = c.client_id
+            WHERE n.id IN ({placeholders})
+        ''', ids)
+        columns = [description[0] for description in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        # Notifications whose client row is gone can never be sent
+        missing = set(ids) - {row['id'] for row in rows}
+        if missing:
+            cursor.executemany("UPDATE trial_notifications SET status = 'cancelled' WHERE id = ?",
+                               [(notification_id,) for notification_id in missing])
+    return rows
+
+def is_obsolete(notification, now):
+    """True when the trial was converted, or an 'expired' mail's trial was extended"""
+    if notification['account_type'] != 'trial':
+        return True
+    if notification['notification_type'] == 'trial_expired' and notification['trial_end_time']:
+        return datetime.fromisoformat(notification['trial_end_time']) > now
+    return False
+
+def record_results(sent, deferred, cancelled, failed):
+    """Write all outcomes of a batch in one transaction"""
+    max_retries = NOTIFICATION_CONFIG['max_retries']
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE trial_notifications
+            SET status = 'sent', sent_time = ?, email_content = ?, claimed_by = NULL, claim_expires_at = NULL
+            WHERE id = ?
+        ''', sent)
+        cursor.executemany('''
+            UPDATE trial_notifications SET status = 'pending', claimed_by = NULL, claim_expires_at = NULL
+            WHERE id = ?
+        ''', [(notification_id,) for notification_id in deferred])
+        cursor.executemany('''
+            UPDATE trial_notifications SET status = 'cancelled', claimed_by = NULL, claim_expires_at = NULL
+            WHERE id = ?
+        ''', [(notification_id,) for notification_id in cancelled])
+        cursor.executemany('''
+            UPDATE trial_notifications
+            SET retry_count = retry_count + 1, last_error = ?, claimed_by = NULL, claim_expires_at = NULL,
+                status = CASE WHEN retry_count + 1 >= ? THEN 'failed' ELSE 'pending' END
+            WHERE id = ?
+        ''', [(error, max_retries, notification_id) for notification_id, error in failed])
+
+class NotificationDispatcher:
+    """Claims due notifications and sends them through a PersistentSMTP session"""
+
+    def __init__(self, email_config, smtp_factory=None):
+        self.email_config = email_config
+        self.smtp = PersistentSMTP(email_config, smtp_factory)
+        self.limiter = DomainRateLimiter(NOTIFICATION_CONFIG['per_domain_per_minute'])
+        self.claimer = make_holder_id()
+        self.metrics = {'batches': 0, 'sent': 0, 'deferred': 0, 'cancelled': 0, 'failed': 0}
+
+    def _message(self, notification):
+        trial_end = notification['trial_end_time']
+        context = {
+            'business_name': notification['business_name'],
+            'trial_end': datetime.fromisoformat(trial_end).strftime('%B %d, %Y %H:%M') if trial_end else 'soon',
+            'from_name': self.email_config['from_name']
+        }
+        subject, body = render_notification(notification['notification_type'], context)
+        message = MIMEText(body, 'plain', 'utf-8')
+        message['Subject'] = subject
+        message['From'] = formataddr((self.email_config['from_name'], self.email_config['email']))
+        message['To'] = notification['contact_email']
+        return message, body
+
+    def dispatch(self):
+        """Send one batch of due notifications; returns the number sent"""
+        notifications = claim_due_notifications(self.claimer, NOTIFICATION_CONFIG['batch_size'])
+        if not notifications:
+            return 0
+
+        now = datetime.now()
+        sent, deferred, cancelled, failed = [], [], [], []
+        smtp_down = False
+        try:
+            for notification in notifications:
+                if is_obsolete(notification, now) or notification['notification_type'] not in NOTIFICATION_TEMPLATES:
+                    cancelled.append(notification['id'])
+                    continue
+                recipient = notification['contact_email']
+                if not self.limiter.allow(recipient.rsplit('@', 1)[-1].lower()):
+                    deferred.append(notification['id'])
+                    continue
+                if smtp_down:
+                    deferred.append(notification['id'])
+                    continue
+                try:
+                    message, body = self._message(notification)
+                    self.smtp.send(message, recipient)
+                    sent.append((datetime.now().isoformat(), body, notification['id']))
+                except Exception as e:
+                    failed.append((notification['id'], str(e)))
+                    # Server unreachable: leave the rest of the batch for the next run
+                    smtp_down = isinstance(e, (OSError, smtplib.SMTPServerDisconnected))
+        finally:
+            record_results(sent, deferred, cancelled, failed)
+
+        self.metrics['batches'] += 1
+        self.metrics['sent'] += len(sent)
+        self.metrics['deferred'] += len(deferred)
+        self.metrics['cancelled'] += len(cancelled)
+        self.metrics['failed'] += len(failed)
+        return len(sent)
+
+    def close(self):
+        self.smtp.close()
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['smtp'] = dict(self.smtp.metrics)
+        return stats
@@ -0,0 +1,121 @@
+"""
+Background Scheduler
+Interval jobs run on one daemon thread per worker, outside the request path
+"""
+
+import os
+import threading
+import time
+
+SCHEDULER_CONFIG = {
+    # Set SCHEDULER_ENABLED=0 on web workers when jobs run in a separate process
+    'enabled': os.environ.get('SCHEDULER_ENABLED', '1').lower() in ('1', 'true', 'yes'),
+    'max_sleep': 60  # seconds; upper bound between due-time checks
+}
+
+class Job:
+    """A named function run every `interval` seconds"""
+
+    def __init__(self, name, interval, func, run_immediately=False):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = time.monotonic() + (0 if run_immediately else interval)
+        self.metrics = {
+            'runs': 0,
+            'failures': 0,
+            'last_duration_ms': 0.0,
+            'last_result': None,
+            'last_error': None,
+            'last_run_at': None
+        }
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            self.metrics['last_result'] = self.func()
+            self.metrics['last_error'] = None
+        except Exception as e:
+            self.metrics['failures'] += 1
+            self.metrics['last_error'] = str(e)
+            print(f"Error in scheduled job {self.name}: {e}")
+        finally:
+            self.metrics['runs'] += 1
+            self.metrics['last_duration_ms'] = (time.perf_counter() - started) * 1000
+            self.metrics['last_run_at'] = time.time()
+            self.next_run = time.monotonic() + self.interval
+
+class Scheduler:
+    """Runs due jobs one at a time on a single daemon thread"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def add_job(self, name, interval, func, run_immediately=False):
+        """Register (or replace) a job by name"""
+        with self._lock:
+            self._jobs[name] = Job(name, interval, func, run_immediately)
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping:
+            now = time.monotonic()
+            with self._lock:
+                jobs = list(self._jobs.values())
+            for job in jobs:
+                if job.next_run <= now and not self._stopping:
+                    job.run()
+
+            with self._lock:
+                next_due = min((job.next_run for job in self._jobs.values()), default=None)
+            delay = SCHEDULER_CONFIG['max_sleep'] if next_due is None else next_due - time.monotonic()
+            self._wakeup.wait(max(0.0, min(delay, SCHEDULER_CONFIG['max_sleep'])))
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(job.metrics, interval=job.interval) for name, job in self._jobs.items()}
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Get this worker's scheduler"""
+    global _scheduler, _scheduler_pid
+    pid = os.getpid()
+    if _scheduler is None or _scheduler_pid != pid:
+        with _scheduler_lock:
+            if _scheduler is None or _scheduler_pid != pid:
+                _scheduler = Scheduler()
+                _scheduler_pid = pid
+    return _scheduler
+
+def schedule_job(name, interval, func, run_immediately=False):
+    """Register an interval job and start the scheduler thread if scheduling is enabled"""
+    scheduler = get_scheduler()
+    scheduler.add_job(name, interval, func, run_immediately)
+    if SCHEDULER_CONFIG['enabled']:
+        scheduler.start()
+    return scheduler
+
+def scheduler_metrics():
+    """Per-job run counters for this worker"""
+    if _scheduler is None or _scheduler_pid != os.getpid():
+        return {}
+    return _scheduler.stats()
@@ -0,0 +1,577 @@
+"""
+Database Schema
+Canonical DDL for the tenant, trial, payment and investigation tables. Nothing runs at import;
+core.migrations applies these as numbered schema versions.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from core.database import ensure_columns
+from core.entitlements import create_entitlements_table, refresh_entitlements
+from core.log_partitions import init_log_storage
+from core.notifications import init_notification_storage
+from core.sessions import create_session_indexes
+from core.tasks import init_task_storage
+from core.trial_expiry import create_trial_indexes
+from core.webhook_inbox import init_webhook_inbox
+
+# Files the investigation app kept its tables in before they moved into the shared database
+LEGACY_INVESTIGATION_DATABASES = [path.strip() for path in os.environ.get(
+    'INVESTIGATION_LEGACY_DB', 'visitors.db,visitor_investigations.db').split(',') if path.strip()]
+
+# Columns that only some services used to create; added to tables an older service created first
+TENANT_COLUMN_UPGRADES = {
+    'clients': {
+        'account_type': "TEXT DEFAULT 'full'",
+        'trial_start_time': 'TIMESTAMP',
+        'trial_end_time': 'TIMESTAMP',
+        'trial_duration_hours': 'INTEGER',
+        'trial_extended_count': 'INTEGER DEFAULT 0',
+        'auto_restricted_at': 'TIMESTAMP',
+        'conversion_date': 'TIMESTAMP',
+        'trial_usage_stats': 'TEXT'
+    },
+    'client_users': {
+        'allowed_ips': 'TEXT',
+        'country_restrictions': 'TEXT',
+        'block_vpn': 'BOOLEAN DEFAULT 0',
+        'trial_restricted': 'BOOLEAN DEFAULT 0'
+    },
+    'user_sessions': {
+        'country_code': 'TEXT',
+        'is_vpn': 'BOOLEAN DEFAULT 0'
+    },
+    'access_logs': {
+        'country_code': 'TEXT',
+        'is_vpn': 'BOOLEAN DEFAULT 0'
+    }
+}
+
+def create_tenant_schema(cursor):
+    """Create (or upgrade) the shared tenant tables and their indexes"""
+    # Clients table - business clients, including trial accounts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT UNIQUE NOT NULL,
+            business_name TEXT NOT NULL,
+            contact_email TEXT NOT NULL,
+            website_url TEXT NOT NULL,
+            access_token TEXT UNIQUE NOT NULL,
+            subscription_status TEXT DEFAULT 'active',
+            account_type TEXT DEFAULT 'full',
+            trial_start_time TIMESTAMP,
+            trial_end_time TIMESTAMP,
+            trial_duration_hours INTEGER,
+            trial_extended_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_access TIMESTAMP,
+            billing_cycle TEXT DEFAULT 'monthly',
+            plan_type TEXT DEFAULT 'basic',
+            max_users INTEGER DEFAULT 5,
+            owner_user_id TEXT,
+            auto_restricted_at TIMESTAMP,
+            conversion_date TIMESTAMP,
+            trial_usage_stats TEXT
+        )
+    ''')
+
+    # Client users table - IP and country restrictions, permissions and session limits
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            role TEXT DEFAULT 'viewer',
+            access_token TEXT UNIQUE NOT NULL,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_access TIMESTAMP,
+            access_expires_at TIMESTAMP,
+            allowed_ips TEXT,
+            country_restrictions TEXT,
+            block_vpn BOOLEAN DEFAULT 0,
+            trial_restricted BOOLEAN DEFAULT 0,
+            permissions TEXT,
+            session_limit INTEGER DEFAULT 1,
+            current_sessions INTEGER DEFAULT 0,
+            notes TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+
+    # User sessions table - active sessions with country info
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            user_id TEXT NOT NULL,
+            client_id TEXT NOT NULL,
+            ip_address TEXT,
+            country_code TEXT,
+            is_vpn BOOLEAN DEFAULT 0,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES client_users (user_id),
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+
+    # Access logs table - legacy audit trail, rolled into monthly partitions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            client_id TEXT,
+            action TEXT NOT NULL,
+            resource TEXT,
+            ip_address TEXT,
+            country_code TEXT,
+            is_vpn BOOLEAN DEFAULT 0,
+            user_agent TEXT,
+            success BOOLEAN DEFAULT 1,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES client_users (user_id),
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+
+    # Visitor investigations table - visitor data per client
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visitor_investigations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            visitor_id TEXT UNIQUE NOT NULL,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            company TEXT,
+            job_title TEXT,
+            location TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            current_page TEXT,
+            pages_visited TEXT,
+            time_on_site_seconds INTEGER DEFAULT 0,
+            visit_start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            interest_level TEXT,
+            traffic_source TEXT,
+            device_type TEXT,
+            browser TEXT,
+            first_visit TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            session_count INTEGER DEFAULT 1,
+            total_page_views INTEGER DEFAULT 1,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+
+    # Admin users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT NOT NULL,
+            role TEXT DEFAULT 'admin',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    ''')
+
+    for table, columns in TENANT_COLUMN_UPGRADES.items():
+        ensure_columns(cursor, table, columns)
+
+    # Precomputed plan, limits and feature flags per client
+    create_entitlements_table(cursor)
+
+    create_session_indexes(cursor)
+    # Session history is read per client in creation order (exports)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_client_created ON user_sessions (client_id, created_at)')
+
+    # Index legacy access_logs and roll it into monthly partitions (the access_log_retention job prunes them)
+    init_log_storage(cursor)
+
+def create_trial_schema(cursor):
+    """Trial management, trial notification and automated task tables"""
+    # Trial management table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trial_management (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trial_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            granted_by TEXT,
+            trial_type TEXT DEFAULT 'standard',
+            duration_hours INTEGER NOT NULL,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_time TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'active',
+            usage_stats TEXT,
+            reminder_sent BOOLEAN DEFAULT 0,
+            expiration_warning_sent BOOLEAN DEFAULT 0,
+            auto_restricted_at TIMESTAMP,
+            extension_count INTEGER DEFAULT 0,
+            conversion_attempted BOOLEAN DEFAULT 0,
+            notes TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+    
+    # Trial notifications table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trial_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notification_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            notification_type TEXT NOT NULL,
+            scheduled_time TIMESTAMP NOT NULL,
+            sent_time TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            email_content TEXT,
+            retry_count INTEGER DEFAULT 0,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+    
+    # Automated tasks table with trial management
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS automated_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT UNIQUE NOT NULL,
+            task_type TEXT NOT NULL,
+            client_id TEXT,
+            trial_id TEXT,
+            status TEXT DEFAULT 'pending',
+            scheduled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            executed_at TIMESTAMP,
+            result TEXT,
+            error_message TEXT,
+            retry_count INTEGER DEFAULT 0,
+            max_retries INTEGER DEFAULT 3,
+            task_data TEXT
+        )
+    ''')
+    
+    create_trial_indexes(cursor)
+    init_task_storage(cursor)
+    init_notification_storage(cursor)
+
+def create_payment_schema(cursor):
+    """Plans, subscriptions, transactions, payment methods, customers and the webhook inbox"""
+    # Payment plans table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            price_monthly DECIMAL(10,2),
+            price_yearly DECIMAL(10,2),
+            max_users INTEGER DEFAULT 5,
+            max_websites INTEGER DEFAULT 1,
+            features TEXT,
+            stripe_price_id_monthly TEXT,
+            stripe_price_id_yearly TEXT,
+            paypal_plan_id_monthly TEXT,
+            paypal_plan_id_yearly TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Subscriptions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            plan_id TEXT NOT NULL,
+            payment_provider TEXT NOT NULL,
+            provider_subscription_id TEXT,
+            status TEXT DEFAULT 'active',
+            billing_cycle TEXT DEFAULT 'monthly',
+            amount DECIMAL(10,2),
+            currency TEXT DEFAULT 'USD',
+            current_period_start TIMESTAMP,
+            current_period_end TIMESTAMP,
+            trial_end TIMESTAMP,
+            cancel_at_period_end BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id),
+            FOREIGN KEY (plan_id) REFERENCES payment_plans (plan_id)
+        )
+    ''')
+    
+    # Payment transactions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            subscription_id TEXT,
+            payment_provider TEXT NOT NULL,
+            provider_transaction_id TEXT,
+            amount DECIMAL(10,2) NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            status TEXT DEFAULT 'pending',
+            payment_method TEXT,
+            description TEXT,
+            invoice_url TEXT,
+            receipt_url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id),
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions (subscription_id)
+        )
+    ''')
+    
+    # Payment methods table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_methods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            method_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            payment_provider TEXT NOT NULL,
+            provider_method_id TEXT,
+            type TEXT,
+            last_four TEXT,
+            brand TEXT,
+            exp_month INTEGER,
+            exp_year INTEGER,
+            is_default BOOLEAN DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+    
+    # Billing addresses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS billing_addresses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            address_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            name TEXT,
+            company TEXT,
+            line1 TEXT,
+            line2 TEXT,
+            city TEXT,
+            state TEXT,
+            postal_code TEXT,
+            country TEXT,
+            phone TEXT,
+            is_default BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+    
+    # Provider-side customer per client, created on the first checkout
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_customers (
+            client_id TEXT NOT NULL,
+            payment_provider TEXT NOT NULL,
+            provider_customer_id TEXT NOT NULL,
+            default_payment_method TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (client_id, payment_provider),
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        )
+    ''')
+    
+    # Entitlement refreshes pick each client's newest subscription
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_client_created
+        ON subscriptions (client_id, created_at)
+    ''')
+    
+    # Webhook updates and lookups go by the provider's subscription id
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_provider_subscription
+        ON subscriptions (payment_provider, provider_subscription_id)
+    ''')
+    
+    # Verified webhook events waiting for the worker
+    init_webhook_inbox(cursor)
+
+# features is the display copy for the pricing page; feature_flags are what entitlements grant
+DEFAULT_PAYMENT_PLANS = [
+    {
+        'plan_id': 'basic',
+        'name': 'Basic Plan',
+        'description': 'Perfect for small businesses',
+        'price_monthly': 29.99,
+        'price_yearly': 299.99,
+        'max_users': 5,
+        'max_websites': 1,
+        'features': json.dumps([
+            'Up to 5 users',
+            '1 website tracking',
+            'Basic visitor analytics',
+            'Email support',
+            'CSV export'
+        ]),
+        'feature_flags': json.dumps({'csv_export': True, 'excel_export': False, 'api_access': False,
+                                     'custom_reports': False, 'audit_logs': True, 'white_label': False})
+    },
+    {
+        'plan_id': 'professional',
+        'name': 'Professional Plan',
+        'description': 'For growing businesses',
+        'price_monthly': 79.99,
+        'price_yearly': 799.99,
+        'max_users': 15,
+        'max_websites': 5,
+        'features': json.dumps([
+            'Up to 15 users',
+            '5 websites tracking',
+            'Advanced analytics',
+            'Priority support',
+            'Excel & CSV export',
+            'API access',
+            'Custom reports'
+        ]),
+        'feature_flags': json.dumps({'csv_export': True, 'excel_export': True, 'api_access': True,
+                                     'custom_reports': True, 'audit_logs': True, 'white_label': False})
+    },
+    {
+        'plan_id': 'enterprise',
+        'name': 'Enterprise Plan',
+        'description': 'For large organizations',
+        'price_monthly': 199.99,
+        'price_yearly': 1999.99,
+        'max_users': 50,
+        'max_websites': 25,
+        'features': json.dumps([
+            'Up to 50 users',
+            '25 websites tracking',
+            'Enterprise analytics',
+            'Dedicated support',
+            'All export formats',
+            'Full API access',
+            'Custom integrations',
+            'White-label options'
+        ]),
+        'feature_flags': json.dumps({'csv_export': True, 'excel_export': True, 'api_access': True,
+                                     'custom_reports': True, 'audit_logs': True, 'white_label': True})
+    }
+]
+
+def seed_payment_plans(cursor):
+    """Insert or update the default plans, keeping cached provider ids while prices are unchanged"""
+    for plan in DEFAULT_PAYMENT_PLANS:
+        cursor.execute('''
+            INSERT INTO payment_plans 
+            (plan_id, name, description, price_monthly, price_yearly, max_users, max_websites, features)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (plan_id) DO UPDATE SET
+                name = excluded.name, description = excluded.description,
+                max_users = excluded.max_users, max_websites = excluded.max_websites,
+                features = excluded.features,
+                -- Keep the cached provider ids unless the price they were created for changed
+                stripe_price_id_monthly = CASE WHEN price_monthly = excluded.price_monthly
+                                               THEN stripe_price_id_monthly END,
+                paypal_plan_id_monthly = CASE WHEN price_monthly = excluded.price_monthly
+                                              THEN paypal_plan_id_monthly END,
+                stripe_price_id_yearly = CASE WHEN price_yearly = excluded.price_yearly
+                                              THEN stripe_price_id_yearly END,
+                paypal_plan_id_yearly = CASE WHEN price_yearly = excluded.price_yearly
+                                             THEN paypal_plan_id_yearly END,
+                price_monthly = excluded.price_monthly, price_yearly = excluded.price_yearly
+        ''', (plan['plan_id'], plan['name'], plan['description'], plan['price_monthly'],
+              plan['price_yearly'], plan['max_users'], plan['max_websites'], plan['features']))
+
+def add_plan_feature_flags(cursor):
+    """Store each plan's feature flags on its payment_plans row and re-derive every client's entitlements"""
+    ensure_columns(cursor, 'payment_plans', {'feature_flags': 'TEXT'})
+    # Migration 4 seeded the plans before this column existed, so the flags are written here
+    seed_payment_plans(cursor)
+    cursor.executemany('UPDATE payment_plans SET feature_flags = ? WHERE plan_id = ?',
+                       [(plan['feature_flags'], plan['plan_id']) for plan in DEFAULT_PAYMENT_PLANS])
+    cursor.execute('SELECT client_id FROM clients')
+    refresh_entitlements(cursor, [row[0] for row in cursor.fetchall()])
+
+def create_investigation_schema(cursor):
+    """Tables behind the investigation dashboard (formerly visitors.db) and its default admin"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visitors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            website_url TEXT,
+            ip_address TEXT,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            company TEXT,
+            title TEXT,
+            industry TEXT,
+            location TEXT,
+            country TEXT,
+            region TEXT,
+            city TEXT,
+            device TEXT,
+            browser TEXT,
+            current_page TEXT,
+            pages_visited TEXT,
+            duration INTEGER,
+            interest_level TEXT,
+            referral_source TEXT,
+            session_count INTEGER,
+            total_page_views INTEGER,
+            last_activity TIMESTAMP,
+            first_visit TIMESTAMP,
+            investigation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password_hash TEXT,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    admin_password = hashlib.sha256('admin123'.encode()).hexdigest()
+    cursor.execute('INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?, ?, ?)',
+                   ('admin', admin_password, 'admin'))
+
+def _copy_legacy_table(cursor, legacy, table):
+    """Copy a legacy table's rows over the columns both versions have; returns the row count"""
+    legacy_columns = {row[1] for row in legacy.execute(f'PRAGMA table_info({table})')}
+    cursor.execute(f'PRAGMA table_info({table})')
+    columns = [row[1] for row in cursor.fetchall() if row[1] in legacy_columns and row[1] != 'id']
+    if not columns:
+        return 0
+    rows = legacy.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id").fetchall()
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    if table == 'users' and 'username' in columns:
+        # The old file's accounts win over the default admin seeded by migration 6
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'username')
+        statement += f' ON CONFLICT (username) DO UPDATE SET {updates}' if updates else ' ON CONFLICT DO NOTHING'
+    cursor.executemany(statement, rows)
+    return len(rows)
+
+def import_legacy_investigations(cursor, paths=None):
+    """Copy logins and visitor rows from the investigation app's old database files"""
+    for path in LEGACY_INVESTIGATION_DATABASES if paths is None else paths:
+        if not os.path.exists(path):
+            continue
+        legacy = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            imported = {table: _copy_legacy_table(cursor, legacy, table) for table in ('users', 'visitors')}
+        finally:
+            legacy.close()
+        print(f"Imported investigation data from {path}: {imported['users']} users, "
+              f"{imported['visitors']} visitors")
@@ -0,0 +1,201 @@
+"""
+Signed Session Tokens
+Short-lived HMAC-signed tokens issued by the dashboard exchange. API calls that
+carry one are authorized from its claims alone; revocations go to a compact
+in-memory denylist, shared between workers through session_revocations.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from core.database import get_connection
+from core.signing_keys import purpose_keys
+
+SESSION_TOKEN_CONFIG = {
+    'ttl_seconds': int(os.environ.get('SESSION_TOKEN_TTL', '900')),
+    'key_purpose': 'session-token',  # signing keys come from the shared keyring (core.signing_keys)
+    'header': 'X-Session-Token',
+    'revocation_sync_interval': float(os.environ.get('SESSION_REVOCATION_SYNC', '5'))  # seconds
+}
+
+# Bit per permission in the compiled mask; append only, tokens in flight depend on the order
+PERMISSION_BITS = {name: 1 << bit for bit, name in enumerate([
+    'view_visitors', 'view_basic_info', 'view_contact_info', 'view_email', 'view_phone',
+    'view_company', 'view_all_interest_levels', 'manage_users', 'delete_data', 'export_data',
+    'view_audit_logs'
+])}
+
+def create_revocation_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL,
+            subject_id TEXT NOT NULL,
+            revoked_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_session_revocations_revoked_at
+        ON session_revocations (revoked_at)
+    ''')
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(payload, key):
+    return _b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+def token_fingerprint(access_token):
+    """Short hash binding a session token to the URL token it was exchanged for"""
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+def compile_permission_mask(user_data, has_permission):
+    mask = 0
+    for name, bit in PERMISSION_BITS.items():
+        if has_permission(user_data, name):
+            mask |= bit
+    return mask
+
+def issue_session_token(claims, not_after=None):
+    """Sign claims (adds iat/exp, never later than not_after); returns (token, exp epoch seconds)"""
+    now = time.time()
+    expires_at = int(now) + SESSION_TOKEN_CONFIG['ttl_seconds']
+    if not_after is not None:
+        expires_at = min(expires_at, int(not_after))
+    claims = dict(claims, iat=now, exp=expires_at)
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f"{payload}.{_sign(payload, purpose_keys(SESSION_TOKEN_CONFIG['key_purpose'])[0])}", claims['exp']
+
+def decode_session_token(token):
+    """Claims of a well-signed, unexpired, unrevoked token, or None"""
+    try:
+        payload, signature = token.split('.')
+        # Newest key first; older keys still verify tokens issued before a rotation
+        if not any(hmac.compare_digest(signature, _sign(payload, key))
+                   for key in purpose_keys(SESSION_TOKEN_CONFIG['key_purpose'])):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if claims.get('exp', 0) <= time.time() or denylist.is_revoked(claims):
+        return None
+    return claims
+
+class SessionDenylist:
+    """Revocation times by user and client; tokens issued at or before them are rejected.
+
+    Entries only need to outlive the token TTL, so the list stays small. Other
+    workers' revocations are read from session_revocations at most once per
+    sync interval, on the request path (no scheduler needed on web workers).
+    """
+
+    def __init__(self, ttl_seconds, sync_interval):
+        self.ttl_seconds = ttl_seconds
+        self.sync_interval = sync_interval
+        self._revoked = {}  # (scope, subject_id) -> revoked_at
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._next_sync = 0.0
+        self._pid = None
+        self.metrics = {'revocations': 0, 'rejected': 0, 'syncs': 0, 'sync_errors': 0}
+
+    def _add(self, scope, subject_id, revoked_at):
+        key = (scope, subject_id)
+        if revoked_at > self._revoked.get(key, 0):
+            self._revoked[key] = revoked_at
+
+    def _prune(self, now):
+        cutoff = now - self.ttl_seconds
+        for key in [key for key, revoked_at in self._revoked.items() if revoked_at < cutoff]:
+            del self._revoked[key]
+
+    def revoke(self, scope, subject_ids):
+        """Revoke tokens of these users or clients here and for every other worker"""
+        subject_ids = list(dict.fromkeys(subject_ids))
+        if not subject_ids:
+            return
+        now = time.time()
+        with self._lock:
+            for subject_id in subject_ids:
+                self._add(scope, subject_id, now)
+            self.metrics['revocations'] += len(subject_ids)
+        with get_connection() as conn:
+            conn.cursor().executemany('''
+                INSERT INTO session_revocations (scope, subject_id, revoked_at) VALUES (?, ?, ?)
+            ''', [(scope, subject_id, now) for subject_id in subject_ids])
+
+    def sync(self, force=False):
+        """Pull revocations recorded by other workers since the last sync"""
+        now = time.time()
+        with self._lock:
+            if self._pid != os.getpid():
+                # New or forked worker: start from everything still within the TTL
+                self._pid = os.getpid()
+                self._last_id = 0
+                self._next_sync = 0.0
+            if not force and now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval
+            last_id = self._last_id
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, scope, subject_id, revoked_at FROM session_revocations
+                    WHERE id > ? AND revoked_at >= ?
+                    ORDER BY id
+                ''', (last_id, now - self.ttl_seconds))
+                rows = cursor.fetchall()
+        except Exception as e:
+            self.metrics['sync_errors'] += 1
+            print(f"Error syncing session revocations: {e}")
+            return
+        with self._lock:
+            for row_id, scope, subject_id, revoked_at in rows:
+                self._add(scope, subject_id, revoked_at)
+                self._last_id = max(self._last_id, row_id)
+            self._prune(now)
+            self.metrics['syncs'] += 1
+
+    def is_revoked(self, claims):
+        self.sync()
+        issued_at = claims.get('iat', 0)
+        with self._lock:
+            revoked = (self._revoked.get(('user', claims.get('u')), 0) >= issued_at
+                       or self._revoked.get(('client', claims.get('c')), 0) >= issued_at)
+            if revoked:
+                self.metrics['rejected'] += 1
+        return revoked
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._revoked)
+        return stats
+
+denylist = SessionDenylist(SESSION_TOKEN_CONFIG['ttl_seconds'], SESSION_TOKEN_CONFIG['revocation_sync_interval'])
+
+def revoke_user_sessions(user_ids):
+    denylist.revoke('user', user_ids)
+
+def revoke_client_sessions(client_ids):
+    denylist.revoke('client', client_ids)
+
+def purge_session_revocations():
+    """Delete revocation rows older than any token could be; returns the number removed"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM session_revocations WHERE revoked_at < ?',
+                       (time.time() - SESSION_TOKEN_CONFIG['ttl_seconds'],))
+        return cursor.rowcount
+
+def session_token_metrics():
+    return denylist.stats()
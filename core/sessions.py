@@ -0,0 +1,57 @@
+"""
+Session Maintenance
+Indexes for user_sessions and a bounded, incremental expiry sweep
+"""
+
+import os
+from datetime import datetime
+
+from core.database import get_connection
+
+SESSION_CONFIG = {
+    'sweep_interval': int(os.environ.get('SESSION_SWEEP_INTERVAL', '300')),  # seconds
+    'sweep_batch_size': 500,  # sessions expired per transaction
+    'sweep_max_batches': 20  # per run; the rest waits for the next run
+}
+
+def create_session_indexes(cursor):
+    """Indexes for session counting and the expiry sweep"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_user_active_expiry
+        ON user_sessions (user_id, is_active, expires_at)
+    ''')
+    # Partial index: only live sessions are ever scanned by the sweep
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_active_expiry
+        ON user_sessions (expires_at) WHERE is_active = 1
+    ''')
+
+def session_now():
+    """Current time in the format user_sessions.expires_at is stored in"""
+    # expires_at is written with datetime.now().isoformat(), so compare like with like
+    return datetime.now().isoformat()
+
+def expire_sessions(batch_size=None, max_batches=None):
+    """Deactivate expired sessions a batch at a time; returns the number expired"""
+    batch_size = batch_size or SESSION_CONFIG['sweep_batch_size']
+    max_batches = max_batches or SESSION_CONFIG['sweep_max_batches']
+    now = session_now()
+    expired = 0
+    for _ in range(max_batches):
+        # Each batch is its own short transaction so writers are never blocked for long
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_sessions SET is_active = 0
+                WHERE id IN (
+                    SELECT id FROM user_sessions
+                    WHERE is_active = 1 AND expires_at <= ?
+                    ORDER BY expires_at
+                    LIMIT ?
+                )
+            ''', (now, batch_size))
+            count = cursor.rowcount
+        expired += count
+        if count < batch_size:
+            break
+    return expired
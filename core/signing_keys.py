@@ -0,0 +1,90 @@
+"""
+Signing Keys
+One keyring per deployment for Flask session cookies and session tokens. The
+first key signs; every key verifies, so keys can be rotated without logging
+anyone out. Each purpose signs with its own key derived from the keyring.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from datetime import datetime
+
+from core.database import get_connection
+
+SIGNING_KEY_CONFIG = {
+    # Comma-separated, signing key first. To rotate: append the new key everywhere,
+    # then move it to the front, then drop the old one once what it signed has expired.
+    'keys': os.environ.get('SECRET_KEYS', ''),
+    'keys_file': os.environ.get('SECRET_KEYS_FILE', ''),  # one key per line, newest first
+    # Without configured keys, workers share a key generated once into the database
+    'allow_generated': os.environ.get('SECRET_KEYS_GENERATE', '1').lower() in ('1', 'true', 'yes')
+}
+
+_keyring = None
+_keyring_lock = threading.Lock()
+_derived = {}  # purpose -> derived keys for the current keyring
+
+def create_secrets_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_secrets (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+def _configured_keys(config):
+    keys = [key.strip() for key in config['keys'].split(',') if key.strip()]
+    if config['keys_file']:
+        with open(config['keys_file']) as handle:
+            keys.extend(line.strip() for line in handle if line.strip() and not line.startswith('#'))
+    return keys
+
+def _generated_key():
+    """The deployment's generated key; the first worker to ask creates it"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO app_secrets (name, value, created_at) VALUES (?, ?, ?)',
+                       ('signing_key', secrets.token_hex(32), datetime.now().isoformat()))
+        cursor.execute("SELECT value FROM app_secrets WHERE name = 'signing_key'")
+        return cursor.fetchone()[0]
+
+def load_keyring(config=None):
+    """Signing keys, newest first, from configuration (or the app_secrets key every worker shares)"""
+    config = config or SIGNING_KEY_CONFIG
+    keys = _configured_keys(config)
+    if not keys:
+        if not config['allow_generated']:
+            raise RuntimeError('No signing keys configured - set SECRET_KEYS or SECRET_KEYS_FILE')
+        keys = [_generated_key()]
+    return [key.encode() for key in dict.fromkeys(keys)]
+
+def get_keyring():
+    """This process's keyring, loaded on first use"""
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = load_keyring()
+    return _keyring
+
+def set_keyring(keys):
+    """Install keys (newest first); None reloads from configuration on next use"""
+    global _keyring
+    with _keyring_lock:
+        _keyring = [key.encode() if isinstance(key, str) else key for key in keys] if keys is not None else None
+        _derived.clear()
+
+def purpose_keys(purpose):
+    """Keys derived for one purpose, newest (signing) first"""
+    keys = _derived.get(purpose)
+    if keys is None:
+        keys = _derived[purpose] = [hmac.new(key, purpose.encode(), hashlib.sha256).digest()
+                                    for key in get_keyring()]
+    return keys
+
+def keyring_metrics():
+    return {'keys': len(_keyring) if _keyring is not None else 0}
@@ -0,0 +1,48 @@
+"""
+Startup Hooks
+Explicit per-process startup work (schema, background threads) registered at import
+and run by the application factory or worker entry point, never at import time
+"""
+
+import os
+import threading
+import time
+
+# (name, func) in registration order
+STARTUP_HOOKS = []
+
+_completed_pid = None
+_lock = threading.Lock()
+_timings = {}
+
+def on_startup(func=None, name=None):
+    """Decorator registering a function to run once per process at startup"""
+    def decorator(f):
+        hook_name = name or f"{f.__module__}.{f.__name__}"
+        if all(existing != hook_name for existing, _ in STARTUP_HOOKS):
+            STARTUP_HOOKS.append((hook_name, f))
+        return f
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+def run_startup_hooks():
+    """Run every registered hook once in this process; returns per-hook timings in ms.
+
+    Hooks registered after a run (a module imported later) run on the next call.
+    """
+    global _completed_pid
+    with _lock:
+        if _completed_pid != os.getpid():
+            _timings.clear()  # forked worker: run everything again in this process
+            _completed_pid = os.getpid()
+        for hook_name, func in STARTUP_HOOKS:
+            if hook_name in _timings:
+                continue
+            started = time.perf_counter()
+            func()
+            _timings[hook_name] = round((time.perf_counter() - started) * 1000, 2)
+        return dict(_timings)
+
+def startup_metrics():
+    return dict(_timings) if _completed_pid == os.getpid() else {}
@@ -0,0 +1,250 @@
+"""
+Automated Task Runner
+Claims due automated_tasks rows under an expiring lease and runs them on a bounded thread pool
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from core.database import ensure_columns, get_connection
+from core.leases import make_holder_id
+
+TASK_CONFIG = {
+    'workers': int(os.environ.get('TASK_WORKERS', '4')),
+    'poll_interval': float(os.environ.get('TASK_POLL_INTERVAL', '2')),  # seconds between claims when idle
+    'claim_ttl': 300,  # seconds before a claimed task from a dead worker is reclaimed
+    'backoff_base': 30,  # seconds; doubled on every retry
+    'backoff_max': 3600,
+    'metrics_window': 300  # seconds of completions used for the throughput figure
+}
+
+# task_type -> handler(task) returning a JSON-serialisable result
+TASK_HANDLERS = {}
+
+def register_task(task_type):
+    """Decorator registering the handler for a task type"""
+    def decorator(func):
+        TASK_HANDLERS[task_type] = func
+        return func
+    return decorator
+
+def init_task_storage(cursor):
+    """Claim columns and the due-task index on automated_tasks"""
+    ensure_columns(cursor, 'automated_tasks', {
+        'claimed_by': 'TEXT',
+        'claim_expires_at': 'REAL',
+        'started_at': 'TIMESTAMP'
+    })
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_automated_tasks_status_scheduled
+        ON automated_tasks (status, scheduled_at)
+    ''')
+
+def backoff_delay(retry_count):
+    """Exponential backoff with jitter for the given retry number"""
+    delay = min(TASK_CONFIG['backoff_base'] * (2 ** retry_count), TASK_CONFIG['backoff_max'])
+    return delay * random.uniform(0.8, 1.2)
+
+def claim_tasks(claimer, limit):
+    """Atomically claim up to `limit` due tasks (plus tasks whose claim lapsed)"""
+    now = datetime.now().isoformat()
+    claim_token = f"{claimer}:{random.getrandbits(32):08x}"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if not conn.in_transaction:
+            # Take the write lock before selecting so no other runner can claim the same rows
+            cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id FROM automated_tasks
+            WHERE (status = 'pending' AND scheduled_at <= ?)
+               OR (status = 'running' AND claim_expires_at < ?)
+            ORDER BY scheduled_at
+            LIMIT ?
+        ''', (now, time.time(), limit))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return []
+
+        placeholders = ', '.join('?' for _ in ids)
+        cursor.execute(f'''
+            UPDATE automated_tasks
+            SET status = 'running', claimed_by = ?, claim_expires_at = ?, started_at = ?
+            WHERE id IN ({placeholders})
+        ''', [claim_token, time.time() + TASK_CONFIG['claim_ttl'], now] + ids)
+        cursor.execute(f'''
+            SELECT id, task_id, task_type, client_id, trial_id, scheduled_at,
+                   retry_count, max_retries, task_data
+            FROM automated_tasks WHERE id IN ({placeholders})
+        ''', ids)
+        columns = [description[0] for description in cursor.description]
+        tasks = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for task in tasks:
+        task['claim_token'] = claim_token
+        task['task_data'] = json.loads(task['task_data']) if task['task_data'] else None
+    return tasks
+
+def complete_task(task, result):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE automated_tasks
+            SET status = 'completed', executed_at = ?, result = ?, error_message = NULL,
+                claimed_by = NULL, claim_expires_at = NULL
+            WHERE id = ? AND claimed_by = ?
+        ''', (datetime.now().isoformat(), json.dumps(result), task['id'], task['claim_token']))
+
+def fail_task(task, error):
+    """Reschedule with backoff, or mark failed once max_retries is used up; returns True if retried"""
+    retry_count = (task['retry_count'] or 0) + 1
+    retry = retry_count <= (task['max_retries'] if task['max_retries'] is not None else 3)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if retry:
+            next_attempt = datetime.now() + timedelta(seconds=backoff_delay(retry_count - 1))
+            cursor.execute('''
+                UPDATE automated_tasks
+                SET status = 'pending', retry_count = ?, scheduled_at = ?, error_message = ?,
+                    claimed_by = NULL, claim_expires_at = NULL
+                WHERE id = ? AND claimed_by = ?
+            ''', (retry_count, next_attempt.isoformat(), error, task['id'], task['claim_token']))
+        else:
+            cursor.execute('''
+                UPDATE automated_tasks
+                SET status = 'failed', retry_count = ?, executed_at = ?, error_message = ?,
+                    claimed_by = NULL, claim_expires_at = NULL
+                WHERE id = ? AND claimed_by = ?
+            ''', (retry_count, datetime.now().isoformat(), error, task['id'], task['claim_token']))
+    return retry
+
+class TaskRunner:
+    """Polls for due tasks and keeps at most `workers` of them running"""
+
+    def __init__(self, workers=None, handlers=None):
+        self.workers = workers or TASK_CONFIG['workers']
+        self.handlers = handlers if handlers is not None else TASK_HANDLERS
+        self.claimer = make_holder_id()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='task')
+        self._slots = threading.Semaphore(self.workers)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._completions = deque()
+        self.metrics = {
+            'claimed': 0,
+            'completed': 0,
+            'retried': 0,
+            'failed': 0,
+            'in_flight': 0,
+            'last_queue_lag_ms': 0.0,
+            'max_queue_lag_ms': 0.0
+        }
+
+    def _count(self, metric, amount=1):
+        with self._lock:
+            self.metrics[metric] += amount
+
+    def _execute(self, task):
+        try:
+            handler = self.handlers.get(task['task_type'])
+            if handler is None:
+                raise LookupError(f"No handler registered for task type {task['task_type']}")
+            result = handler(task)
+            complete_task(task, result)
+            self._count('completed')
+            with self._lock:
+                self._completions.append(time.monotonic())
+        except Exception as e:
+            print(f"Task {task['task_id']} ({task['task_type']}) failed: {e}")
+            try:
+                self._count('retried' if fail_task(task, str(e)) else 'failed')
+            except Exception as record_error:
+                # The claim will lapse and the task will be picked up again
+                print(f"Could not record failure of task {task['task_id']}: {record_error}")
+        finally:
+            self._count('in_flight', -1)
+            self._slots.release()
+
+    def run_once(self):
+        """Claim as many due tasks as there are free workers; returns the number dispatched"""
+        free = 0
+        while self._slots.acquire(blocking=False):
+            free += 1
+        if not free:
+            return 0
+
+        try:
+            tasks = claim_tasks(self.claimer, free)
+        except Exception:
+            for _ in range(free):
+                self._slots.release()
+            raise
+        for _ in range(free - len(tasks)):
+            self._slots.release()
+
+        now = datetime.now()
+        for task in tasks:
+            try:
+                lag_ms = max(0.0, (now - datetime.fromisoformat(task['scheduled_at'])).total_seconds() * 1000)
+            except (TypeError, ValueError):
+                lag_ms = 0.0
+            with self._lock:
+                self.metrics['claimed'] += 1
+                self.metrics['in_flight'] += 1
+                self.metrics['last_queue_lag_ms'] = lag_ms
+                self.metrics['max_queue_lag_ms'] = max(self.metrics['max_queue_lag_ms'], lag_ms)
+            self._executor.submit(self._execute, task)
+        return len(tasks)
+
+    def run_forever(self):
+        """Main loop for the worker process"""
+        print(f"Task runner {self.claimer} started with {self.workers} workers "
+              f"for: {', '.join(sorted(self.handlers)) or 'no handlers'}")
+        while not self._stopping.is_set():
+            try:
+                dispatched = self.run_once()
+            except Exception as e:
+                print(f"Error claiming tasks: {e}")
+                dispatched = 0
+            if not dispatched:
+                self._stopping.wait(TASK_CONFIG['poll_interval'])
+
+    def stop(self, wait=True):
+        self._stopping.set()
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        window = TASK_CONFIG['metrics_window']
+        cutoff = time.monotonic() - window
+        with self._lock:
+            while self._completions and self._completions[0] < cutoff:
+                self._completions.popleft()
+            stats = dict(self.metrics)
+            stats['throughput_per_minute'] = len(self._completions) * 60.0 / window
+        return stats
+
+def task_queue_metrics():
+    """Queue depth and lag as seen from the database (safe to call from any process)"""
+    now = datetime.now()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*), MIN(scheduled_at) FROM automated_tasks
+            WHERE status = 'pending' AND scheduled_at <= ?
+        ''', (now.isoformat(),))
+        due, oldest = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) FROM automated_tasks WHERE status = 'running'")
+        running = cursor.fetchone()[0]
+
+    lag_seconds = 0.0
+    if oldest:
+        try:
+            lag_seconds = max(0.0, (now - datetime.fromisoformat(oldest)).total_seconds())
+        except ValueError:
+            pass
+    return {'due': due, 'running': running, 'oldest_due_lag_seconds': lag_seconds}
@@ -0,0 +1,226 @@
+"""
+Access Token Front Door
+A Bloom filter of every issued access token plus a bounded negative cache, so
+random or revoked tokens are rejected before verify_user_access reaches SQLite
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from core.auth_cache import register_cache
+from core.database import get_connection
+
+TOKEN_FILTER_CONFIG = {
+    'enabled': os.environ.get('TOKEN_FILTER_ENABLED', '1').lower() in ('1', 'true', 'yes'),
+    'capacity': int(os.environ.get('TOKEN_FILTER_CAPACITY', '100000')),  # grows by rebuilding when exceeded
+    'error_rate': float(os.environ.get('TOKEN_FILTER_ERROR_RATE', '0.001')),
+    # On a miss, pick up tokens other workers created, at most this often (seconds)
+    'sync_interval': float(os.environ.get('TOKEN_FILTER_SYNC_INTERVAL', '1')),
+    'negative_cache_size': int(os.environ.get('TOKEN_NEGATIVE_CACHE_SIZE', '50000')),
+    'negative_ttl': float(os.environ.get('TOKEN_NEGATIVE_TTL', '30'))
+}
+
+class BloomFilter:
+    """Fixed-size bit array with k double-hashed probes; no false negatives"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=16).digest(), 'little')
+        h1, h2 = digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        # Unknown tokens usually stop at the first or second unset bit
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+class NegativeTokenCache:
+    """Tokens that passed the filter but failed the DB lookup, with a short TTL.
+
+    Registered with the auth cache invalidation helpers: any user or client
+    change clears it, so a reactivated account is never held back.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.name = 'negative_tokens'
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # access_token -> expires
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'stored': 0, 'cleared': 0}
+
+    def __contains__(self, access_token):
+        with self._lock:
+            expires = self._entries.get(access_token)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._entries[access_token]
+                return False
+            self.metrics['hits'] += 1
+            return True
+
+    def put(self, access_token):
+        with self._lock:
+            self._entries.pop(access_token, None)
+            self._entries[access_token] = time.monotonic() + self.ttl_seconds
+            self.metrics['stored'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_token(self, access_token):
+        with self._lock:
+            self._entries.pop(access_token, None)
+
+    def invalidate_user(self, user_id):
+        self.clear()
+
+    def invalidate_client(self, client_id):
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.metrics['cleared'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._entries)
+        return stats
+
+class TokenFilter:
+    """Per-worker Bloom filter of client_users access tokens.
+
+    Built from the table on first use (or by the startup hook), extended in
+    place for tokens this worker creates, and caught up from client_users by
+    id for tokens created elsewhere before a miss is trusted.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or TOKEN_FILTER_CONFIG
+        self.negative = NegativeTokenCache(self.config['negative_cache_size'], self.config['negative_ttl'])
+        register_cache(self.negative)
+        self._bloom = None
+        self._last_id = 0
+        self._next_sync = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.metrics = {'rejected': 0, 'passed': 0, 'rebuilds': 0, 'syncs': 0, 'last_rebuild_ms': 0.0}
+
+    def rebuild(self):
+        """Load every access token into a new filter sized for the current table"""
+        started = time.perf_counter()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*), MAX(id) FROM client_users')
+            count, last_id = cursor.fetchone()
+            bloom = BloomFilter(max(self.config['capacity'], 2 * (count or 0)), self.config['error_rate'])
+            cursor.execute('SELECT access_token FROM client_users WHERE id <= ?', (last_id or 0,))
+            for (access_token,) in cursor:
+                bloom.add(access_token)
+        with self._lock:
+            self._bloom = bloom
+            self._last_id = last_id or 0
+            self._next_sync = time.monotonic() + self.config['sync_interval']
+            self._pid = os.getpid()
+            self.metrics['rebuilds'] += 1
+            self.metrics['last_rebuild_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _ensure_built(self):
+        if self._bloom is None or self._pid != os.getpid():
+            self.rebuild()
+
+    def add(self, access_token):
+        """Record a token this worker just created (other workers pick it up on sync)"""
+        if not self.config['enabled']:
+            return
+        self._ensure_built()
+        with self._lock:
+            self._bloom.add(access_token)
+            grow = self._bloom.count > self._bloom.capacity
+        self.negative.invalidate_token(access_token)
+        if grow:
+            self.rebuild()
+
+    def _sync(self):
+        """Add tokens inserted since the last sync, by any worker"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, access_token FROM client_users WHERE id > ? ORDER BY id',
+                           (self._last_id,))
+            rows = cursor.fetchall()
+        with self._lock:
+            for row_id, access_token in rows:
+                self._bloom.add(access_token)
+                self._last_id = max(self._last_id, row_id)
+            self._next_sync = time.monotonic() + self.config['sync_interval']
+            self.metrics['syncs'] += 1
+            grow = self._bloom.count > self._bloom.capacity
+        for _, access_token in rows:
+            self.negative.invalidate_token(access_token)
+        if grow:
+            self.rebuild()
+
+    def might_exist(self, access_token):
+        """False only for tokens that certainly do not exist or just failed a DB lookup"""
+        if not self.config['enabled']:
+            return True
+        self._ensure_built()
+        if access_token in self._bloom:
+            if access_token in self.negative:
+                self.metrics['rejected'] += 1
+                return False
+            self.metrics['passed'] += 1
+            return True
+        with self._sync_lock:
+            # A flood of unknown tokens costs at most one indexed read per sync interval
+            synced = time.monotonic() >= self._next_sync
+            if synced:
+                self._sync()
+        if synced:
+            if access_token in self._bloom:
+                self.metrics['passed'] += 1
+                return True
+        self.metrics['rejected'] += 1
+        return False
+
+    def record_miss(self, access_token):
+        """The DB lookup found no usable record for a token the filter let through"""
+        if self.config['enabled']:
+            self.negative.put(access_token)
+
+    def stats(self):
+        stats = dict(self.metrics)
+        bloom = self._bloom
+        if bloom is not None:
+            stats.update(tokens=bloom.count, capacity=bloom.capacity, bits=bloom.size, hashes=bloom.hashes)
+        stats['negative_cache'] = self.negative.stats()
+        return stats
+
+token_filter = TokenFilter()
+
+def token_filter_metrics():
+    return token_filter.stats()
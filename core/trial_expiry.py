@@ -0,0 +1,182 @@
+"""
+Trial Expiry Scheduler
+One lease-elected worker keeps a min-heap of trial deadlines and restricts trials as they expire
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from core.database import get_connection
+from core.leases import make_holder_id, release_lease, try_acquire_lease
+
+TRIAL_EXPIRY_CONFIG = {
+    'lease_name': 'trial_expiry',
+    'lease_ttl': 60,  # seconds; a crashed leader is replaced within this window
+    'renew_interval': 20,
+    # Deadlines due within the horizon are loaded from the DB on every refresh.
+    # Trials last at least one hour, so any trial created on another worker is
+    # picked up well before it expires.
+    'refresh_interval': int(os.environ.get('TRIAL_EXPIRY_REFRESH', '300')),
+    'horizon_seconds': 3600
+}
+
+def create_trial_indexes(cursor):
+    """Indexes backing the deadline load and the set-based trial restriction"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_clients_account_type_trial_end
+        ON clients (account_type, trial_end_time)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_trial_management_client ON trial_management (client_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_client_users_client ON client_users (client_id)')
+
+class TrialExpiryScheduler:
+    """Fires restrict_func(client_ids) at each trial deadline while holding the lease.
+
+    restrict_func returns {'restricted': count, 'batches': [per-batch timings]}.
+    """
+
+    def __init__(self, restrict_func):
+        self.restrict_func = restrict_func
+        self.holder = make_holder_id()
+        self._heap = []  # (trial_end, client_id)
+        self._deadlines = {}  # client_id -> latest known trial_end; older heap entries are stale
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.is_leader = False
+        self._next_renew = 0.0
+        self._next_refresh = 0.0
+        self.metrics = {
+            'fired': 0,
+            'restricted': 0,
+            'refreshes': 0,
+            'leader_changes': 0,
+            'last_fire_lag_ms': 0.0,
+            'last_batches': [],
+            'last_error': None
+        }
+
+    def push(self, client_id, trial_end):
+        """Track a new or moved deadline (call after creating or extending a trial)"""
+        if not self.is_leader:
+            return  # Only the leader fires; a new leader reloads everything from the DB
+        if isinstance(trial_end, str):
+            trial_end = datetime.fromisoformat(trial_end)
+        with self._lock:
+            self._deadlines[client_id] = trial_end
+            heapq.heappush(self._heap, (trial_end, client_id))
+        self._wakeup.set()
+
+    def discard(self, client_id):
+        """Stop tracking a trial (converted or restricted by hand)"""
+        with self._lock:
+            self._deadlines.pop(client_id, None)
+
+    def load_deadlines(self):
+        """Load unrestricted trials ending before the horizon (including overdue ones)"""
+        horizon = (datetime.now() + timedelta(seconds=TRIAL_EXPIRY_CONFIG['horizon_seconds'])).isoformat()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT client_id, trial_end_time FROM clients
+                WHERE account_type = 'trial' AND trial_end_time <= ?
+                AND auto_restricted_at IS NULL
+            ''', (horizon,))
+            rows = cursor.fetchall()
+
+        with self._lock:
+            for client_id, trial_end_time in rows:
+                trial_end = datetime.fromisoformat(trial_end_time)
+                if self._deadlines.get(client_id) != trial_end:
+                    self._deadlines[client_id] = trial_end
+                    heapq.heappush(self._heap, (trial_end, client_id))
+        self.metrics['refreshes'] += 1
+        return len(rows)
+
+    def _pop_due(self):
+        """Remove and return client_ids whose deadline has passed, skipping stale entries"""
+        now = datetime.now()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                trial_end, client_id = heapq.heappop(self._heap)
+                if self._deadlines.get(client_id) == trial_end:
+                    del self._deadlines[client_id]
+                    due.append(client_id)
+                    lag_ms = (now - trial_end).total_seconds() * 1000
+                    self.metrics['last_fire_lag_ms'] = lag_ms
+        return due
+
+    def _seconds_until_next(self):
+        with self._lock:
+            if not self._heap:
+                return None
+            return (self._heap[0][0] - datetime.now()).total_seconds()
+
+    def _run(self):
+        while not self._stopping:
+            now = time.monotonic()
+            try:
+                if now >= self._next_renew:
+                    leader = try_acquire_lease(TRIAL_EXPIRY_CONFIG['lease_name'], self.holder,
+                                               TRIAL_EXPIRY_CONFIG['lease_ttl'])
+                    if leader != self.is_leader:
+                        self.metrics['leader_changes'] += 1
+                        self._next_refresh = 0.0  # new leader: cold-start load
+                        if not leader:
+                            with self._lock:
+                                self._heap.clear()
+                                self._deadlines.clear()
+                    self.is_leader = leader
+                    self._next_renew = now + TRIAL_EXPIRY_CONFIG['renew_interval']
+
+                if self.is_leader:
+                    if now >= self._next_refresh:
+                        self.load_deadlines()
+                        self._next_refresh = now + TRIAL_EXPIRY_CONFIG['refresh_interval']
+                    due = self._pop_due()
+                    if due:
+                        self.metrics['fired'] += 1
+                        result = self.restrict_func(due)
+                        self.metrics['restricted'] += result['restricted']
+                        self.metrics['last_batches'] = result['batches']
+            except Exception as e:
+                self.metrics['last_error'] = str(e)
+                print(f"Error in trial expiry scheduler: {e}")
+
+            # Sleep until the next deadline, lease renewal or refresh - whichever comes first
+            delay = self._next_renew - time.monotonic()
+            if self.is_leader:
+                delay = min(delay, self._next_refresh - time.monotonic())
+                until_deadline = self._seconds_until_next()
+                if until_deadline is not None:
+                    delay = min(delay, until_deadline)
+            self._wakeup.wait(max(0.0, delay))
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trial-expiry', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.is_leader:
+            release_lease(TRIAL_EXPIRY_CONFIG['lease_name'], self.holder)
+            self.is_leader = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['tracked_deadlines'] = len(self._deadlines)
+            stats['next_deadline'] = self._heap[0][0].isoformat() if self._heap else None
+        stats['is_leader'] = self.is_leader
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
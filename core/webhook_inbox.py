@@ -0,0 +1,250 @@
+"""
+Payment Webhook Inbox
+Verified provider events are stored once (deduplicated by event id) and applied
+later in arrival order, in batches, by a single lease-holding consumer
+"""
+
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from core.auth_cache import invalidate_client
+from core.database import get_connection
+from core.entitlements import refresh_entitlements
+from core.leases import make_holder_id, try_acquire_lease
+from core.session_tokens import revoke_client_sessions
+
+WEBHOOK_CONFIG = {
+    'batch_size': 200,
+    'poll_interval': int(os.environ.get('WEBHOOK_POLL_INTERVAL', '5')),  # seconds between consumer runs
+    'max_attempts': 5,  # per event, for errors other than a busy database
+    'max_backoff': 300,  # seconds; cap on the wait after consecutive busy-database runs
+    'lease_name': 'payment_webhooks',
+    'lease_ttl': 60
+}
+
+# (provider, event_type) -> status written to subscriptions.status and clients.subscription_status
+WEBHOOK_EVENT_STATUS = {
+    ('stripe', 'invoice.payment_succeeded'): 'active',
+    ('stripe', 'invoice.payment_failed'): 'past_due',
+    ('stripe', 'customer.subscription.deleted'): 'canceled',
+    ('paypal', 'BILLING.SUBSCRIPTION.ACTIVATED'): 'active',
+    ('paypal', 'BILLING.SUBSCRIPTION.PAYMENT.FAILED'): 'past_due',
+    ('paypal', 'BILLING.SUBSCRIPTION.CANCELLED'): 'canceled'
+}
+
+def init_webhook_inbox(cursor):
+    """Inbox table and the index behind the consumer's reads"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payment_provider TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            provider_subscription_id TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            UNIQUE (payment_provider, event_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_webhook_events_status
+        ON payment_webhook_events (status, id)
+    ''')
+
+def store_webhook_event(payment_provider, event_id, event_type, provider_subscription_id, payload):
+    """Persist a verified event; returns False if it was already received (provider retry)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO payment_webhook_events
+            (payment_provider, event_id, event_type, provider_subscription_id, payload)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (payment_provider, event_id, event_type, provider_subscription_id, payload))
+        return cursor.rowcount == 1
+
+def _apply_events(cursor, events, now):
+    """Apply (id, provider, event_type, subscription_ref) rows; returns (client_ids, lapsed client_ids)"""
+    latest = {}  # (provider, provider_subscription_id) -> status of its newest event
+    ignored = []
+    for event_id, provider, event_type, subscription_ref in events:
+        status = WEBHOOK_EVENT_STATUS.get((provider, event_type))
+        if status is None or not subscription_ref:
+            ignored.append((now, event_id))
+            continue
+        latest[(provider, subscription_ref)] = status
+
+    cursor.executemany('''
+        UPDATE subscriptions SET status = ?, updated_at = ?
+        WHERE payment_provider = ? AND provider_subscription_id = ?
+    ''', [(status, now, provider, ref) for (provider, ref), status in latest.items()])
+    cursor.executemany('''
+        UPDATE clients SET subscription_status = ?
+        WHERE client_id IN (
+            SELECT client_id FROM subscriptions
+            WHERE payment_provider = ? AND provider_subscription_id = ?
+        )
+    ''', [(status, provider, ref) for (provider, ref), status in latest.items()])
+
+    client_ids = set()
+    lapsed = set()  # clients whose subscription is no longer active
+    for (provider, ref), status in latest.items():
+        cursor.execute('''
+            SELECT client_id FROM subscriptions
+            WHERE payment_provider = ? AND provider_subscription_id = ?
+        ''', (provider, ref))
+        found = [row[0] for row in cursor.fetchall()]
+        client_ids.update(found)
+        if status != 'active':
+            lapsed.update(found)
+    refresh_entitlements(cursor, client_ids)
+
+    ignored_ids = {event_id for _, event_id in ignored}
+    cursor.executemany('''
+        UPDATE payment_webhook_events SET status = 'processed', processed_at = ?, last_error = NULL
+        WHERE id = ?
+    ''', [(now, event[0]) for event in events if event[0] not in ignored_ids])
+    cursor.executemany('''
+        UPDATE payment_webhook_events SET status = 'ignored', processed_at = ?
+        WHERE id = ?
+    ''', ignored)
+    return client_ids, lapsed
+
+def _after_commit(client_ids, lapsed):
+    for client_id in client_ids:
+        invalidate_client(client_id)
+    revoke_client_sessions(lapsed)
+
+def pending_webhook_events(limit=None):
+    """The oldest pending events, in arrival order"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, payment_provider, event_type, provider_subscription_id
+            FROM payment_webhook_events
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT ?
+        ''', (limit or WEBHOOK_CONFIG['batch_size'],))
+        return cursor.fetchall()
+
+def apply_webhook_batch(limit=None):
+    """Apply the oldest pending events in one transaction; returns the number processed.
+
+    Events are read in arrival order and only the last status per subscription
+    is written, so a burst of retries or flapping events costs one update each.
+    """
+    now = datetime.now().isoformat()
+    with get_connection() as conn:
+        events = pending_webhook_events(limit)
+        if not events:
+            return 0
+        client_ids, lapsed = _apply_events(conn.cursor(), events, now)
+
+    _after_commit(client_ids, lapsed)
+    return len(events)
+
+def apply_webhook_event(event):
+    """Apply one (id, provider, event_type, subscription_ref) row in its own transaction"""
+    with get_connection() as conn:
+        client_ids, lapsed = _apply_events(conn.cursor(), [event], datetime.now().isoformat())
+    _after_commit(client_ids, lapsed)
+
+def is_transient_error(error):
+    """True for errors worth retrying without counting an attempt (a busy or locked database)"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+def record_webhook_failure(event_id, error):
+    """Count a failed attempt against one event, parking it as 'failed' once it keeps failing"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE payment_webhook_events
+            SET attempts = attempts + 1, last_error = ?,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+            WHERE id = ?
+        ''', (error, WEBHOOK_CONFIG['max_attempts'], event_id))
+
+def apply_events_one_by_one(events):
+    """Apply a batch that failed as a whole event by event, charging the failure to the events at fault.
+
+    Later events for a subscription whose event failed stay pending, so that
+    subscription's events still apply in arrival order. Transient errors are
+    raised to the caller without counting an attempt. Returns the number processed.
+    """
+    processed = 0
+    blocked = set()  # (provider, provider_subscription_id) with a failed event in this pass
+    for event in events:
+        key = (event[1], event[3])
+        if event[3] and key in blocked:
+            continue
+        try:
+            apply_webhook_event(event)
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            print(f"Error applying payment webhook {event[0]}: {e}")
+            record_webhook_failure(event[0], str(e))
+            blocked.add(key)
+            continue
+        processed += 1
+    return processed
+
+class WebhookConsumer:
+    """Drains the inbox while holding the consumer lease, so events apply in order"""
+
+    def __init__(self):
+        self.holder = make_holder_id()
+        self.metrics = {'runs': 0, 'processed': 0, 'errors': 0, 'transient_errors': 0, 'last_error': None}
+        self._backoff = 0
+        self._retry_at = 0.0
+
+    def run_once(self):
+        """Apply pending events batch by batch; returns the number processed"""
+        if time.monotonic() < self._retry_at:
+            return 0
+        if not try_acquire_lease(WEBHOOK_CONFIG['lease_name'], self.holder, WEBHOOK_CONFIG['lease_ttl']):
+            return 0
+        self.metrics['runs'] += 1
+        processed = 0
+        try:
+            while True:
+                try:
+                    count = apply_webhook_batch()
+                except Exception as e:
+                    if is_transient_error(e):
+                        raise
+                    self.metrics['errors'] += 1
+                    self.metrics['last_error'] = str(e)
+                    print(f"Error applying payment webhooks, retrying event by event: {e}")
+                    processed += apply_events_one_by_one(pending_webhook_events())
+                    break
+                processed += count
+                if count < WEBHOOK_CONFIG['batch_size']:
+                    break
+            self._backoff = 0
+        except Exception as e:
+            if not is_transient_error(e):
+                raise
+            # Nothing is charged to the events; wait longer after each consecutive busy run
+            self._backoff = min(max(self._backoff * 2, WEBHOOK_CONFIG['poll_interval']),
+                                WEBHOOK_CONFIG['max_backoff'])
+            self._retry_at = time.monotonic() + self._backoff
+            self.metrics['transient_errors'] += 1
+            self.metrics['last_error'] = str(e)
+        self.metrics['processed'] += processed
+        return processed
+
+    def stats(self):
+        stats = dict(self.metrics)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM payment_webhook_events WHERE status = 'pending'")
+            stats['pending'] = cursor.fetchone()[0]
+        return stats
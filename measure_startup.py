@@ -0,0 +1,87 @@
+"""
+Startup Measurement
+Import time (python -X importtime) and boot-to-first-response time of the web app,
+each run in a fresh interpreter and checked against STARTUP_TARGETS.
+
+Usage: python measure_startup.py [module] [path]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTUP_TARGETS = {
+    'import_ms': 300,           # import of the app module, no startup hooks
+    'first_response_ms': 1000   # interpreter start to first response from create_app()
+}
+
+TOP_MODULES = 15
+
+FIRST_RESPONSE_SCRIPT = '''
+import sys, time
+started = time.perf_counter()
+module = __import__(sys.argv[1])
+app = module.create_app()
+response = app.test_client().get(sys.argv[2])
+print(round((time.perf_counter() - started) * 1000, 1), response.status_code)
+'''
+
+def measure_import(module, env):
+    """Cumulative import time per top-level module, in ms, largest first"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=env, cwd=env['STARTUP_WORKDIR'])
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            continue  # nested import, already counted in its parent
+        totals[name.strip()] = int(cumulative) / 1000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+def measure_first_response(module, path, env):
+    """(ms from interpreter start to first response, status code)"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', FIRST_RESPONSE_SCRIPT, module, path],
+                            capture_output=True, text=True, env=env, cwd=env['STARTUP_WORKDIR'])
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    in_process_ms, status = result.stdout.strip().splitlines()[-1].split()
+    print(f"  create_app() + first request: {in_process_ms} ms (status {status})")
+    return round(wall_ms, 1), int(status)
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else 'app'
+    path = sys.argv[2] if len(sys.argv) > 2 else '/login'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Fresh databases and no background jobs, so every run measures a cold boot
+        # (run from the temp directory too, so relative paths cannot touch the checkout)
+        env = dict(os.environ, CLIENT_DB_PATH=os.path.join(workdir, 'clients.db'), SCHEDULER_ENABLED='0',
+                   PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), STARTUP_WORKDIR=workdir)
+
+        modules = measure_import(module, env)
+        import_ms = round(dict(modules)[module], 1)
+        print(f"Import of {module}: {import_ms} ms")
+        for name, ms in modules[:TOP_MODULES]:
+            print(f"  {ms:8.1f} ms  {name}")
+
+        print(f"First response from {module}.create_app() for {path}:")
+        first_response_ms, _ = measure_first_response(module, path, env)
+        print(f"  total (including interpreter start): {first_response_ms} ms")
+
+    results = {'import_ms': import_ms, 'first_response_ms': first_response_ms}
+    failed = [name for name, target in STARTUP_TARGETS.items() if results[name] > target]
+    for name, target in STARTUP_TARGETS.items():
+        print(f"{name}: {results[name]} ms (target {target} ms) {'FAIL' if name in failed else 'ok'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,21 @@ Enhanced Payment System with Stripe and PayPal Integration
 Supports both one-time payments and recurring subscriptions
 """
 
-import stripe
-import paypalrestsdk
 from flask import Flask, request, jsonify, render_template, redirect, url_for
 import json
-import sqlite3
 from datetime import datetime, timedelta
 import uuid
 import hmac
 import hashlib
 import os
+import threading
+from core.database import get_connection
+from core.auth_cache import invalidate_client
+from core.ids import generate_subscription_id
+from core.migrations import ensure_schema
+from core.startup import on_startup
+from core.entitlements import get_entitlements, refresh_entitlements
+from core.webhook_inbox import store_webhook_event
 
 # Payment configuration
 STRIPE_CONFIG = {
@@ -28,273 +33,236 @@ PAYPAL_CONFIG = {
     'webhook_id': 'your_paypal_webhook_id'  # Replace with your PayPal webhook ID
 }
 
-# Initialize payment providers
-stripe.api_key = STRIPE_CONFIG['secret_key']
+def load_stripe():
+    """Import and configure the Stripe SDK"""
+    import stripe
+    stripe.api_key = STRIPE_CONFIG['secret_key']
+    return stripe
 
-paypalrestsdk.configure({
-    'mode': PAYPAL_CONFIG['mode'],
-    'client_id': PAYPAL_CONFIG['client_id'],
-    'client_secret': PAYPAL_CONFIG['client_secret']
-})
+def load_paypal():
+    """Import and configure the PayPal SDK"""
+    import paypalrestsdk
+    paypalrestsdk.configure({
+        'mode': PAYPAL_CONFIG['mode'],
+        'client_id': PAYPAL_CONFIG['client_id'],
+        'client_secret': PAYPAL_CONFIG['client_secret']
+    })
+    return paypalrestsdk
 
+PROVIDER_LOADERS = {
+    'stripe': load_stripe,
+    'paypal': load_paypal
+}
+
+# Provider SDKs, imported and configured on first use; swap in local stand-ins to time checkouts offline
+PAYMENT_PROVIDERS = {}
+_providers_lock = threading.Lock()
+
+def get_payment_provider(name):
+    """The SDK module (or stand-in) for a payment provider"""
+    provider = PAYMENT_PROVIDERS.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = PAYMENT_PROVIDERS.get(name)
+            if provider is None:
+                provider = PAYMENT_PROVIDERS[name] = PROVIDER_LOADERS[name]()
+    return provider
+
+def set_payment_providers(stripe_api=None, paypal_api=None):
+    """Replace the provider SDKs (e.g. with local stand-ins); returns the ones loaded before"""
+    previous = dict(PAYMENT_PROVIDERS)
+    if stripe_api is not None:
+        PAYMENT_PROVIDERS['stripe'] = stripe_api
+    if paypal_api is not None:
+        PAYMENT_PROVIDERS['paypal'] = paypal_api
+    return previous
+
+@on_startup
 def init_payment_database():
-    """Initialize payment-related database tables"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    # Payment plans table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payment_plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_id TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            description TEXT,
-            price_monthly DECIMAL(10,2),
-            price_yearly DECIMAL(10,2),
-            max_users INTEGER DEFAULT 5,
-            max_websites INTEGER DEFAULT 1,
-            features TEXT,
-            stripe_price_id_monthly TEXT,
-            stripe_price_id_yearly TEXT,
-            paypal_plan_id_monthly TEXT,
-            paypal_plan_id_yearly TEXT,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Subscriptions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            subscription_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            plan_id TEXT NOT NULL,
-            payment_provider TEXT NOT NULL,
-            provider_subscription_id TEXT,
-            status TEXT DEFAULT 'active',
-            billing_cycle TEXT DEFAULT 'monthly',
-            amount DECIMAL(10,2),
-            currency TEXT DEFAULT 'USD',
-            current_period_start TIMESTAMP,
-            current_period_end TIMESTAMP,
-            trial_end TIMESTAMP,
-            cancel_at_period_end BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id),
-            FOREIGN KEY (plan_id) REFERENCES payment_plans (plan_id)
-        )
-    ''')
-    
-    # Payment transactions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payment_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transaction_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            subscription_id TEXT,
-            payment_provider TEXT NOT NULL,
-            provider_transaction_id TEXT,
-            amount DECIMAL(10,2) NOT NULL,
-            currency TEXT DEFAULT 'USD',
-            status TEXT DEFAULT 'pending',
-            payment_method TEXT,
-            description TEXT,
-            invoice_url TEXT,
-            receipt_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            processed_at TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id),
-            FOREIGN KEY (subscription_id) REFERENCES subscriptions (subscription_id)
-        )
-    ''')
-    
-    # Payment methods table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payment_methods (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            method_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            payment_provider TEXT NOT NULL,
-            provider_method_id TEXT,
-            type TEXT,
-            last_four TEXT,
-            brand TEXT,
-            exp_month INTEGER,
-            exp_year INTEGER,
-            is_default BOOLEAN DEFAULT 0,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id)
-        )
-    ''')
+    """Bring the database schema up to date, including payment tables and default plans"""
+    ensure_schema()
+
+def get_provider_customer(client_id, payment_provider):
+    """(provider_customer_id, default_payment_method) for a client, or None"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT provider_customer_id, default_payment_method FROM payment_customers
+            WHERE client_id = ? AND payment_provider = ?
+        ''', (client_id, payment_provider))
+        
+        return cursor.fetchone()
+
+def save_provider_customer(client_id, payment_provider, provider_customer_id, default_payment_method=None):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO payment_customers (client_id, payment_provider, provider_customer_id, default_payment_method)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (client_id, payment_provider)
+            DO UPDATE SET provider_customer_id = excluded.provider_customer_id,
+                          default_payment_method = excluded.default_payment_method
+        ''', (client_id, payment_provider, provider_customer_id, default_payment_method))
+
+def save_provider_plan_id(plan_id, column, provider_plan_id):
+    """Store a lazily created provider price/plan id; returns the id that won if two workers raced"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            UPDATE payment_plans SET {column} = ? WHERE plan_id = ? AND {column} IS NULL
+        ''', (provider_plan_id, plan_id))
+        
+        if cursor.rowcount == 1:
+            return provider_plan_id
+        
+        cursor.execute(f'SELECT {column} FROM payment_plans WHERE plan_id = ?', (plan_id,))
+        return cursor.fetchone()[0]
+
+def load_checkout_context(client_id, plan_id):
+    """Plan row (with cached provider ids) and client row in one connection"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT plan_id, name, description, price_monthly, price_yearly,
+                   stripe_price_id_monthly, stripe_price_id_yearly,
+                   paypal_plan_id_monthly, paypal_plan_id_yearly
+            FROM payment_plans WHERE plan_id = ?
+        ''', (plan_id,))
+        plan_row = cursor.fetchone()
+        
+        cursor.execute('SELECT business_name, contact_email FROM clients WHERE client_id = ?', (client_id,))
+        client_row = cursor.fetchone()
     
-    # Billing addresses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS billing_addresses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            address_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            name TEXT,
-            company TEXT,
-            line1 TEXT,
-            line2 TEXT,
-            city TEXT,
-            state TEXT,
-            postal_code TEXT,
-            country TEXT,
-            phone TEXT,
-            is_default BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id)
-        )
-    ''')
+    plan = dict(zip(['plan_id', 'name', 'description', 'price_monthly', 'price_yearly',
+                     'stripe_price_id_monthly', 'stripe_price_id_yearly',
+                     'paypal_plan_id_monthly', 'paypal_plan_id_yearly'], plan_row)) if plan_row else None
+    client = {'business_name': client_row[0], 'contact_email': client_row[1]} if client_row else None
+    return plan, client
+
+def ensure_stripe_price(plan, billing_cycle):
+    """Stripe price id for a plan and cycle, created on first use"""
+    column = f'stripe_price_id_{billing_cycle}'
+    if plan[column]:
+        return plan[column]
     
-    conn.commit()
-    conn.close()
+    amount = plan['price_monthly'] if billing_cycle == 'monthly' else plan['price_yearly']
+    price = get_payment_provider('stripe').Price.create(
+        currency='usd',
+        unit_amount=int(round(amount * 100)),  # Convert to cents
+        recurring={'interval': 'month' if billing_cycle == 'monthly' else 'year'},
+        product_data={'name': plan['name']}
+    )
+    return save_provider_plan_id(plan['plan_id'], column, price.id)
 
-def create_default_payment_plans():
-    """Create default payment plans"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
+def ensure_paypal_plan(plan, billing_cycle, return_url, cancel_url):
+    """Active PayPal billing plan id for a plan and cycle, created on first use"""
+    column = f'paypal_plan_id_{billing_cycle}'
+    if plan[column]:
+        return plan[column]
     
-    plans = [
-        {
-            'plan_id': 'basic',
-            'name': 'Basic Plan',
-            'description': 'Perfect for small businesses',
-            'price_monthly': 29.99,
-            'price_yearly': 299.99,
-            'max_users': 5,
-            'max_websites': 1,
-            'features': json.dumps([
-                'Up to 5 users',
-                '1 website tracking',
-                'Basic visitor analytics',
-                'Email support',
-                'CSV export'
-            ])
-        },
-        {
-            'plan_id': 'professional',
-            'name': 'Professional Plan',
-            'description': 'For growing businesses',
-            'price_monthly': 79.99,
-            'price_yearly': 799.99,
-            'max_users': 15,
-            'max_websites': 5,
-            'features': json.dumps([
-                'Up to 15 users',
-                '5 websites tracking',
-                'Advanced analytics',
-                'Priority support',
-                'Excel & CSV export',
-                'API access',
-                'Custom reports'
-            ])
-        },
-        {
-            'plan_id': 'enterprise',
-            'name': 'Enterprise Plan',
-            'description': 'For large organizations',
-            'price_monthly': 199.99,
-            'price_yearly': 1999.99,
-            'max_users': 50,
-            'max_websites': 25,
-            'features': json.dumps([
-                'Up to 50 users',
-                '25 websites tracking',
-                'Enterprise analytics',
-                'Dedicated support',
-                'All export formats',
-                'Full API access',
-                'Custom integrations',
-                'White-label options'
-            ])
-        }
-    ]
+    amount = plan['price_monthly'] if billing_cycle == 'monthly' else plan['price_yearly']
+    interval = 'MONTH' if billing_cycle == 'monthly' else 'YEAR'
     
-    for plan in plans:
-        cursor.execute('''
-            INSERT OR REPLACE INTO payment_plans 
-            (plan_id, name, description, price_monthly, price_yearly, max_users, max_websites, features)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (plan['plan_id'], plan['name'], plan['description'], plan['price_monthly'],
-              plan['price_yearly'], plan['max_users'], plan['max_websites'], plan['features']))
+    billing_plan = get_payment_provider('paypal').BillingPlan({
+        'name': f"{plan['name']} - {billing_cycle.title()}",
+        'description': plan['description'],
+        'type': 'INFINITE',
+        'payment_definitions': [{
+            'name': f"{plan['name']} Payment",
+            'type': 'REGULAR',
+            'frequency': interval,
+            'frequency_interval': '1',
+            'amount': {
+                'value': str(amount),
+                'currency': 'USD'
+            },
+            'cycles': '0'  # Infinite
+        }],
+        'merchant_preferences': {
+            'return_url': return_url,
+            'cancel_url': cancel_url,
+            'auto_bill_amount': 'YES',
+            'initial_fail_amount_action': 'CONTINUE',
+            'max_fail_attempts': '3'
+        }
+    })
     
-    conn.commit()
-    conn.close()
+    if not (billing_plan.create() and billing_plan.activate()):
+        return None
+    return save_provider_plan_id(plan['plan_id'], column, billing_plan.id)
 
 def create_stripe_subscription(client_id, plan_id, billing_cycle, payment_method_id, billing_address=None):
-    """Create a Stripe subscription"""
+    """Create a Stripe subscription.
+    
+    The price and customer are created once and reused, so a returning client
+    with the same card needs a single remote call.
+    """
     try:
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Get plan details
-        cursor.execute('SELECT * FROM payment_plans WHERE plan_id = ?', (plan_id,))
-        plan = cursor.fetchone()
+        stripe_api = get_payment_provider('stripe')
+        plan, client = load_checkout_context(client_id, plan_id)
         if not plan:
             return {'success': False, 'error': 'Plan not found'}
-        
-        # Get client details
-        cursor.execute('SELECT * FROM clients WHERE client_id = ?', (client_id,))
-        client = cursor.fetchone()
         if not client:
             return {'success': False, 'error': 'Client not found'}
         
+        price_id = ensure_stripe_price(plan, billing_cycle)
+        
         # Create or retrieve Stripe customer
-        customer = stripe.Customer.create(
-            email=client[3],  # contact_email
-            name=client[2],   # business_name
-            payment_method=payment_method_id,
-            invoice_settings={'default_payment_method': payment_method_id}
-        )
+        customer = get_provider_customer(client_id, 'stripe')
+        if customer is None:
+            created = stripe_api.Customer.create(
+                email=client['contact_email'],
+                name=client['business_name'],
+                payment_method=payment_method_id,
+                invoice_settings={'default_payment_method': payment_method_id}
+            )
+            customer_id = created.id
+            save_provider_customer(client_id, 'stripe', customer_id, payment_method_id)
+        else:
+            customer_id, default_payment_method = customer
+            if payment_method_id and payment_method_id != default_payment_method:
+                stripe_api.PaymentMethod.attach(payment_method_id, customer=customer_id)
+                save_provider_customer(client_id, 'stripe', customer_id, payment_method_id)
         
-        # Determine price based on billing cycle
-        amount = plan[4] if billing_cycle == 'monthly' else plan[5]  # price_monthly or price_yearly
+        amount = plan['price_monthly'] if billing_cycle == 'monthly' else plan['price_yearly']
         
         # Create Stripe subscription
-        subscription = stripe.Subscription.create(
-            customer=customer.id,
-            items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': plan[2],  # name
-                        'description': plan[3]  # description
-                    },
-                    'unit_amount': int(amount * 100),  # Convert to cents
-                    'recurring': {
-                        'interval': 'month' if billing_cycle == 'monthly' else 'year'
-                    }
-                }
-            }],
+        subscription = stripe_api.Subscription.create(
+            customer=customer_id,
+            items=[{'price': price_id}],
+            default_payment_method=payment_method_id,
             expand=['latest_invoice.payment_intent']
         )
         
-        # Save subscription to database
-        subscription_id = f"sub_{uuid.uuid4().hex[:12]}"
-        cursor.execute('''
-            INSERT INTO subscriptions 
-            (subscription_id, client_id, plan_id, payment_provider, provider_subscription_id,
-             status, billing_cycle, amount, current_period_start, current_period_end)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (subscription_id, client_id, plan_id, 'stripe', subscription.id,
-              subscription.status, billing_cycle, amount,
-              datetime.fromtimestamp(subscription.current_period_start).isoformat(),
-              datetime.fromtimestamp(subscription.current_period_end).isoformat()))
-        
-        # Update client subscription status
-        cursor.execute('''
-            UPDATE clients 
-            SET subscription_status = 'active', plan_type = ?, account_type = 'full'
-            WHERE client_id = ?
-        ''', (plan_id, client_id))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Save subscription to database
+            subscription_id = generate_subscription_id()
+            cursor.execute('''
+                INSERT INTO subscriptions 
+                (subscription_id, client_id, plan_id, payment_provider, provider_subscription_id,
+                 status, billing_cycle, amount, current_period_start, current_period_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (subscription_id, client_id, plan_id, 'stripe', subscription.id,
+                  subscription.status, billing_cycle, amount,
+                  datetime.fromtimestamp(subscription.current_period_start).isoformat(),
+                  datetime.fromtimestamp(subscription.current_period_end).isoformat()))
+            
+            # Update client subscription status
+            cursor.execute('''
+                UPDATE clients 
+                SET subscription_status = 'active', plan_type = ?, account_type = 'full'
+                WHERE client_id = ?
+            ''', (plan_id, client_id))
+            
+            refresh_entitlements(cursor, [client_id])
         
-        conn.commit()
-        conn.close()
+        invalidate_client(client_id)
         
         return {
             'success': True,
@@ -307,321 +275,160 @@ def create_stripe_subscription(client_id, plan_id, billing_cycle, payment_method
         return {'success': False, 'error': str(e)}
 
 def create_paypal_subscription(client_id, plan_id, billing_cycle, return_url, cancel_url):
-    """Create a PayPal subscription"""
+    """Create a PayPal subscription.
+    
+    The billing plan is created and activated once per plan and cycle; each
+    checkout only creates the agreement, with its own return and cancel URLs.
+    """
     try:
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Get plan details
-        cursor.execute('SELECT * FROM payment_plans WHERE plan_id = ?', (plan_id,))
-        plan = cursor.fetchone()
+        plan, _ = load_checkout_context(client_id, plan_id)
         if not plan:
             return {'success': False, 'error': 'Plan not found'}
         
-        # Determine price based on billing cycle
-        amount = plan[4] if billing_cycle == 'monthly' else plan[5]  # price_monthly or price_yearly
-        interval = 'MONTH' if billing_cycle == 'monthly' else 'YEAR'
-        
-        # Create PayPal billing plan
-        billing_plan = paypalrestsdk.BillingPlan({
-            'name': f"{plan[2]} - {billing_cycle.title()}",
-            'description': plan[3],
-            'type': 'INFINITE',
-            'payment_definitions': [{
-                'name': f"{plan[2]} Payment",
-                'type': 'REGULAR',
-                'frequency': interval,
-                'frequency_interval': '1',
-                'amount': {
-                    'value': str(amount),
-                    'currency': 'USD'
-                },
-                'cycles': '0'  # Infinite
-            }],
-            'merchant_preferences': {
+        amount = plan['price_monthly'] if billing_cycle == 'monthly' else plan['price_yearly']
+        
+        paypal_plan_id = ensure_paypal_plan(plan, billing_cycle, return_url, cancel_url)
+        if not paypal_plan_id:
+            return {'success': False, 'error': 'Failed to create PayPal subscription'}
+        
+        # Create billing agreement
+        billing_agreement = get_payment_provider('paypal').BillingAgreement({
+            'name': f"{plan['name']} Subscription",
+            'description': plan['description'],
+            'start_date': (datetime.now() + timedelta(minutes=1)).isoformat() + 'Z',
+            'plan': {
+                'id': paypal_plan_id
+            },
+            'payer': {
+                'payment_method': 'paypal'
+            },
+            'override_merchant_preferences': {
                 'return_url': return_url,
-                'cancel_url': cancel_url,
-                'auto_bill_amount': 'YES',
-                'initial_fail_amount_action': 'CONTINUE',
-                'max_fail_attempts': '3'
+                'cancel_url': cancel_url
             }
         })
         
-        if billing_plan.create():
-            # Activate the billing plan
-            if billing_plan.activate():
-                # Create billing agreement
-                billing_agreement = paypalrestsdk.BillingAgreement({
-                    'name': f"{plan[2]} Subscription",
-                    'description': plan[3],
-                    'start_date': (datetime.now() + timedelta(minutes=1)).isoformat() + 'Z',
-                    'plan': {
-                        'id': billing_plan.id
-                    },
-                    'payer': {
-                        'payment_method': 'paypal'
-                    }
-                })
-                
-                if billing_agreement.create():
-                    # Save subscription to database (pending approval)
-                    subscription_id = f"sub_{uuid.uuid4().hex[:12]}"
-                    cursor.execute('''
-                        INSERT INTO subscriptions 
-                        (subscription_id, client_id, plan_id, payment_provider, provider_subscription_id,
-                         status, billing_cycle, amount)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (subscription_id, client_id, plan_id, 'paypal', billing_agreement.id,
-                          'pending_approval', billing_cycle, amount))
-                    
-                    conn.commit()
-                    conn.close()
-                    
-                    # Get approval URL
-                    for link in billing_agreement.links:
-                        if link.rel == 'approval_url':
-                            return {
-                                'success': True,
-                                'subscription_id': subscription_id,
-                                'approval_url': link.href,
-                                'paypal_agreement_id': billing_agreement.id
-                            }
-                
-        return {'success': False, 'error': 'Failed to create PayPal subscription'}
+        if not billing_agreement.create():
+            return {'success': False, 'error': 'Failed to create PayPal subscription'}
+        
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Save subscription to database (pending approval)
+            subscription_id = generate_subscription_id()
+            cursor.execute('''
+                INSERT INTO subscriptions 
+                (subscription_id, client_id, plan_id, payment_provider, provider_subscription_id,
+                 status, billing_cycle, amount)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (subscription_id, client_id, plan_id, 'paypal', billing_agreement.id,
+                  'pending_approval', billing_cycle, amount))
+        
+        # Get approval URL
+        for link in billing_agreement.links:
+            if link.rel == 'approval_url':
+                return {
+                    'success': True,
+                    'subscription_id': subscription_id,
+                    'approval_url': link.href,
+                    'paypal_agreement_id': billing_agreement.id
+                }
         
+        return {'success': False, 'error': 'Failed to create PayPal subscription'}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
 def handle_stripe_webhook(payload, signature):
-    """Handle Stripe webhook events"""
+    """Verify a Stripe webhook and queue it; the worker applies it (see core.webhook_inbox)"""
     try:
-        event = stripe.Webhook.construct_event(
+        event = get_payment_provider('stripe').Webhook.construct_event(
             payload, signature, STRIPE_CONFIG['webhook_secret']
         )
+        event_object = event['data']['object']
         
-        if event['type'] == 'invoice.payment_succeeded':
-            # Handle successful payment
-            invoice = event['data']['object']
-            subscription_id = invoice['subscription']
-            
-            # Update subscription status
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'active', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-            ''', (datetime.now().isoformat(), subscription_id))
-            
-            # Update client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'active'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-                )
-            ''', (subscription_id,))
-            
-            conn.commit()
-            conn.close()
-            
-        elif event['type'] == 'invoice.payment_failed':
-            # Handle failed payment
-            invoice = event['data']['object']
-            subscription_id = invoice['subscription']
-            
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'past_due', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-            ''', (datetime.now().isoformat(), subscription_id))
-            
-            # Restrict client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'past_due'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-                )
-            ''', (subscription_id,))
-            
-            conn.commit()
-            conn.close()
-            
+        if event['type'] in ('invoice.payment_succeeded', 'invoice.payment_failed'):
+            subscription_id = event_object.get('subscription')
         elif event['type'] == 'customer.subscription.deleted':
-            # Handle subscription cancellation
-            subscription = event['data']['object']
-            subscription_id = subscription['id']
-            
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'canceled', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-            ''', (datetime.now().isoformat(), subscription_id))
-            
-            # Restrict client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'canceled'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'stripe'
-                )
-            ''', (subscription_id,))
-            
-            conn.commit()
-            conn.close()
+            subscription_id = event_object.get('id')
+        else:
+            subscription_id = None
+        
+        stored = store_webhook_event('stripe', event['id'], event['type'], subscription_id,
+                                     payload.decode('utf-8') if isinstance(payload, bytes) else payload)
         
-        return {'success': True}
+        return {'success': True, 'duplicate': not stored}
         
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+# Delivery headers PayPal's verify-webhook-signature API needs -> its request fields
+PAYPAL_SIGNATURE_HEADERS = {
+    'PAYPAL-TRANSMISSION-ID': 'transmission_id',
+    'PAYPAL-TRANSMISSION-TIME': 'transmission_time',
+    'PAYPAL-TRANSMISSION-SIG': 'transmission_sig',
+    'PAYPAL-CERT-URL': 'cert_url',
+    'PAYPAL-AUTH-ALGO': 'auth_algo'
+}
+
+def verify_paypal_webhook(event, headers):
+    """Ask PayPal's verify-webhook-signature API whether a delivery is genuine"""
+    headers = {name.upper(): value for name, value in dict(headers).items()}
+    verification = {field: headers.get(header) for header, field in PAYPAL_SIGNATURE_HEADERS.items()}
+    if not all(verification.values()):
+        return False
+    verification['webhook_id'] = PAYPAL_CONFIG['webhook_id']
+    verification['webhook_event'] = event
+    response = get_payment_provider('paypal').api.default().post(
+        'v1/notifications/verify-webhook-signature', verification
+    )
+    return response.get('verification_status') == 'SUCCESS'
+
 def handle_paypal_webhook(payload, headers):
-    """Handle PayPal webhook events"""
+    """Verify a PayPal webhook and queue it; the worker applies it (see core.webhook_inbox)"""
     try:
-        # Verify PayPal webhook signature (implement based on PayPal documentation)
-        
         event = json.loads(payload)
+        if not verify_paypal_webhook(event, headers):
+            return {'success': False, 'error': 'Invalid PayPal webhook signature'}
+        
         event_type = event.get('event_type')
+        resource = event.get('resource') or {}
         
-        if event_type == 'BILLING.SUBSCRIPTION.ACTIVATED':
-            # Handle subscription activation
-            subscription = event['resource']
-            agreement_id = subscription['id']
-            
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'active', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-            ''', (datetime.now().isoformat(), agreement_id))
-            
-            # Update client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'active'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-                )
-            ''', (agreement_id,))
-            
-            conn.commit()
-            conn.close()
-            
+        if event_type in ('BILLING.SUBSCRIPTION.ACTIVATED', 'BILLING.SUBSCRIPTION.CANCELLED'):
+            agreement_id = resource.get('id')
         elif event_type == 'BILLING.SUBSCRIPTION.PAYMENT.FAILED':
-            # Handle failed payment
-            subscription = event['resource']
-            agreement_id = subscription['billing_agreement_id']
-            
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'past_due', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-            ''', (datetime.now().isoformat(), agreement_id))
-            
-            # Restrict client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'past_due'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-                )
-            ''', (agreement_id,))
-            
-            conn.commit()
-            conn.close()
-            
-        elif event_type == 'BILLING.SUBSCRIPTION.CANCELLED':
-            # Handle subscription cancellation
-            subscription = event['resource']
-            agreement_id = subscription['id']
-            
-            conn = sqlite3.connect('client_management.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'canceled', updated_at = ?
-                WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-            ''', (datetime.now().isoformat(), agreement_id))
-            
-            # Restrict client access
-            cursor.execute('''
-                UPDATE clients 
-                SET subscription_status = 'canceled'
-                WHERE client_id = (
-                    SELECT client_id FROM subscriptions 
-                    WHERE provider_subscription_id = ? AND payment_provider = 'paypal'
-                )
-            ''', (agreement_id,))
-            
-            conn.commit()
-            conn.close()
+            agreement_id = resource.get('billing_agreement_id')
+        else:
+            agreement_id = None
+        
+        if not event.get('id') or not event_type:
+            return {'success': False, 'error': 'Malformed PayPal event'}
         
-        return {'success': True}
+        stored = store_webhook_event('paypal', event['id'], event_type, agreement_id,
+                                     payload.decode('utf-8') if isinstance(payload, bytes) else payload)
+        
+        return {'success': True, 'duplicate': not stored}
         
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
 def get_client_subscription_status(client_id):
-    """Get current subscription status for a client"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT s.*, pp.name, pp.max_users, pp.max_websites, pp.features
-        FROM subscriptions s
-        JOIN payment_plans pp ON s.plan_id = pp.plan_id
-        WHERE s.client_id = ? AND s.status IN ('active', 'trialing', 'past_due')
-        ORDER BY s.created_at DESC
-        LIMIT 1
-    ''', (client_id,))
+    """Get current subscription status for a client (from its entitlement record)"""
+    entitlements = get_entitlements(client_id)
     
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
+    if entitlements and entitlements['subscription_id']:
         return {
             'has_subscription': True,
-            'subscription_id': result[1],
-            'plan_id': result[3],
-            'payment_provider': result[4],
-            'status': result[6],
-            'billing_cycle': result[7],
-            'amount': result[8],
-            'current_period_end': result[11],
-            'plan_name': result[15],
-            'max_users': result[16],
-            'max_websites': result[17],
-            'features': json.loads(result[18]) if result[18] else []
+            'subscription_id': entitlements['subscription_id'],
+            'plan_id': entitlements['plan_id'],
+            'payment_provider': entitlements['payment_provider'],
+            'status': entitlements['subscription_status'],
+            'billing_cycle': entitlements['billing_cycle'],
+            'amount': entitlements['amount'],
+            'current_period_end': entitlements['current_period_end'],
+            'plan_name': entitlements['plan_name'],
+            'max_users': entitlements['max_users'],
+            'max_websites': entitlements['max_websites'],
+            'features': entitlements['plan_features']
         }
     else:
         return {'has_subscription': False}
-
-# Initialize payment system
-init_payment_database()
-create_default_payment_plans()
-
-print("💳 Payment System Initialized")
-print("✅ Stripe integration ready")
-print("✅ PayPal integration ready")
-print("✅ Subscription management ready")
-print("✅ Webhook handling ready")
-
@@ -0,0 +1,43 @@
+"""
+Automated Task Worker
+Runs queued automated_tasks, trial notification emails and payment webhook events
+outside the web workers (Procfile: worker)
+"""
+
+import signal
+import threading
+import time
+
+from core.log_partitions import LOG_PARTITION_CONFIG, apply_log_retention
+from core.notifications import NotificationDispatcher
+from core.scheduler import schedule_job
+from core.startup import run_startup_hooks
+from core.tasks import TaskRunner
+from core.webhook_inbox import WEBHOOK_CONFIG, WebhookConsumer
+
+# Importing the service registers its task handlers
+import trial_management_system
+
+NOTIFICATION_INTERVAL = 30  # seconds between notification batches
+
+METRICS_INTERVAL = 60  # seconds between metrics log lines
+
+def report_metrics(runner, dispatcher, webhooks):
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        print(f"Task runner metrics: {runner.stats()}")
+        print(f"Notification metrics: {dispatcher.stats()}")
+        print(f"Payment webhook metrics: {webhooks.stats()}")
+
+if __name__ == '__main__':
+    run_startup_hooks()
+    runner = TaskRunner()
+    dispatcher = NotificationDispatcher(trial_management_system.EMAIL_CONFIG)
+    schedule_job('dispatch_trial_notifications', NOTIFICATION_INTERVAL, dispatcher.dispatch, run_immediately=True)
+    webhooks = WebhookConsumer()
+    schedule_job('apply_payment_webhooks', WEBHOOK_CONFIG['poll_interval'], webhooks.run_once, run_immediately=True)
+    schedule_job('access_log_retention', LOG_PARTITION_CONFIG['retention_interval'], apply_log_retention,
+                 run_immediately=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop(wait=False))
+    threading.Thread(target=report_metrics, args=(runner, dispatcher, webhooks), daemon=True).start()
+    runner.run_forever()
@@ -0,0 +1,50 @@
+"""
+Shared test setup: every in-process test runs against a throwaway database with
+background threads off and audit entries written inline
+"""
+
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Read by the core modules at import time, so set before any test imports them
+os.environ['CLIENT_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='vis-tests-'), 'tests.db')
+os.environ['SCHEDULER_ENABLED'] = '0'
+os.environ['AUDIT_LOG_MODE'] = 'sync'
+os.environ['INVESTIGATION_LEGACY_DB'] = ''  # don't import the visitors.db files in the working directory
+
+import pytest
+
+@pytest.fixture
+def db():
+    """The migrated test database's connection context"""
+    from core.database import get_connection
+    from core.migrations import ensure_schema
+    ensure_schema()
+    return get_connection
+
+@pytest.fixture
+def tenant(db):
+    """Insert an active client with one user; returns a function taking column overrides"""
+    from core.ids import generate_access_token, generate_client_id, generate_user_id
+    from core.token_filter import token_filter
+
+    def create(**user_columns):
+        client_id, user_id, access_token = generate_client_id(), generate_user_id(), generate_access_token()
+        user = dict({'user_id': user_id, 'client_id': client_id, 'name': 'Test User', 'email': 'user@example.com',
+                     'role': 'owner', 'access_token': access_token, 'session_limit': 1}, **user_columns)
+        with db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO clients (client_id, business_name, contact_email, website_url, access_token,
+                                     subscription_status)
+                VALUES (?, 'Test Business', 'owner@example.com', 'https://example.com', ?, 'active')
+            ''', (client_id, generate_access_token()))
+            cursor.execute(f"INSERT INTO client_users ({', '.join(user)}) VALUES ({', '.join('?' * len(user))})",
+                           list(user.values()))
+        token_filter.add(user['access_token'])
+        return user
+    return create
@@ -0,0 +1,249 @@
+-- client_management.db schema as created by the baseline services (before schema_version existed)
+
+CREATE TABLE clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT UNIQUE NOT NULL,
+            business_name TEXT NOT NULL,
+            contact_email TEXT NOT NULL,
+            website_url TEXT NOT NULL,
+            access_token TEXT UNIQUE NOT NULL,
+            subscription_status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_access TIMESTAMP,
+            billing_cycle TEXT DEFAULT 'monthly',
+            plan_type TEXT DEFAULT 'basic',
+            max_users INTEGER DEFAULT 5,
+            owner_user_id TEXT
+        );
+
+CREATE TABLE client_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            role TEXT DEFAULT 'viewer',
+            access_token TEXT UNIQUE NOT NULL,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_access TIMESTAMP,
+            access_expires_at TIMESTAMP,
+            allowed_ips TEXT,
+            permissions TEXT,
+            session_limit INTEGER DEFAULT 1,
+            current_sessions INTEGER DEFAULT 0,
+            notes TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            user_id TEXT NOT NULL,
+            client_id TEXT NOT NULL,
+            ip_address TEXT,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES client_users (user_id),
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE access_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            client_id TEXT,
+            action TEXT NOT NULL,
+            resource TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            success BOOLEAN DEFAULT 1,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES client_users (user_id),
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE visitor_investigations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            visitor_id TEXT UNIQUE NOT NULL,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            company TEXT,
+            job_title TEXT,
+            location TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            current_page TEXT,
+            pages_visited TEXT,
+            time_on_site_seconds INTEGER DEFAULT 0,
+            visit_start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            interest_level TEXT,
+            traffic_source TEXT,
+            device_type TEXT,
+            browser TEXT,
+            first_visit TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            session_count INTEGER DEFAULT 1,
+            total_page_views INTEGER DEFAULT 1,
+            is_active BOOLEAN DEFAULT 1,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE admin_users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT NOT NULL,
+            role TEXT DEFAULT 'admin',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        );
+
+CREATE TABLE trial_management (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trial_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            granted_by TEXT,
+            trial_type TEXT DEFAULT 'standard',
+            duration_hours INTEGER NOT NULL,
+            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            end_time TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'active',
+            usage_stats TEXT,
+            reminder_sent BOOLEAN DEFAULT 0,
+            expiration_warning_sent BOOLEAN DEFAULT 0,
+            auto_restricted_at TIMESTAMP,
+            extension_count INTEGER DEFAULT 0,
+            conversion_attempted BOOLEAN DEFAULT 0,
+            notes TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE trial_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notification_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            notification_type TEXT NOT NULL,
+            scheduled_time TIMESTAMP NOT NULL,
+            sent_time TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            email_content TEXT,
+            retry_count INTEGER DEFAULT 0,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE automated_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT UNIQUE NOT NULL,
+            task_type TEXT NOT NULL,
+            client_id TEXT,
+            trial_id TEXT,
+            status TEXT DEFAULT 'pending',
+            scheduled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            executed_at TIMESTAMP,
+            result TEXT,
+            error_message TEXT,
+            retry_count INTEGER DEFAULT 0,
+            max_retries INTEGER DEFAULT 3,
+            task_data TEXT
+        );
+
+CREATE TABLE payment_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            price_monthly DECIMAL(10,2),
+            price_yearly DECIMAL(10,2),
+            max_users INTEGER DEFAULT 5,
+            max_websites INTEGER DEFAULT 1,
+            features TEXT,
+            stripe_price_id_monthly TEXT,
+            stripe_price_id_yearly TEXT,
+            paypal_plan_id_monthly TEXT,
+            paypal_plan_id_yearly TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+CREATE TABLE subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscription_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            plan_id TEXT NOT NULL,
+            payment_provider TEXT NOT NULL,
+            provider_subscription_id TEXT,
+            status TEXT DEFAULT 'active',
+            billing_cycle TEXT DEFAULT 'monthly',
+            amount DECIMAL(10,2),
+            currency TEXT DEFAULT 'USD',
+            current_period_start TIMESTAMP,
+            current_period_end TIMESTAMP,
+            trial_end TIMESTAMP,
+            cancel_at_period_end BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id),
+            FOREIGN KEY (plan_id) REFERENCES payment_plans (plan_id)
+        );
+
+CREATE TABLE payment_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            subscription_id TEXT,
+            payment_provider TEXT NOT NULL,
+            provider_transaction_id TEXT,
+            amount DECIMAL(10,2) NOT NULL,
+            currency TEXT DEFAULT 'USD',
+            status TEXT DEFAULT 'pending',
+            payment_method TEXT,
+            description TEXT,
+            invoice_url TEXT,
+            receipt_url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id),
+            FOREIGN KEY (subscription_id) REFERENCES subscriptions (subscription_id)
+        );
+
+CREATE TABLE payment_methods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            method_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            payment_provider TEXT NOT NULL,
+            provider_method_id TEXT,
+            type TEXT,
+            last_four TEXT,
+            brand TEXT,
+            exp_month INTEGER,
+            exp_year INTEGER,
+            is_default BOOLEAN DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
+
+CREATE TABLE billing_addresses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            address_id TEXT UNIQUE NOT NULL,
+            client_id TEXT NOT NULL,
+            name TEXT,
+            company TEXT,
+            line1 TEXT,
+            line2 TEXT,
+            city TEXT,
+            state TEXT,
+            postal_code TEXT,
+            country TEXT,
+            phone TEXT,
+            is_default BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (client_id)
+        );
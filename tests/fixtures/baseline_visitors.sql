@@ -0,0 +1,37 @@
+-- visitors.db schema as created by the baseline investigation app (app.init_db)
+
+CREATE TABLE visitors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        website_url TEXT,
+        ip_address TEXT,
+        name TEXT,
+        email TEXT,
+        phone TEXT,
+        company TEXT,
+        title TEXT,
+        industry TEXT,
+        location TEXT,
+        country TEXT,
+        region TEXT,
+        city TEXT,
+        device TEXT,
+        browser TEXT,
+        current_page TEXT,
+        pages_visited TEXT,
+        duration INTEGER,
+        interest_level TEXT,
+        referral_source TEXT,
+        session_count INTEGER,
+        total_page_views INTEGER,
+        last_activity TIMESTAMP,
+        first_visit TIMESTAMP,
+        investigation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        password_hash TEXT,
+        role TEXT DEFAULT 'user',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
@@ -0,0 +1,107 @@
+"""
+Payment Provider Stand-ins
+Local replacements for the stripe and paypalrestsdk modules, installed with
+payment_system.set_payment_providers(). Every remote call sleeps for a fixed
+round-trip latency and is recorded, so checkouts can be timed offline.
+"""
+
+import itertools
+import time
+from types import SimpleNamespace
+
+class RemoteCalls:
+    """Shared call log and simulated round trip for one provider"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.log = []
+        self._ids = itertools.count(1)
+
+    def call(self, name):
+        time.sleep(self.latency)
+        self.log.append(name)
+        return next(self._ids)
+
+    def reset(self):
+        self.log.clear()
+
+class StripeStandIn:
+    """The parts of the stripe module that payment_system uses"""
+
+    def __init__(self, latency=0.0):
+        self.calls = calls = RemoteCalls(latency)
+
+        class Price:
+            @staticmethod
+            def create(**params):
+                return SimpleNamespace(id=f"price_{calls.call('Price.create')}", **params)
+
+        class Customer:
+            @staticmethod
+            def create(**params):
+                return SimpleNamespace(id=f"cus_{calls.call('Customer.create')}")
+
+        class PaymentMethod:
+            @staticmethod
+            def attach(payment_method_id, customer=None):
+                calls.call('PaymentMethod.attach')
+                return SimpleNamespace(id=payment_method_id, customer=customer)
+
+        class Subscription:
+            @staticmethod
+            def create(**params):
+                number = calls.call('Subscription.create')
+                now = int(time.time())
+                intent = SimpleNamespace(client_secret=f'pi_{number}_secret')
+                return SimpleNamespace(id=f'sub_{number}', status='active', current_period_start=now,
+                                       current_period_end=now + 30 * 86400,
+                                       latest_invoice=SimpleNamespace(payment_intent=intent))
+
+        self.Price = Price
+        self.Customer = Customer
+        self.PaymentMethod = PaymentMethod
+        self.Subscription = Subscription
+
+class PayPalStandIn:
+    """The parts of the paypalrestsdk module that payment_system uses"""
+
+    def __init__(self, latency=0.0, verification_status='SUCCESS'):
+        self.calls = calls = RemoteCalls(latency)
+
+        class Resource:
+            kind = 'Resource'
+
+            def __init__(self, attributes):
+                self.attributes = attributes
+                self.id = None
+
+            def create(self):
+                self.id = f"{self.kind}-{calls.call(f'{self.kind}.create')}"
+                return True
+
+        class BillingPlan(Resource):
+            kind = 'BillingPlan'
+
+            def activate(self):
+                calls.call('BillingPlan.activate')
+                return True
+
+        class BillingAgreement(Resource):
+            kind = 'BillingAgreement'
+
+            def create(self):
+                created = super().create()
+                self.links = [SimpleNamespace(rel='approval_url', href=f'https://paypal.test/approve/{self.id}')]
+                return created
+
+        class Api:
+            def default(self):
+                return self
+
+            def post(self, path, body):
+                calls.call(f'POST {path}')
+                return {'verification_status': verification_status}
+
+        self.BillingPlan = BillingPlan
+        self.BillingAgreement = BillingAgreement
+        self.api = Api()
@@ -0,0 +1,83 @@
+"""
+Local SMTP Sink
+A plain-SMTP server on 127.0.0.1 that accepts every message and keeps it in
+memory. Point EMAIL_CONFIG at it with use_tls off (SMTP_USE_TLS=0) to send
+trial notifications without a real mail server.
+"""
+
+import socketserver
+import threading
+from email import message_from_bytes
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Records each connection and every (sender, recipients, message) delivered"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), SMTPSession)
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self.server_address
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def deliver(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append((sender, recipients, message_from_bytes(data)))
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 for smtplib: EHLO/HELO, MAIL, RCPT, DATA, NOOP, RSET, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        with self.server._lock:
+            self.server.connections += 1
+        sender, recipients = None, []
+        self.reply('220 smtp-sink ready')
+        for raw in self.rfile:
+            command = raw.decode('ascii', 'replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                self.reply('250-smtp-sink')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self.server.deliver(sender, recipients, b''.join(lines))
+                sender, recipients = None, []
+                self.reply('250 OK: queued')
+            elif verb in ('NOOP', 'RSET'):
+                if verb == 'RSET':
+                    sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
@@ -0,0 +1,53 @@
+"""
+App Assembly Test
+Routes shared by the tenant dashboards are registered once, and pages link to
+wherever the app factory mounted each blueprint
+"""
+
+import re
+
+import pytest
+
+pytest.importorskip('flask')
+
+from flask import render_template
+
+from app import create_app
+
+@pytest.fixture(scope='module')
+def app():
+    return create_app()
+
+def test_audit_routes_are_registered_once_at_the_root(app):
+    rules = [str(rule) for rule in app.url_map.iter_rules()]
+    assert [rule for rule in rules if 'access-logs' in rule] == ['/api/access-logs/<access_token>']
+    assert [rule for rule in rules if '/api/export/' in rule] == ['/api/export/<access_token>/<dataset>']
+
+def test_audit_api_follows_either_tenant_feature():
+    rules = [str(rule) for rule in create_app({'features': 'investigation,country_access'}).url_map.iter_rules()]
+    assert '/api/access-logs/<access_token>' in rules
+
+def test_user_management_page_fetches_mounted_urls(app):
+    with app.test_request_context('/'):
+        html = render_template('user_management.html', access_token='TOKEN',
+                               user={'business_name': 'B', 'name': 'N', 'role': 'owner',
+                                     'current_country_name': 'United States', 'is_vpn': False})
+    client = app.test_client()
+    countries_url = re.search(r"fetch\('([^']*countries)'\)", html).group(1)
+    assert countries_url == '/country/api/countries'
+    assert client.get(countries_url).status_code == 200
+
+def test_access_logs_include_country_columns(app, tenant):
+    user = tenant(role='owner', session_limit=5)
+    response = app.test_client().get(f"/api/access-logs/{user['access_token']}?format=columnar")
+    assert response.status_code == 200
+    assert {'country_code', 'is_vpn'} <= set(response.get_json()['columns'])
+
+def test_user_management_page_without_country_access():
+    app = create_app({'features': 'access_control'})
+    with app.test_request_context('/'):
+        html = render_template('user_management.html', access_token='TOKEN',
+                               user={'business_name': 'B', 'name': 'N', 'role': 'owner',
+                                     'current_country_name': 'United States', 'is_vpn': False})
+    assert 'id="countries-list"' not in html and 'api/countries' not in html
+    assert "fetch('/api/create-user/TOKEN'" in html
@@ -0,0 +1,45 @@
+"""
+Audit Log Writer Test
+The queue never grows past max_queue, including while the writer shuts down
+"""
+
+import threading
+
+from core.audit_log import AuditLogWriter
+from core.database import get_connection
+from core.log_partitions import list_partitions
+
+def audit_rows(action):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        return sum(cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE action = ?', (action,)).fetchone()[0]
+                   for table in list_partitions(cursor))
+
+def entry(action):
+    return {'client_id': 'audit_client', 'action': action}
+
+def test_blocked_producer_writes_inline_once_shutdown_starts(db):
+    # Never started, so nothing drains the queue: the producer blocks on the full queue
+    writer = AuditLogWriter(batch_size=10, flush_interval=0.05, max_queue=2, overflow_policy='block')
+    writer.submit(entry('block_test'))
+    writer.submit(entry('block_test'))
+    producer = threading.Thread(target=writer.submit, args=(entry('block_test'),))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+
+    writer.shutdown()
+    producer.join(1)
+    assert not producer.is_alive()
+    assert writer.stats()['queue_depth'] == 0
+    assert writer.stats()['overflow_sync_writes'] == 1
+    assert audit_rows('block_test') == 3
+
+def test_submit_after_shutdown_is_written_not_queued(db):
+    writer = AuditLogWriter(batch_size=10, flush_interval=0.05, max_queue=2, overflow_policy='block')
+    writer.start()
+    writer.shutdown()
+    writer.submit(entry('late_test'))
+
+    assert writer.stats()['queue_depth'] == 0
+    assert audit_rows('late_test') == 1
@@ -0,0 +1,68 @@
+"""
+Checkout Latency Test
+Times Stripe and PayPal checkouts against local provider stand-ins with a fixed
+round trip per call: once the plan's price/billing plan and the customer are
+cached, a checkout makes a single remote call
+"""
+
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+
+import payment_system
+from provider_standins import PayPalStandIn, StripeStandIn
+
+ROUND_TRIP = 0.05
+
+@pytest.fixture
+def providers(db):
+    stripe_api, paypal_api = StripeStandIn(ROUND_TRIP), PayPalStandIn(ROUND_TRIP)
+    previous = payment_system.set_payment_providers(stripe_api, paypal_api)
+    # Provider ids cached by earlier tests belong to other stand-ins
+    with db() as conn:
+        conn.cursor().execute('''
+            UPDATE payment_plans SET stripe_price_id_monthly = NULL, stripe_price_id_yearly = NULL,
+                                     paypal_plan_id_monthly = NULL, paypal_plan_id_yearly = NULL
+        ''')
+    yield stripe_api, paypal_api
+    payment_system.PAYMENT_PROVIDERS.clear()
+    payment_system.PAYMENT_PROVIDERS.update(previous)
+
+def timed(checkout, *args):
+    started = time.perf_counter()
+    result = checkout(*args)
+    assert result['success'], result
+    return time.perf_counter() - started
+
+def test_returning_stripe_checkout_is_one_round_trip(providers, tenant):
+    stripe_api, _ = providers
+    client_id = tenant()['client_id']
+
+    timed(payment_system.create_stripe_subscription, client_id, 'basic', 'monthly', 'pm_card')
+    assert stripe_api.calls.log == ['Price.create', 'Customer.create', 'Subscription.create']
+
+    stripe_api.calls.reset()
+    elapsed = timed(payment_system.create_stripe_subscription, client_id, 'basic', 'monthly', 'pm_card')
+    assert stripe_api.calls.log == ['Subscription.create']
+    assert elapsed < 2 * ROUND_TRIP
+
+    # A new card is attached to the existing customer first
+    stripe_api.calls.reset()
+    timed(payment_system.create_stripe_subscription, client_id, 'basic', 'monthly', 'pm_new_card')
+    assert stripe_api.calls.log == ['PaymentMethod.attach', 'Subscription.create']
+
+def test_paypal_checkout_after_plan_creation_is_one_round_trip(providers, tenant):
+    _, paypal_api = providers
+    client_id = tenant()['client_id']
+    urls = ('https://example.com/return', 'https://example.com/cancel')
+
+    timed(payment_system.create_paypal_subscription, client_id, 'professional', 'yearly', *urls)
+    assert paypal_api.calls.log == ['BillingPlan.create', 'BillingPlan.activate', 'BillingAgreement.create']
+
+    paypal_api.calls.reset()
+    elapsed = timed(payment_system.create_paypal_subscription, tenant()['client_id'], 'professional', 'yearly',
+                    *urls)
+    assert paypal_api.calls.log == ['BillingAgreement.create']
+    assert elapsed < 2 * ROUND_TRIP
@@ -0,0 +1,45 @@
+"""
+Entitlement Test
+Feature flags come from the payment_plans rows, and user limits fall back to
+the plan defaults for clients without an entitlement record
+"""
+
+import json
+
+from core.entitlements import PLAN_LIMITS, get_entitlements, max_users_for, refresh_entitlements
+
+def test_feature_flags_follow_the_plan_row(tenant, db):
+    client_id = tenant()['client_id']
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE clients SET plan_type = 'professional' WHERE client_id = ?", (client_id,))
+        refresh_entitlements(cursor, [client_id])
+    assert get_entitlements(client_id)['features']['api_access'] is True
+
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT feature_flags FROM payment_plans WHERE plan_id = 'professional'")
+        original = cursor.fetchone()[0]
+        cursor.execute("UPDATE payment_plans SET feature_flags = ? WHERE plan_id = 'professional'",
+                       (json.dumps(dict(json.loads(original), api_access=False)),))
+        refresh_entitlements(cursor, [client_id])
+    try:
+        assert get_entitlements(client_id)['features']['api_access'] is False
+    finally:
+        with db() as conn:
+            conn.cursor().execute("UPDATE payment_plans SET feature_flags = ? WHERE plan_id = 'professional'",
+                                  (original,))
+
+def test_trials_get_no_paid_features(tenant, db):
+    client_id = tenant()['client_id']
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE clients SET account_type = 'trial' WHERE client_id = ?", (client_id,))
+        refresh_entitlements(cursor, [client_id])
+    features = get_entitlements(client_id)['features']
+    assert features and not any(features.values())
+
+def test_max_users_falls_back_to_plan_limits_without_entitlements():
+    assert get_entitlements('client_without_row') is None
+    assert max_users_for('client_without_row') == PLAN_LIMITS['basic']['max_users']
+    assert max_users_for('client_without_row', 'enterprise') == PLAN_LIMITS['enterprise']['max_users']
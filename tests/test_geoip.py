@@ -0,0 +1,92 @@
+"""
+Geo-IP Resolution Test
+Country and proxy status come from a local range CSV with the network cut off:
+when a database file is present, the default settings never reach ip-api.com
+"""
+
+import socket
+
+import pytest
+
+from core import geoip
+
+RANGES = '''start_ip,end_ip,country_code,is_proxy
+# documentation ranges
+192.0.2.0,192.0.2.255,de,0
+198.51.100.0,198.51.100.255,NL,1
+3405803776,3405804031,FR,0
+2001:db8::,2001:db8::ffff,jp,true
+'''
+
+@pytest.fixture
+def offline(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError('geo lookup tried to use the network')
+    monkeypatch.setattr(socket, 'create_connection', refuse)
+    monkeypatch.setattr(socket.socket, 'connect', refuse)
+
+@pytest.fixture
+def resolver(tmp_path, monkeypatch):
+    database = tmp_path / 'geoip_ranges.csv'
+    database.write_text(RANGES)
+    resolver = geoip.build_resolver(dict(geoip.GEOIP_CONFIG, database_path=str(database), remote_fallback='auto',
+                                         cache_size=2))
+    monkeypatch.setattr(geoip, '_resolver', resolver)
+    return resolver
+
+def test_local_database_replaces_the_remote_backend(resolver):
+    assert [type(backend) for backend in resolver.backends] == [geoip.RangeDatabaseResolver]
+    assert len(resolver.backends[0]) == 4
+
+def test_lookups_answer_offline(resolver, offline):
+    assert geoip.lookup_ip('192.0.2.17') == ('DE', False)
+    assert geoip.lookup_ip('198.51.100.255') == ('NL', True)
+    assert geoip.lookup_ip('203.0.113.5') == ('FR', False)  # range given as integers
+    assert geoip.lookup_ip('2001:db8::42') == ('JP', True)
+    assert geoip.lookup_ip('192.0.3.1') == geoip.UNKNOWN
+    assert geoip.lookup_ip('not-an-ip') == geoip.UNKNOWN
+    assert geoip.lookup_ip('127.0.0.1') == geoip.LOCALHOST
+
+def test_cache_is_bounded(resolver, offline):
+    for ip_address in ('192.0.2.1', '192.0.2.2', '192.0.2.1', '192.0.2.3', '192.0.2.2'):
+        geoip.lookup_ip(ip_address)
+    # .2 was evicted by .3, so only the repeat of .1 hit the cache
+    assert geoip.geoip_metrics() == {'hits': 1, 'misses': 4, 'cached': 2}
+
+class FlakyRemote:
+    """Remote backend stand-in: fails (returns None) until it is told to answer"""
+
+    definitive = False
+
+    def __init__(self):
+        self.answer = None
+        self.calls = 0
+
+    def lookup(self, ip_address):
+        self.calls += 1
+        return self.answer
+
+def test_remote_failures_are_retried_after_failure_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(geoip.time, 'monotonic', lambda: clock[0])
+    remote = FlakyRemote()
+    resolver = geoip.GeoResolver([geoip.RangeDatabaseResolver(), remote], failure_ttl=30)
+
+    assert resolver.resolve('203.0.113.9') == geoip.UNKNOWN
+    assert resolver.resolve('203.0.113.9') == geoip.UNKNOWN
+    assert remote.calls == 1  # briefly cached, so a dead service is not hit on every request
+
+    remote.answer = geoip.GeoResult('FR', False)
+    clock[0] += 31
+    assert resolver.resolve('203.0.113.9') == ('FR', False)
+    assert remote.calls == 2
+
+def test_misses_of_the_range_database_are_cached(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(geoip.time, 'monotonic', lambda: clock[0])
+    resolver = geoip.GeoResolver([geoip.RangeDatabaseResolver([('192.0.2.0', '192.0.2.255', 'DE', '0')])])
+
+    assert resolver.resolve('203.0.113.9') == geoip.UNKNOWN
+    clock[0] += 10 ** 6
+    assert resolver.resolve('203.0.113.9') == geoip.UNKNOWN
+    assert resolver.stats()['hits'] == 1
@@ -0,0 +1,28 @@
+"""
+Access Log Retention Test
+Retention must prune old partitions at boot, not only across a month rollover
+"""
+
+from datetime import datetime
+
+from core.log_partitions import LOG_PARTITION_CONFIG, apply_log_retention, ensure_partition, list_partitions
+
+def test_retention_job_drops_expired_partitions_once_per_interval(db):
+    with db() as conn:
+        cursor = conn.cursor()
+        ensure_partition(cursor, '200001')
+        current = ensure_partition(cursor, datetime.utcnow().strftime('%Y%m'))
+
+    assert apply_log_retention() == ['access_logs_200001']
+    with db() as conn:
+        assert list_partitions(conn.cursor()) == [current]
+
+    # Another worker booting inside the same interval leaves it to the lease holder
+    with db() as conn:
+        ensure_partition(conn.cursor(), '200002')
+    assert apply_log_retention() == []
+
+    with db() as conn:
+        conn.cursor().execute("UPDATE scheduler_leases SET expires_at = 0 WHERE name = ?",
+                              (LOG_PARTITION_CONFIG['retention_lease'],))
+    assert apply_log_retention() == ['access_logs_200002']
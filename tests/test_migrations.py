@@ -0,0 +1,69 @@
+"""
+Schema Upgrade Test
+A client_management.db created by the baseline services (no schema_version
+table, so version 0) must replay every migration and boot, taking over the
+investigation app's logins and visitors from its old visitors.db
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_SCHEMA = os.path.join(REPO_ROOT, 'tests', 'fixtures', 'baseline_client_management.sql')
+BASELINE_VISITORS_SCHEMA = os.path.join(REPO_ROOT, 'tests', 'fixtures', 'baseline_visitors.sql')
+
+# Runs in its own interpreter so the pool opens the baseline database
+UPGRADE = '''
+from core.migrations import LATEST_VERSION, current_version, ensure_schema
+from core.database import get_connection
+ensure_schema()
+with get_connection() as conn:
+    assert current_version(conn.cursor()) == LATEST_VERSION
+'''
+
+def baseline_database(path, schema):
+    conn = sqlite3.connect(path)
+    with open(schema) as handle:
+        conn.executescript(handle.read())
+    return conn
+
+def test_baseline_database_upgrades_to_latest(tmp_path):
+    visitors_path = str(tmp_path / 'visitors.db')
+    conn = baseline_database(visitors_path, BASELINE_VISITORS_SCHEMA)
+    conn.executemany('INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)',
+                     [('admin', 'changed', 'admin'), ('analyst', 'hash', 'user')])
+    conn.execute("INSERT INTO visitors (website_url, name, company) VALUES ('https://example.com', 'Ada', 'Acme')")
+    conn.commit()
+    conn.close()
+
+    db_path = str(tmp_path / 'client_management.db')
+    conn = baseline_database(db_path, BASELINE_SCHEMA)
+    conn.execute('''
+        INSERT INTO clients (client_id, business_name, contact_email, website_url, access_token, plan_type)
+        VALUES ('client-1', 'Baseline Business', 'owner@example.com', 'https://example.com', 'token-1',
+                'professional')
+    ''')
+    conn.commit()
+    conn.close()
+
+    env = dict(os.environ, CLIENT_DB_PATH=db_path, INVESTIGATION_LEGACY_DB=visitors_path, SCHEDULER_ENABLED='0',
+               AUDIT_LOG_MODE='sync')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')]))
+    completed = subprocess.run([sys.executable, '-c', UPGRADE], cwd=REPO_ROOT, env=env, capture_output=True,
+                               text=True, timeout=60)
+    assert completed.returncode == 0, completed.stderr
+
+    conn = sqlite3.connect(db_path)
+    flags = dict(conn.execute('SELECT plan_id, feature_flags FROM payment_plans').fetchall())
+    assert set(flags) == {'basic', 'professional', 'enterprise'}
+    assert json.loads(flags['professional'])['excel_export'] is True
+    features = conn.execute("SELECT features FROM client_entitlements WHERE client_id = 'client-1'").fetchone()[0]
+    assert json.loads(features)['excel_export'] is True
+    assert conn.execute('SELECT username, password_hash FROM users ORDER BY username').fetchall() == \
+        [('admin', 'changed'), ('analyst', 'hash')]
+    assert conn.execute('SELECT website_url, name, company FROM visitors').fetchall() == \
+        [('https://example.com', 'Ada', 'Acme')]
+    conn.close()
@@ -0,0 +1,77 @@
+"""
+Trial Notification Dispatch Test
+Due trial notifications are delivered to a local SMTP sink in one batch over a
+single SMTP connection, and their rows are marked sent
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.ids import generate_client_id
+from core.notifications import NotificationDispatcher
+from smtp_sink import SMTPSink
+
+@pytest.fixture
+def sink():
+    server = SMTPSink().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def email_config(sink):
+    host, port = sink.address
+    return {'smtp_server': host, 'smtp_port': port, 'use_tls': False, 'email': 'trials@example.com',
+            'password': '', 'from_name': 'Visitor Investigation System'}
+
+def trial_client(db, email, notification_types):
+    """A trial client with one due notification per type; returns the notification row ids"""
+    client_id = generate_client_id()
+    due = (datetime.now() - timedelta(minutes=1)).isoformat()
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO clients (client_id, business_name, contact_email, website_url, access_token,
+                                 account_type, trial_end_time)
+            VALUES (?, 'Trial Business', ?, 'https://example.com', ?, 'trial', ?)
+        ''', (client_id, email, f'token-{client_id}', (datetime.now() + timedelta(days=1)).isoformat()))
+        ids = []
+        for notification_type in notification_types:
+            cursor.execute('''
+                INSERT INTO trial_notifications (notification_id, client_id, notification_type, scheduled_time)
+                VALUES (?, ?, ?, ?)
+            ''', (f'{client_id}-{notification_type}', client_id, notification_type, due))
+            ids.append(cursor.lastrowid)
+    return ids
+
+def statuses(db, ids):
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT status FROM trial_notifications WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        return [row[0] for row in cursor.fetchall()]
+
+def test_batch_is_sent_over_one_connection(db, sink, email_config):
+    ids = (trial_client(db, 'a@first.example', ['trial_reminder', 'trial_expiring'])
+           + trial_client(db, 'b@second.example', ['trial_reminder']))
+
+    dispatcher = NotificationDispatcher(email_config)
+    try:
+        assert dispatcher.dispatch() == 3
+    finally:
+        dispatcher.close()
+
+    assert sink.connections == 1
+    assert sorted(recipients[0] for _, recipients, _ in sink.messages) == \
+        ['a@first.example', 'a@first.example', 'b@second.example']
+    subjects = {message['Subject'] for _, _, message in sink.messages}
+    assert 'Your Trial Business trial expires soon' in subjects
+    assert statuses(db, ids) == ['sent'] * 3
+
+def test_unreachable_server_leaves_notifications_pending(db, sink, email_config):
+    ids = trial_client(db, 'c@third.example', ['trial_reminder'])
+    sink.stop()
+
+    dispatcher = NotificationDispatcher(email_config)
+    assert dispatcher.dispatch() == 0
+    assert statuses(db, ids) == ['pending']
+    assert dispatcher.stats()['failed'] == 1
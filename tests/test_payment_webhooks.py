@@ -0,0 +1,85 @@
+"""
+Payment Webhook Test
+Only provider-verified events reach the inbox; PayPal deliveries are checked
+with the verify-webhook-signature API before they are stored
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip('flask')
+
+import payment_system
+
+SIGNED_HEADERS = {
+    'Paypal-Transmission-Id': 'tx-1',
+    'Paypal-Transmission-Time': '2024-01-01T00:00:00Z',
+    'Paypal-Transmission-Sig': 'signature',
+    'Paypal-Cert-Url': 'https://api.paypal.com/v1/notifications/certs/CERT',
+    'Paypal-Auth-Algo': 'SHA256withRSA'
+}
+
+class VerifyingApi:
+    """PayPal REST client stand-in answering verify-webhook-signature"""
+
+    def __init__(self, status):
+        self.status = status
+        self.requests = []
+
+    def default(self):
+        return self
+
+    def post(self, path, body):
+        self.requests.append((path, body))
+        return {'verification_status': self.status}
+
+class PayPalStandIn:
+    def __init__(self, status):
+        self.api = VerifyingApi(status)
+
+@pytest.fixture
+def paypal(db, monkeypatch):
+    def install(status):
+        stand_in = PayPalStandIn(status)
+        monkeypatch.setitem(payment_system.PAYMENT_PROVIDERS, 'paypal', stand_in)
+        return stand_in
+    return install
+
+def inbox_events(db, event_id):
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT event_type FROM payment_webhook_events WHERE payment_provider = 'paypal' "
+                       "AND event_id = ?", (event_id,))
+        return cursor.fetchall()
+
+def paypal_event(event_id):
+    return json.dumps({'id': event_id, 'event_type': 'BILLING.SUBSCRIPTION.CANCELLED',
+                       'resource': {'id': 'I-AGREEMENT'}})
+
+def test_verified_paypal_event_is_queued(paypal, db):
+    stand_in = paypal('SUCCESS')
+    result = payment_system.handle_paypal_webhook(paypal_event('WH-OK'), SIGNED_HEADERS)
+
+    assert result == {'success': True, 'duplicate': False}
+    assert inbox_events(db, 'WH-OK') == [('BILLING.SUBSCRIPTION.CANCELLED',)]
+    path, body = stand_in.api.requests[0]
+    assert path == 'v1/notifications/verify-webhook-signature'
+    assert body['transmission_sig'] == 'signature'
+    assert body['webhook_id'] == payment_system.PAYPAL_CONFIG['webhook_id']
+    assert body['webhook_event']['id'] == 'WH-OK'
+
+def test_unverified_paypal_event_is_rejected(paypal, db):
+    paypal('FAILURE')
+    result = payment_system.handle_paypal_webhook(paypal_event('WH-FORGED'), SIGNED_HEADERS)
+
+    assert result['success'] is False
+    assert inbox_events(db, 'WH-FORGED') == []
+
+def test_unsigned_paypal_event_never_reaches_the_api(paypal, db):
+    stand_in = paypal('SUCCESS')
+    result = payment_system.handle_paypal_webhook(paypal_event('WH-UNSIGNED'), {})
+
+    assert result['success'] is False
+    assert stand_in.api.requests == []
+    assert inbox_events(db, 'WH-UNSIGNED') == []
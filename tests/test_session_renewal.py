@@ -0,0 +1,53 @@
+"""
+Session Token Renewal Test
+Renewing the dashboard's session token must not count that session twice, and
+token-authorized calls must see the same user payload as URL-token calls
+"""
+
+from datetime import datetime, timedelta
+
+from core.authorization import (authorize_request, issue_user_session_token, renew_session_token, user_payload,
+                                verify_user_access)
+from core.database import get_connection
+from core.ids import generate_session_id
+
+def open_dashboard(user):
+    """What the dashboard route does: verify, record the session, issue a token"""
+    user_data = verify_user_access(user['access_token'], '10.0.0.1', resolve_country=False)
+    with get_connection() as conn:
+        conn.cursor().execute('''
+            INSERT INTO user_sessions (session_id, user_id, client_id, ip_address, expires_at)
+            VALUES (?, ?, ?, '10.0.0.1', ?)
+        ''', (generate_session_id(), user_data['user_id'], user_data['client_id'],
+              (datetime.now() + timedelta(hours=24)).isoformat()))
+    return user_data, issue_user_session_token(user_data, user['access_token'], '10.0.0.1')[0]
+
+def test_renewal_skips_the_session_already_counted(tenant):
+    user = tenant(session_limit=1)
+    _, session_token = open_dashboard(user)
+
+    assert renew_session_token(user['access_token'], '10.0.0.1', session_token, resolve_country=False)
+    # Without the current token it is a new session, and the limit of one is used up
+    assert renew_session_token(user['access_token'], '10.0.0.1', resolve_country=False) is None
+    # A token bound to another IP does not stand for this session
+    assert renew_session_token(user['access_token'], '10.0.0.2', session_token, resolve_country=False) is None
+
+def test_renewal_still_rejects_inactive_users(tenant, db):
+    user = tenant(session_limit=5)
+    _, session_token = open_dashboard(user)
+    with db() as conn:
+        conn.cursor().execute("UPDATE client_users SET status = 'inactive' WHERE user_id = ?", (user['user_id'],))
+    from core.auth_cache import invalidate_user
+    invalidate_user(user['user_id'])
+
+    assert renew_session_token(user['access_token'], '10.0.0.1', session_token, resolve_country=False) is None
+
+def test_user_payload_matches_for_token_and_url_token_callers(tenant):
+    user = tenant(session_limit=5, role='viewer')
+    verified, session_token = open_dashboard(user)
+    from_token = authorize_request(user['access_token'], '10.0.0.1', session_token, resolve_country=False)
+
+    assert 'permission_mask' in from_token
+    assert user_payload(from_token) == user_payload(verified)
+    assert user_payload(from_token)['name'] == 'Test User'
+    assert user_payload(from_token)['business_name'] == 'Test Business'
@@ -0,0 +1,75 @@
+"""
+Cross-Worker Session Test
+Separate processes share one database and keyring, the way gunicorn workers do:
+whatever one worker signs, every other worker must accept, across key rotations.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('flask')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in its own interpreter; reads a JSON request on argv, prints a JSON result
+WORKER = '''
+import json, sys
+request = json.loads(sys.argv[1])
+from app import create_app
+from core.session_tokens import decode_session_token, issue_session_token
+
+client = create_app().test_client()
+result = {}
+if request['action'] == 'login':
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    result['cookie'] = response.headers['Set-Cookie'].split(';', 1)[0].split('=', 1)[1]
+    result['token'] = issue_session_token({'user_id': 'u1', 'client_id': 'c1'})[0]
+else:
+    client.set_cookie('session', request['cookie'])
+    response = client.get('/')
+    result['cookie_valid'] = response.status_code == 200
+    result['token_valid'] = decode_session_token(request['token']) is not None
+print(json.dumps(result))
+'''
+
+def run_worker(db_path, secret_keys, **request):
+    env = dict(os.environ, CLIENT_DB_PATH=db_path, SECRET_KEYS=secret_keys, APP_FEATURES='investigation',
+               SCHEDULER_ENABLED='0', AUDIT_LOG_MODE='sync')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')]))
+    completed = subprocess.run([sys.executable, '-c', WORKER, json.dumps(request)], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'workers.db')
+
+def test_session_signed_by_one_worker_verifies_in_another(db_path):
+    signed = run_worker(db_path, 'key-one', action='login')
+    checked = run_worker(db_path, 'key-one', action='check', **signed)
+    assert checked == {'cookie_valid': True, 'token_valid': True}
+
+def test_generated_key_is_shared_between_workers(db_path):
+    signed = run_worker(db_path, '', action='login')
+    checked = run_worker(db_path, '', action='check', **signed)
+    assert checked == {'cookie_valid': True, 'token_valid': True}
+
+def test_key_rotation_keeps_old_sessions_and_signs_with_new_key(db_path):
+    old = run_worker(db_path, 'key-one', action='login')
+
+    # Rotation step 2: the new key signs, the old one still verifies
+    assert run_worker(db_path, 'key-two,key-one', action='check', **old) == {'cookie_valid': True,
+                                                                           'token_valid': True}
+    new = run_worker(db_path, 'key-two,key-one', action='login')
+    assert run_worker(db_path, 'key-two', action='check', **new) == {'cookie_valid': True, 'token_valid': True}
+    assert run_worker(db_path, 'key-one', action='check', **new) == {'cookie_valid': False,
+                                                                    'token_valid': False}
+
+    # Rotation step 3: once the old key is dropped, what it signed is rejected
+    assert run_worker(db_path, 'key-two', action='check', **old) == {'cookie_valid': False,
+                                                                    'token_valid': False}
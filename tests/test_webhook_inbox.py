@@ -0,0 +1,100 @@
+"""
+Payment Webhook Inbox Test
+An event that cannot be applied is charged to itself only: the valid events
+queued around it still apply, and a busy database costs no attempts
+"""
+
+import sqlite3
+
+import pytest
+
+from core import webhook_inbox
+from core.leases import release_lease
+from core.webhook_inbox import WEBHOOK_CONFIG, WebhookConsumer, store_webhook_event
+
+@pytest.fixture
+def consumer(db):
+    consumer = WebhookConsumer()
+    yield consumer
+    release_lease(WEBHOOK_CONFIG['lease_name'], consumer.holder)
+
+@pytest.fixture
+def subscriptions(db, tenant):
+    """Stripe subscriptions sub_ok and sub_poison; updating sub_poison always fails"""
+    client_id = tenant()['client_id']
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM payment_webhook_events WHERE status = 'pending'")  # other tests' events
+        for ref in ('sub_ok', 'sub_poison'):
+            cursor.execute('''
+                INSERT INTO subscriptions (subscription_id, client_id, plan_id, payment_provider,
+                                           provider_subscription_id, status)
+                VALUES (?, ?, 'basic', 'stripe', ?, 'active')
+            ''', (f'{client_id}-{ref}', client_id, ref))
+        cursor.execute('''
+            CREATE TRIGGER poison_subscription BEFORE UPDATE ON subscriptions
+            WHEN NEW.provider_subscription_id = 'sub_poison'
+            BEGIN SELECT RAISE(ABORT, 'cannot apply this event'); END
+        ''')
+    yield
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DROP TRIGGER poison_subscription')
+        cursor.execute("DELETE FROM subscriptions WHERE provider_subscription_id IN ('sub_ok', 'sub_poison')")
+        cursor.execute("DELETE FROM payment_webhook_events WHERE provider_subscription_id IN ('sub_ok', 'sub_poison')")
+
+def queue(event_id, event_type, ref):
+    assert store_webhook_event('stripe', event_id, event_type, ref, '{}')
+
+def events(db):
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT event_id, status, attempts FROM payment_webhook_events
+            WHERE provider_subscription_id IN ('sub_ok', 'sub_poison') ORDER BY id
+        ''')
+        return cursor.fetchall()
+
+def subscription_status(db, ref):
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT status FROM subscriptions WHERE provider_subscription_id = ?', (ref,))
+        return cursor.fetchone()[0]
+
+def test_poison_event_fails_alone(db, subscriptions, consumer):
+    queue('evt_1', 'invoice.payment_failed', 'sub_ok')
+    queue('evt_2', 'invoice.payment_failed', 'sub_poison')
+    queue('evt_3', 'invoice.payment_succeeded', 'sub_poison')  # waits behind evt_2
+    queue('evt_4', 'customer.subscription.deleted', 'sub_ok')
+
+    assert consumer.run_once() == 2
+    assert subscription_status(db, 'sub_ok') == 'canceled'
+    assert events(db) == [('evt_1', 'processed', 0), ('evt_2', 'pending', 1), ('evt_3', 'pending', 0),
+                          ('evt_4', 'processed', 0)]
+
+    for _ in range(WEBHOOK_CONFIG['max_attempts'] - 1):
+        consumer.run_once()
+    assert events(db)[1:3] == [('evt_2', 'failed', WEBHOOK_CONFIG['max_attempts']), ('evt_3', 'pending', 0)]
+
+    # Once the poison event is parked, the next event for that subscription is tried in order
+    consumer.run_once()
+    assert events(db)[2] == ('evt_3', 'pending', 1)
+
+def test_busy_database_costs_no_attempts(db, subscriptions, consumer, monkeypatch):
+    queue('evt_busy', 'invoice.payment_failed', 'sub_ok')
+
+    def busy(limit=None):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(webhook_inbox, 'apply_webhook_batch', busy)
+
+    assert consumer.run_once() == 0
+    assert events(db) == [('evt_busy', 'pending', 0)]
+    assert consumer.stats()['transient_errors'] == 1
+    # Backing off: the next poll does not touch the database
+    assert consumer.run_once() == 0
+    assert consumer.stats()['transient_errors'] == 1
+
+    monkeypatch.undo()
+    consumer._retry_at = 0.0
+    assert consumer.run_once() == 1
+    assert events(db) == [('evt_busy', 'processed', 0)]
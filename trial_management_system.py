@@ -3,9 +3,7 @@ Enhanced Automated Client Onboarding with Trial Management
 Self-service client registration with flexible trial periods and automatic restrictions
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file
-from flask_cors import CORS
-import sqlite3
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, send_file
 import json
 import random
 import string
@@ -17,156 +15,40 @@ import secrets
 import os
 import csv
 import io
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-import requests
-import smtplib
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
-import threading
-import schedule
+from core.database import get_connection
+from core.auth_cache import invalidate_client
+from core.trial_expiry import TrialExpiryScheduler
+from core.tasks import register_task, task_queue_metrics
+from core.ids import generate_client_id, generate_user_id, generate_access_token, generate_trial_id
+from core.migrations import ensure_schema
+from core.scheduler import SCHEDULER_CONFIG
+from core.startup import on_startup
+from core.authorization import verify_user_access
+from core.session_tokens import revoke_client_sessions
+from core.token_filter import token_filter
+from core.entitlements import PLAN_LIMITS, refresh_entitlements
 
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
-CORS(app, origins="*")
+bp = Blueprint('trials', __name__)
 
 # Email configuration (configure with your SMTP settings)
 EMAIL_CONFIG = {
-    'smtp_server': 'smtp.gmail.com',  # Change to your SMTP server
-    'smtp_port': 587,
-    'email': 'your-email@gmail.com',  # Change to your email
-    'password': 'your-app-password',  # Change to your app password
+    'smtp_server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),  # Change to your SMTP server
+    'smtp_port': int(os.environ.get('SMTP_PORT', '587')),
+    'use_tls': os.environ.get('SMTP_USE_TLS', '1').lower() in ('1', 'true', 'yes'),  # 0 for a local SMTP sink
+    'email': os.environ.get('SMTP_EMAIL', 'your-email@gmail.com'),  # Change to your email
+    'password': os.environ.get('SMTP_PASSWORD', 'your-app-password'),  # Change to your app password
     'from_name': 'Visitor Investigation System'
 }
 
-def init_database():
-    """Initialize database with trial management tables"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    # Enhanced clients table with trial support
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id TEXT UNIQUE NOT NULL,
-            business_name TEXT NOT NULL,
-            contact_email TEXT NOT NULL,
-            website_url TEXT NOT NULL,
-            access_token TEXT UNIQUE NOT NULL,
-            subscription_status TEXT DEFAULT 'active',
-            account_type TEXT DEFAULT 'full',
-            trial_start_time TIMESTAMP,
-            trial_end_time TIMESTAMP,
-            trial_duration_hours INTEGER,
-            trial_extended_count INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_access TIMESTAMP,
-            billing_cycle TEXT DEFAULT 'monthly',
-            plan_type TEXT DEFAULT 'basic',
-            max_users INTEGER DEFAULT 5,
-            owner_user_id TEXT,
-            auto_restricted_at TIMESTAMP,
-            conversion_date TIMESTAMP,
-            trial_usage_stats TEXT
-        )
-    ''')
-    
-    # Trial management table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trial_management (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            trial_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            granted_by TEXT,
-            trial_type TEXT DEFAULT 'standard',
-            duration_hours INTEGER NOT NULL,
-            start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            end_time TIMESTAMP NOT NULL,
-            status TEXT DEFAULT 'active',
-            usage_stats TEXT,
-            reminder_sent BOOLEAN DEFAULT 0,
-            expiration_warning_sent BOOLEAN DEFAULT 0,
-            auto_restricted_at TIMESTAMP,
-            extension_count INTEGER DEFAULT 0,
-            conversion_attempted BOOLEAN DEFAULT 0,
-            notes TEXT,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id)
-        )
-    ''')
-    
-    # Trial notifications table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trial_notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            notification_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            notification_type TEXT NOT NULL,
-            scheduled_time TIMESTAMP NOT NULL,
-            sent_time TIMESTAMP,
-            status TEXT DEFAULT 'pending',
-            email_content TEXT,
-            retry_count INTEGER DEFAULT 0,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id)
-        )
-    ''')
-    
-    # Enhanced client users table with trial restrictions
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS client_users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE NOT NULL,
-            client_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            role TEXT DEFAULT 'viewer',
-            access_token TEXT UNIQUE NOT NULL,
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT,
-            last_access TIMESTAMP,
-            access_expires_at TIMESTAMP,
-            trial_restricted BOOLEAN DEFAULT 0,
-            country_restrictions TEXT,
-            block_vpn BOOLEAN DEFAULT 0,
-            permissions TEXT,
-            session_limit INTEGER DEFAULT 1,
-            current_sessions INTEGER DEFAULT 0,
-            notes TEXT,
-            FOREIGN KEY (client_id) REFERENCES clients (client_id)
-        )
-    ''')
-    
-    # Automated tasks table with trial management
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS automated_tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            task_id TEXT UNIQUE NOT NULL,
-            task_type TEXT NOT NULL,
-            client_id TEXT,
-            trial_id TEXT,
-            status TEXT DEFAULT 'pending',
-            scheduled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            executed_at TIMESTAMP,
-            result TEXT,
-            error_message TEXT,
-            retry_count INTEGER DEFAULT 0,
-            max_retries INTEGER DEFAULT 3,
-            task_data TEXT
-        )
-    ''')
-    
-    # Include previous tables (onboarding_requests, user_sessions, access_logs, visitor_investigations, admin_users)
-    # ... (previous table creation code)
-    
-    conn.commit()
-    conn.close()
-
-# Initialize database
-init_database()
+# Expired trials restricted per write transaction; smaller batches let dashboard reads in sooner
+TRIAL_RESTRICTION_CONFIG = {
+    'batch_size': int(os.environ.get('TRIAL_RESTRICTION_BATCH_SIZE', '500'))
+}
 
-def generate_trial_id():
-    """Generate unique trial identifier"""
-    return f"trial_{uuid.uuid4().hex[:12]}"
+@on_startup
+def init_database():
+    """Bring the database schema up to date (a single version read once it is current)"""
+    ensure_schema()
 
 def calculate_trial_end_time(duration_hours):
     """Calculate trial end time based on duration"""
@@ -176,8 +58,6 @@ def create_trial_account(business_name, contact_email, website_url, duration_hou
     """Create a trial account with automatic expiration"""
     try:
         # Generate unique identifiers
-        from country_access_control import generate_client_id, generate_user_id, generate_access_token
-        
         client_id = generate_client_id()
         trial_id = generate_trial_id()
         owner_user_id = generate_user_id()
@@ -187,57 +67,59 @@ def create_trial_account(business_name, contact_email, website_url, duration_hou
         trial_start = datetime.now()
         trial_end = calculate_trial_end_time(duration_hours)
         
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Create trial client
-        cursor.execute('''
-            INSERT INTO clients 
-            (client_id, business_name, contact_email, website_url, access_token, 
-             account_type, trial_start_time, trial_end_time, trial_duration_hours,
-             plan_type, max_users, owner_user_id, subscription_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (client_id, business_name, contact_email, website_url, client_access_token, 
-              'trial', trial_start.isoformat(), trial_end.isoformat(), duration_hours,
-              'trial', 3, owner_user_id, 'trial'))  # Trial accounts get 3 users max
-        
-        # Create trial management record
-        cursor.execute('''
-            INSERT INTO trial_management 
-            (trial_id, client_id, granted_by, trial_type, duration_hours, 
-             start_time, end_time, usage_stats)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (trial_id, client_id, granted_by, trial_type, duration_hours,
-              trial_start.isoformat(), trial_end.isoformat(), json.dumps({})))
-        
-        # Create owner user with trial permissions
-        trial_permissions = {
-            'view_visitors': True,
-            'view_contact_info': True,
-            'view_email': True,
-            'view_phone': False,  # Limited in trial
-            'view_company': True,
-            'export_data': False,  # Limited in trial
-            'manage_users': True,
-            'view_audit_logs': False  # Limited in trial
-        }
-        
-        cursor.execute('''
-            INSERT INTO client_users 
-            (user_id, client_id, name, email, role, access_token, created_by, 
-             permissions, session_limit)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (owner_user_id, client_id, business_name + ' (Trial)', contact_email, 'owner', 
-              owner_access_token, granted_by, json.dumps(trial_permissions), 2))
-        
-        # Schedule trial notifications
-        schedule_trial_notifications(client_id, trial_id, trial_end, duration_hours)
-        
-        # Schedule automatic restriction
-        schedule_automatic_restriction(client_id, trial_id, trial_end)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Create trial client
+            cursor.execute('''
+                INSERT INTO clients 
+                (client_id, business_name, contact_email, website_url, access_token, 
+                 account_type, trial_start_time, trial_end_time, trial_duration_hours,
+                 plan_type, max_users, owner_user_id, subscription_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (client_id, business_name, contact_email, website_url, client_access_token, 
+                  'trial', trial_start.isoformat(), trial_end.isoformat(), duration_hours,
+                  'trial', PLAN_LIMITS['trial']['max_users'], owner_user_id, 'trial'))
+            
+            # Create trial management record
+            cursor.execute('''
+                INSERT INTO trial_management 
+                (trial_id, client_id, granted_by, trial_type, duration_hours, 
+                 start_time, end_time, usage_stats)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (trial_id, client_id, granted_by, trial_type, duration_hours,
+                  trial_start.isoformat(), trial_end.isoformat(), json.dumps({})))
+            
+            # Create owner user with trial permissions
+            trial_permissions = {
+                'view_visitors': True,
+                'view_contact_info': True,
+                'view_email': True,
+                'view_phone': False,  # Limited in trial
+                'view_company': True,
+                'export_data': False,  # Limited in trial
+                'manage_users': True,
+                'view_audit_logs': False  # Limited in trial
+            }
+            
+            cursor.execute('''
+                INSERT INTO client_users 
+                (user_id, client_id, name, email, role, access_token, created_by, 
+                 permissions, session_limit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (owner_user_id, client_id, business_name + ' (Trial)', contact_email, 'owner', 
+                  owner_access_token, granted_by, json.dumps(trial_permissions), 2))
+            
+            refresh_entitlements(cursor, [client_id])
+            
+            # Schedule trial notifications
+            schedule_trial_notifications(client_id, trial_id, trial_end, duration_hours)
+            
+            # Schedule automatic restriction
+            schedule_automatic_restriction(client_id, trial_id, trial_end)
         
-        conn.commit()
-        conn.close()
+        trial_expiry.push(client_id, trial_end)
+        token_filter.add(owner_access_token)
         
         # Generate demo data for trial
         create_automated_task('generate_demo_data', client_id, trial_id)
@@ -258,152 +140,191 @@ def create_trial_account(business_name, contact_email, website_url, duration_hou
 
 def schedule_trial_notifications(client_id, trial_id, trial_end, duration_hours):
     """Schedule trial reminder and expiration notifications"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    # Schedule reminder notification (at 75% of trial period)
-    reminder_time = trial_end - timedelta(hours=duration_hours * 0.25)
-    if reminder_time > datetime.now():
-        cursor.execute('''
-            INSERT INTO trial_notifications 
-            (notification_id, client_id, notification_type, scheduled_time)
-            VALUES (?, ?, ?, ?)
-        ''', (f"reminder_{uuid.uuid4().hex[:8]}", client_id, 'trial_reminder', reminder_time.isoformat()))
-    
-    # Schedule expiration warning (1 hour before expiration for short trials, 24 hours for long trials)
-    warning_hours = 1 if duration_hours <= 24 else 24
-    warning_time = trial_end - timedelta(hours=warning_hours)
-    if warning_time > datetime.now():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Schedule reminder notification (at 75% of trial period)
+        reminder_time = trial_end - timedelta(hours=duration_hours * 0.25)
+        if reminder_time > datetime.now():
+            cursor.execute('''
+                INSERT INTO trial_notifications 
+                (notification_id, client_id, notification_type, scheduled_time)
+                VALUES (?, ?, ?, ?)
+            ''', (f"reminder_{uuid.uuid4().hex[:8]}", client_id, 'trial_reminder', reminder_time.isoformat()))
+        
+        # Schedule expiration warning (1 hour before expiration for short trials, 24 hours for long trials)
+        warning_hours = 1 if duration_hours <= 24 else 24
+        warning_time = trial_end - timedelta(hours=warning_hours)
+        if warning_time > datetime.now():
+            cursor.execute('''
+                INSERT INTO trial_notifications 
+                (notification_id, client_id, notification_type, scheduled_time)
+                VALUES (?, ?, ?, ?)
+            ''', (f"warning_{uuid.uuid4().hex[:8]}", client_id, 'trial_expiring', warning_time.isoformat()))
+        
+        # Schedule expiration notification (at trial end)
         cursor.execute('''
             INSERT INTO trial_notifications 
             (notification_id, client_id, notification_type, scheduled_time)
             VALUES (?, ?, ?, ?)
-        ''', (f"warning_{uuid.uuid4().hex[:8]}", client_id, 'trial_expiring', warning_time.isoformat()))
-    
-    # Schedule expiration notification (at trial end)
-    cursor.execute('''
-        INSERT INTO trial_notifications 
-        (notification_id, client_id, notification_type, scheduled_time)
-        VALUES (?, ?, ?, ?)
-    ''', (f"expired_{uuid.uuid4().hex[:8]}", client_id, 'trial_expired', trial_end.isoformat()))
-    
-    conn.commit()
-    conn.close()
+        ''', (f"expired_{uuid.uuid4().hex[:8]}", client_id, 'trial_expired', trial_end.isoformat()))
 
 def schedule_automatic_restriction(client_id, trial_id, trial_end):
     """Schedule automatic restriction task"""
     create_automated_task('restrict_trial_access', client_id, trial_id, trial_end)
 
-def check_and_restrict_expired_trials():
-    """Check for expired trials and automatically restrict access"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    # Find expired trials that haven't been restricted yet
-    cursor.execute('''
-        SELECT client_id, trial_id, business_name, contact_email
-        FROM clients c
-        JOIN trial_management tm ON c.client_id = tm.client_id
-        WHERE c.account_type = 'trial' 
-        AND c.trial_end_time <= ? 
-        AND c.auto_restricted_at IS NULL
-        AND tm.status = 'active'
-    ''', (datetime.now().isoformat(),))
+def check_and_restrict_expired_trials(client_ids=None):
+    """Check for expired trials and automatically restrict access.
     
-    expired_trials = cursor.fetchall()
+    Expired trials are restricted in bounded batches, each a handful of
+    set-based UPDATEs keyed off a temp table, so the write lock is only held
+    briefly. With client_ids, only those trials are checked (used when a
+    deadline fires). Returns the number restricted and per-batch timings.
+    """
+    params = [datetime.now().isoformat()]
+    client_filter = ''
+    if client_ids:
+        client_filter = f"AND c.client_id IN ({', '.join('?' for _ in client_ids)})"
+        params.extend(client_ids)
     
-    for client_id, trial_id, business_name, contact_email in expired_trials:
-        try:
+    batch_size = TRIAL_RESTRICTION_CONFIG['batch_size']
+    batches = []
+    restricted = 0
+    while True:
+        started = time.perf_counter()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if not conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS expired_trial_batch (client_id TEXT, trial_id TEXT)
+            ''')
+            cursor.execute('DELETE FROM temp.expired_trial_batch')
+            
+            # Find expired trials that haven't been restricted yet
+            cursor.execute(f'''
+                INSERT INTO temp.expired_trial_batch (client_id, trial_id)
+                SELECT c.client_id, tm.trial_id
+                FROM clients c
+                JOIN trial_management tm ON c.client_id = tm.client_id
+                WHERE c.account_type = 'trial' 
+                AND c.trial_end_time <= ? 
+                AND c.auto_restricted_at IS NULL
+                AND tm.status = 'active'
+                {client_filter}
+                LIMIT ?
+            ''', params + [batch_size])
+            batch_rows = cursor.rowcount
+            if batch_rows <= 0:
+                break
+            
+            restricted_at = datetime.now().isoformat()
+            
             # Restrict client access
             cursor.execute('''
                 UPDATE clients 
                 SET subscription_status = 'trial_expired', auto_restricted_at = ?
-                WHERE client_id = ?
-            ''', (datetime.now().isoformat(), client_id))
+                WHERE client_id IN (SELECT client_id FROM temp.expired_trial_batch)
+            ''', (restricted_at,))
             
-            # Restrict all users for this client
+            # Restrict all users for these clients
             cursor.execute('''
                 UPDATE client_users 
                 SET status = 'trial_expired', trial_restricted = 1
-                WHERE client_id = ?
-            ''', (client_id,))
+                WHERE client_id IN (SELECT client_id FROM temp.expired_trial_batch)
+            ''')
             
             # Deactivate all sessions
             cursor.execute('''
                 UPDATE user_sessions 
                 SET is_active = 0 
-                WHERE client_id = ?
-            ''', (client_id,))
+                WHERE client_id IN (SELECT client_id FROM temp.expired_trial_batch) AND is_active = 1
+            ''')
             
             # Update trial management
             cursor.execute('''
                 UPDATE trial_management 
                 SET status = 'expired', auto_restricted_at = ?
-                WHERE trial_id = ?
-            ''', (datetime.now().isoformat(), trial_id))
-            
-            print(f"Automatically restricted expired trial for {business_name}")
+                WHERE trial_id IN (SELECT trial_id FROM temp.expired_trial_batch)
+            ''', (restricted_at,))
             
-        except Exception as e:
-            print(f"Error restricting trial {trial_id}: {e}")
+            cursor.execute('SELECT DISTINCT client_id FROM temp.expired_trial_batch')
+            batch_clients = [row[0] for row in cursor.fetchall()]
+            refresh_entitlements(cursor, batch_clients)
+            cursor.execute('DELETE FROM temp.expired_trial_batch')
+        
+        batches.append({'size': len(batch_clients),
+                        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)})
+        restricted += len(batch_clients)
+        
+        # Restricted clients must not keep authorizing from cached records or session tokens
+        for client_id in batch_clients:
+            invalidate_client(client_id)
+        revoke_client_sessions(batch_clients)
+        
+        if batch_rows < batch_size:
+            break
     
-    conn.commit()
-    conn.close()
+    if restricted:
+        print(f"Automatically restricted {restricted} expired trials in {len(batches)} batches")
     
-    return len(expired_trials)
+    return {'restricted': restricted, 'batches': batches}
 
 def extend_trial(client_id, additional_hours, extended_by='admin'):
     """Extend an existing trial"""
     try:
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Get current trial info
-        cursor.execute('''
-            SELECT trial_end_time, trial_extended_count
-            FROM clients 
-            WHERE client_id = ? AND account_type = 'trial'
-        ''', (client_id,))
-        
-        result = cursor.fetchone()
-        if not result:
-            return {'success': False, 'error': 'Trial not found'}
-        
-        current_end_time, extension_count = result
-        current_end = datetime.fromisoformat(current_end_time)
-        new_end_time = current_end + timedelta(hours=additional_hours)
-        
-        # Update client trial end time
-        cursor.execute('''
-            UPDATE clients 
-            SET trial_end_time = ?, trial_extended_count = ?,
-                subscription_status = 'trial', auto_restricted_at = NULL
-            WHERE client_id = ?
-        ''', (new_end_time.isoformat(), extension_count + 1, client_id))
-        
-        # Reactivate users if they were restricted
-        cursor.execute('''
-            UPDATE client_users 
-            SET status = 'active', trial_restricted = 0
-            WHERE client_id = ? AND trial_restricted = 1
-        ''', (client_id,))
-        
-        # Update trial management
-        cursor.execute('''
-            UPDATE trial_management 
-            SET end_time = ?, extension_count = ?, status = 'active'
-            WHERE client_id = ?
-        ''', (new_end_time.isoformat(), extension_count + 1, client_id))
-        
-        # Schedule new notifications
-        cursor.execute('SELECT trial_id FROM trial_management WHERE client_id = ?', (client_id,))
-        trial_id = cursor.fetchone()[0]
-        
-        schedule_trial_notifications(client_id, trial_id, new_end_time, additional_hours)
-        schedule_automatic_restriction(client_id, trial_id, new_end_time)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get current trial info
+            cursor.execute('''
+                SELECT trial_end_time, trial_extended_count
+                FROM clients 
+                WHERE client_id = ? AND account_type = 'trial'
+            ''', (client_id,))
+            
+            result = cursor.fetchone()
+            if not result:
+                return {'success': False, 'error': 'Trial not found'}
+            
+            current_end_time, extension_count = result
+            current_end = datetime.fromisoformat(current_end_time)
+            new_end_time = current_end + timedelta(hours=additional_hours)
+            
+            # Update client trial end time
+            cursor.execute('''
+                UPDATE clients 
+                SET trial_end_time = ?, trial_extended_count = ?,
+                    subscription_status = 'trial', auto_restricted_at = NULL
+                WHERE client_id = ?
+            ''', (new_end_time.isoformat(), extension_count + 1, client_id))
+            
+            # Reactivate users if they were restricted
+            cursor.execute('''
+                UPDATE client_users 
+                SET status = 'active', trial_restricted = 0
+                WHERE client_id = ? AND trial_restricted = 1
+            ''', (client_id,))
+            
+            # Update trial management
+            cursor.execute('''
+                UPDATE trial_management 
+                SET end_time = ?, extension_count = ?, status = 'active'
+                WHERE client_id = ?
+            ''', (new_end_time.isoformat(), extension_count + 1, client_id))
+            
+            refresh_entitlements(cursor, [client_id])
+            
+            # Schedule new notifications
+            cursor.execute('SELECT trial_id FROM trial_management WHERE client_id = ?', (client_id,))
+            trial_id = cursor.fetchone()[0]
+            
+            schedule_trial_notifications(client_id, trial_id, new_end_time, additional_hours)
+            schedule_automatic_restriction(client_id, trial_id, new_end_time)
         
-        conn.commit()
-        conn.close()
+        invalidate_client(client_id)
+        trial_expiry.push(client_id, new_end_time)
         
         return {
             'success': True,
@@ -417,46 +338,48 @@ def extend_trial(client_id, additional_hours, extended_by='admin'):
 def convert_trial_to_full(client_id, plan_type='basic'):
     """Convert trial account to full paid account"""
     try:
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Update client to full account
-        max_users = {'basic': 5, 'professional': 15, 'enterprise': 50}.get(plan_type, 5)
-        
-        cursor.execute('''
-            UPDATE clients 
-            SET account_type = 'full', subscription_status = 'active', 
-                plan_type = ?, max_users = ?, conversion_date = ?
-            WHERE client_id = ?
-        ''', (plan_type, max_users, datetime.now().isoformat(), client_id))
-        
-        # Update trial management
-        cursor.execute('''
-            UPDATE trial_management 
-            SET status = 'converted', conversion_attempted = 1
-            WHERE client_id = ?
-        ''', (client_id,))
-        
-        # Upgrade user permissions to full access
-        full_permissions = {
-            'view_visitors': True,
-            'view_contact_info': True,
-            'view_email': True,
-            'view_phone': True,
-            'view_company': True,
-            'export_data': True,
-            'manage_users': True,
-            'view_audit_logs': True
-        }
-        
-        cursor.execute('''
-            UPDATE client_users 
-            SET permissions = ?, status = 'active', trial_restricted = 0
-            WHERE client_id = ? AND role = 'owner'
-        ''', (json.dumps(full_permissions), client_id))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Update client to full account
+            max_users = PLAN_LIMITS.get(plan_type, PLAN_LIMITS['basic'])['max_users']
+            
+            cursor.execute('''
+                UPDATE clients 
+                SET account_type = 'full', subscription_status = 'active', 
+                    plan_type = ?, max_users = ?, conversion_date = ?
+                WHERE client_id = ?
+            ''', (plan_type, max_users, datetime.now().isoformat(), client_id))
+            
+            # Update trial management
+            cursor.execute('''
+                UPDATE trial_management 
+                SET status = 'converted', conversion_attempted = 1
+                WHERE client_id = ?
+            ''', (client_id,))
+            
+            # Upgrade user permissions to full access
+            full_permissions = {
+                'view_visitors': True,
+                'view_contact_info': True,
+                'view_email': True,
+                'view_phone': True,
+                'view_company': True,
+                'export_data': True,
+                'manage_users': True,
+                'view_audit_logs': True
+            }
+            
+            cursor.execute('''
+                UPDATE client_users 
+                SET permissions = ?, status = 'active', trial_restricted = 0
+                WHERE client_id = ? AND role = 'owner'
+            ''', (json.dumps(full_permissions), client_id))
+            
+            refresh_entitlements(cursor, [client_id])
         
-        conn.commit()
-        conn.close()
+        invalidate_client(client_id)
+        trial_expiry.discard(client_id)
         
         return {'success': True, 'message': 'Trial converted to full account successfully'}
         
@@ -469,28 +392,62 @@ def create_automated_task(task_type, client_id=None, trial_id=None, scheduled_at
     if not scheduled_at:
         scheduled_at = datetime.now()
     
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO automated_tasks (task_id, task_type, client_id, trial_id, scheduled_at, task_data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (task_id, task_type, client_id, trial_id, scheduled_at.isoformat(), 
+              json.dumps(task_data) if task_data else None))
+    
+    return task_id
+
+# Automated task handlers (executed by the task worker process, see task_worker.py)
+@register_task('restrict_trial_access')
+def run_restrict_trial_access(task):
+    """Restrict a trial at its scheduled end (no-op if it was extended or converted)"""
+    return check_and_restrict_expired_trials([task['client_id']])
+
+@register_task('generate_demo_data')
+def run_generate_demo_data(task):
+    """Populate a new trial dashboard with sample visitors"""
+    count = (task['task_data'] or {}).get('count', 25)
+    first_names = ['Emma', 'Liam', 'Olivia', 'Noah', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Sophia', 'Mason']
+    last_names = ['Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Clark', 'Lewis']
+    companies = ['Acme Corp', 'Globex', 'Initech', 'Umbrella Ltd', 'Stark Industries', 'Wayne Enterprises']
+    pages = ['/', '/pricing', '/features', '/about', '/contact', '/blog']
     
-    cursor.execute('''
-        INSERT INTO automated_tasks (task_id, task_type, client_id, trial_id, scheduled_at, task_data)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (task_id, task_type, client_id, trial_id, scheduled_at.isoformat(), 
-          json.dumps(task_data) if task_data else None))
+    rows = []
+    for _ in range(count):
+        first, last = random.choice(first_names), random.choice(last_names)
+        company = random.choice(companies)
+        domain = company.lower().replace(' ', '') + '.com'
+        visited = random.sample(pages, random.randint(1, len(pages)))
+        rows.append((task['client_id'], f"demo_{uuid.uuid4().hex[:12]}", f"{first} {last}",
+                     f"{first.lower()}.{last.lower()}@{domain}", company, visited[-1], json.dumps(visited),
+                     random.randint(20, 900), random.choice(['High', 'Medium', 'Low']),
+                     random.choice(['Google', 'Direct', 'LinkedIn', 'Referral'])))
     
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO visitor_investigations 
+            (client_id, visitor_id, name, email, company, current_page, pages_visited,
+             time_on_site_seconds, interest_level, traffic_source)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
     
-    return task_id
+    return {'visitors_created': len(rows)}
 
 # Enhanced routes for trial management
 
-@app.route('/admin/trials')
+@bp.route('/admin/trials')
 def admin_trials():
     """Admin interface for trial management"""
     return render_template('admin_trials.html')
 
-@app.route('/api/create-trial', methods=['POST'])
+@bp.route('/api/create-trial', methods=['POST'])
 def create_trial():
     """Create a new trial account"""
     try:
@@ -519,56 +476,54 @@ def create_trial():
     except Exception as e:
         return jsonify({'error': f'Failed to create trial: {str(e)}'}), 500
 
-@app.route('/api/trials')
+@bp.route('/api/trials')
 def get_trials():
     """Get all trial accounts"""
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT c.client_id, c.business_name, c.contact_email, c.website_url,
-               c.trial_start_time, c.trial_end_time, c.trial_duration_hours,
-               c.trial_extended_count, c.subscription_status, c.auto_restricted_at,
-               c.conversion_date, tm.trial_id, tm.granted_by, tm.trial_type,
-               tm.status, tm.extension_count
-        FROM clients c
-        JOIN trial_management tm ON c.client_id = tm.client_id
-        WHERE c.account_type = 'trial'
-        ORDER BY c.created_at DESC
-    ''')
-    
-    trials = []
-    for row in cursor.fetchall():
-        trial_end = datetime.fromisoformat(row[5]) if row[5] else None
-        time_remaining = None
-        if trial_end and datetime.now() < trial_end:
-            time_remaining = int((trial_end - datetime.now()).total_seconds() / 3600)  # Hours remaining
-        
-        trials.append({
-            'client_id': row[0],
-            'business_name': row[1],
-            'contact_email': row[2],
-            'website_url': row[3],
-            'trial_start_time': row[4],
-            'trial_end_time': row[5],
-            'trial_duration_hours': row[6],
-            'trial_extended_count': row[7],
-            'subscription_status': row[8],
-            'auto_restricted_at': row[9],
-            'conversion_date': row[10],
-            'trial_id': row[11],
-            'granted_by': row[12],
-            'trial_type': row[13],
-            'status': row[14],
-            'extension_count': row[15],
-            'time_remaining_hours': time_remaining,
-            'is_expired': trial_end and datetime.now() >= trial_end if trial_end else False
-        })
-    
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT c.client_id, c.business_name, c.contact_email, c.website_url,
+                   c.trial_start_time, c.trial_end_time, c.trial_duration_hours,
+                   c.trial_extended_count, c.subscription_status, c.auto_restricted_at,
+                   c.conversion_date, tm.trial_id, tm.granted_by, tm.trial_type,
+                   tm.status, tm.extension_count
+            FROM clients c
+            JOIN trial_management tm ON c.client_id = tm.client_id
+            WHERE c.account_type = 'trial'
+            ORDER BY c.created_at DESC
+        ''')
+        
+        trials = []
+        for row in cursor.fetchall():
+            trial_end = datetime.fromisoformat(row[5]) if row[5] else None
+            time_remaining = None
+            if trial_end and datetime.now() < trial_end:
+                time_remaining = int((trial_end - datetime.now()).total_seconds() / 3600)  # Hours remaining
+            
+            trials.append({
+                'client_id': row[0],
+                'business_name': row[1],
+                'contact_email': row[2],
+                'website_url': row[3],
+                'trial_start_time': row[4],
+                'trial_end_time': row[5],
+                'trial_duration_hours': row[6],
+                'trial_extended_count': row[7],
+                'subscription_status': row[8],
+                'auto_restricted_at': row[9],
+                'conversion_date': row[10],
+                'trial_id': row[11],
+                'granted_by': row[12],
+                'trial_type': row[13],
+                'status': row[14],
+                'extension_count': row[15],
+                'time_remaining_hours': time_remaining,
+                'is_expired': trial_end and datetime.now() >= trial_end if trial_end else False
+            })
     return jsonify({'trials': trials})
 
-@app.route('/api/extend-trial/<client_id>', methods=['POST'])
+@bp.route('/api/extend-trial/<client_id>', methods=['POST'])
 def extend_trial_api(client_id):
     """Extend a trial period"""
     try:
@@ -589,7 +544,7 @@ def extend_trial_api(client_id):
     except Exception as e:
         return jsonify({'error': f'Failed to extend trial: {str(e)}'}), 500
 
-@app.route('/api/convert-trial/<client_id>', methods=['POST'])
+@bp.route('/api/convert-trial/<client_id>', methods=['POST'])
 def convert_trial_api(client_id):
     """Convert trial to full account"""
     try:
@@ -606,43 +561,46 @@ def convert_trial_api(client_id):
     except Exception as e:
         return jsonify({'error': f'Failed to convert trial: {str(e)}'}), 500
 
-@app.route('/api/restrict-trial/<client_id>', methods=['POST'])
+@bp.route('/api/restrict-trial/<client_id>', methods=['POST'])
 def restrict_trial_api(client_id):
     """Manually restrict a trial"""
     try:
-        conn = sqlite3.connect('client_management.db')
-        cursor = conn.cursor()
-        
-        # Restrict client access
-        cursor.execute('''
-            UPDATE clients 
-            SET subscription_status = 'trial_expired', auto_restricted_at = ?
-            WHERE client_id = ? AND account_type = 'trial'
-        ''', (datetime.now().isoformat(), client_id))
-        
-        # Restrict all users
-        cursor.execute('''
-            UPDATE client_users 
-            SET status = 'trial_expired', trial_restricted = 1
-            WHERE client_id = ?
-        ''', (client_id,))
-        
-        # Deactivate sessions
-        cursor.execute('''
-            UPDATE user_sessions 
-            SET is_active = 0 
-            WHERE client_id = ?
-        ''', (client_id,))
-        
-        # Update trial management
-        cursor.execute('''
-            UPDATE trial_management 
-            SET status = 'manually_restricted', auto_restricted_at = ?
-            WHERE client_id = ?
-        ''', (datetime.now().isoformat(), client_id))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Restrict client access
+            cursor.execute('''
+                UPDATE clients 
+                SET subscription_status = 'trial_expired', auto_restricted_at = ?
+                WHERE client_id = ? AND account_type = 'trial'
+            ''', (datetime.now().isoformat(), client_id))
+            
+            # Restrict all users
+            cursor.execute('''
+                UPDATE client_users 
+                SET status = 'trial_expired', trial_restricted = 1
+                WHERE client_id = ?
+            ''', (client_id,))
+            
+            # Deactivate sessions
+            cursor.execute('''
+                UPDATE user_sessions 
+                SET is_active = 0 
+                WHERE client_id = ?
+            ''', (client_id,))
+            
+            # Update trial management
+            cursor.execute('''
+                UPDATE trial_management 
+                SET status = 'manually_restricted', auto_restricted_at = ?
+                WHERE client_id = ?
+            ''', (datetime.now().isoformat(), client_id))
+            
+            refresh_entitlements(cursor, [client_id])
         
-        conn.commit()
-        conn.close()
+        invalidate_client(client_id)
+        revoke_client_sessions([client_id])
+        trial_expiry.discard(client_id)
         
         return jsonify({'success': True, 'message': 'Trial access restricted successfully'})
         
@@ -650,88 +608,22 @@ def restrict_trial_api(client_id):
         return jsonify({'error': f'Failed to restrict trial: {str(e)}'}), 500
 
 # Enhanced user access verification with trial checking
-def verify_user_access_with_trial(access_token, ip_address=None, user_agent=None):
-    """Verify user access with trial expiration checking"""
-    from country_access_control import verify_user_access
+def verify_user_access_with_trial(access_token, ip_address=None, user_agent=None, include_trial_remaining=True):
+    """Verify user access with trial expiration checking.
     
-    # First do standard verification
-    user_data = verify_user_access(access_token, ip_address, user_agent)
-    
-    if not user_data:
-        return None
-    
-    # Check if this is a trial account
-    conn = sqlite3.connect('client_management.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT account_type, trial_end_time, subscription_status
-        FROM clients 
-        WHERE client_id = ?
-    ''', (user_data['client_id'],))
-    
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        account_type, trial_end_time, subscription_status = result
-        
-        if account_type == 'trial':
-            # Check if trial has expired
-            if trial_end_time:
-                trial_end = datetime.fromisoformat(trial_end_time)
-                if datetime.now() >= trial_end:
-                    # Trial has expired, restrict access
-                    return None
-            
-            # Add trial info to user data
-            user_data['account_type'] = 'trial'
-            user_data['trial_end_time'] = trial_end_time
-            user_data['is_trial'] = True
-            
-            if trial_end_time:
-                trial_end = datetime.fromisoformat(trial_end_time)
-                time_remaining = trial_end - datetime.now()
-                user_data['trial_hours_remaining'] = max(0, int(time_remaining.total_seconds() / 3600))
-        else:
-            user_data['account_type'] = 'full'
-            user_data['is_trial'] = False
-    
-    return user_data
-
-# Background task to check expired trials
-def run_trial_monitor():
-    """Background task to monitor and restrict expired trials"""
-    while True:
-        try:
-            restricted_count = check_and_restrict_expired_trials()
-            if restricted_count > 0:
-                print(f"Automatically restricted {restricted_count} expired trials")
-        except Exception as e:
-            print(f"Error in trial monitor: {e}")
-        
-        time.sleep(3600)  # Check every hour
+    Trial state comes from the same authorization query as the country and
+    permission checks; expired trials are rejected there.
+    """
+    return verify_user_access(access_token, ip_address, user_agent, include_trial_remaining=include_trial_remaining)
 
-# Start background trial monitor
-trial_monitor_thread = threading.Thread(target=run_trial_monitor, daemon=True)
-trial_monitor_thread.start()
-
-@app.route('/health')
-def health_check():
-    """Health check endpoint with trial monitoring"""
-    # Run trial check on health check
-    restricted_count = check_and_restrict_expired_trials()
-    
-    return jsonify({
-        'status': 'healthy', 
-        'timestamp': datetime.now().isoformat(),
-        'trials_restricted': restricted_count
-    })
+# Restrict trials at their deadlines; one worker per deployment holds the scheduler lease
+trial_expiry = TrialExpiryScheduler(check_and_restrict_expired_trials)
 
-if __name__ == '__main__':
-    print("🚀 Starting Enhanced Trial Management System")
-    print("📝 Onboarding Form: http://localhost:5000/onboard")
-    print("⚙️ Admin Trials: http://localhost:5000/admin/trials")
-    print("🕐 Features: Flexible trials, automatic restrictions, trial extensions")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+@on_startup
+def start_trial_expiry():
+    if SCHEDULER_CONFIG['enabled']:
+        trial_expiry.start()
 
+def health_metrics():
+    """Trial scheduler and task queue status for the application health check"""
+    return {'trial_expiry': trial_expiry.stats(), 'task_queue': task_queue_metrics()}